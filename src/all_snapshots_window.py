@@ -0,0 +1,84 @@
+from gi.repository import Gtk, Adw, GLib, Gdk, Gio
+from .common import myUtils
+from .snapshot_catalog import SnapshotCatalog
+import os
+import pathlib
+
+@Gtk.Template(resource_path="/io/github/flattool/Warehouse/../data/ui/all_snapshots.ui")
+class AllSnapshotsWindow(Adw.Window):
+    __gtype_name__ = "AllSnapshotsWindow"
+
+    main_stack = Gtk.Template.Child()
+    outerbox = Gtk.Template.Child()
+    apps_list = Gtk.Template.Child()
+    no_snapshots = Gtk.Template.Child()
+    open_folder_button = Gtk.Template.Child()
+    title_widget = Gtk.Template.Child()
+
+    host_home = str(pathlib.Path.home())
+    snapshots_path = host_home + "/.var/app/io.github.flattool.Warehouse/data/Snapshots/"
+
+    def key_handler(self, _a, event, _c, _d):
+        if event == Gdk.KEY_Escape:
+            self.close()
+
+    def open_button_handler(self, widget):
+        try:
+            Gio.AppInfo.launch_default_for_uri(f"file://{self.snapshots_path}", None)
+        except GLib.GError as e:
+            print("error in all_snapshots_window.open_button_handler:", e)
+
+    def setIcon(self, image, texture):
+        if texture != None:
+            image.set_from_paintable(texture)
+
+    def generateList(self):
+        apps = self.catalog.apps()
+        if len(apps) == 0:
+            self.title_widget.set_subtitle("")
+            self.main_stack.set_visible_child(self.no_snapshots)
+            return
+
+        total = sum(self.catalog.totalSize(records) for records in apps.values())
+        self.title_widget.set_subtitle(_("{} of snapshots").format(self.my_utils.getSizeFormat(total)))
+        # Apps using the most space first
+        for app_id, records in sorted(apps.items(), key=lambda app: -self.catalog.totalSize(app[1])):
+            self.create_app_row(app_id, records)
+        self.main_stack.set_visible_child(self.outerbox)
+
+    def create_app_row(self, app_id, records):
+        app_row = Adw.ExpanderRow(title=GLib.markup_escape_text(records[-1]["app_name"]))
+        app_row.set_subtitle(_("{} snapshots, ~{}").format(len(records), self.my_utils.getSizeFormat(self.catalog.totalSize(records))))
+        image = Gtk.Image(icon_name="application-x-executable-symbolic", pixel_size=32)
+        app_row.add_prefix(image)
+        self.my_utils.findAppIcon(app_id, lambda texture: self.setIcon(image, texture), image.get_pixel_size())
+
+        for record in reversed(records):
+            row = Adw.ActionRow(title=GLib.DateTime.new_from_unix_local(record["created"]).format("%x %X"))
+            subtitle = f"~{self.my_utils.getSizeFormat(record['compressed_size'])}"
+            if record["file_count"] != None:
+                subtitle = _("{}, {} files").format(subtitle, record["file_count"])
+            row.set_subtitle(subtitle)
+            row.add_suffix(Gtk.Label(label=_("Version {}").format(record["version"]), wrap=True, justify=Gtk.Justification.RIGHT))
+            app_row.add_row(row)
+        self.apps_list.append(app_row)
+
+    def __init__(self, parent_window, **kwargs):
+        super().__init__(**kwargs)
+        self.my_utils = myUtils(self)
+        self.catalog = SnapshotCatalog.getShared(self.snapshots_path)
+
+        self.open_folder_button.set_sensitive(os.path.exists(self.snapshots_path))
+        self.open_folder_button.connect("clicked", self.open_button_handler)
+
+        event_controller = Gtk.EventControllerKey()
+        event_controller.connect("key-pressed", self.key_handler)
+        self.add_controller(event_controller)
+
+        self.set_title(_("Snapshots"))
+        self.set_transient_for(parent_window)
+        self.set_size_request(260, 230)
+
+        # Only app folders that changed since the catalog last saw them are listed
+        task = Gio.Task.new(None, None, lambda *_: self.generateList())
+        task.run_in_thread(lambda *_: self.catalog.refreshAll())
@@ -1,26 +1,43 @@
-import os
 import pathlib
 import subprocess
 import re
 
-from gi.repository import Adw, Gdk, Gio, GLib, Gtk
+from gi.repository import Adw, Gdk, Gio, GLib, GObject, Gtk
 from .properties_window import PropertiesWindow
-from .downgrade_window import DowngradeWindow
-from .snapshots_window import SnapshotsWindow
 from .filter_window import FilterWindow
 from .common import myUtils
 
+class FlatpakItem(GObject.Object):
+    """One installed ref in the main list's model. Rows are only created for the items on screen."""
+    __gtype_name__ = "FlatpakItem"
+
+    selected = GObject.Property(type=bool, default=False)
+    masked = GObject.Property(type=bool, default=False)
+    has_data = GObject.Property(type=bool, default=False)
+
+    def __init__(self, flatpak_row, key, signature, is_masked, is_runtime_eol, has_data, **kwargs):
+        super().__init__(**kwargs)
+        self.flatpak_row = flatpak_row
+        self.key = key
+        self.signature = signature
+        self.app_name = flatpak_row[0]
+        self.app_id = flatpak_row[2]
+        self.origin_remote = flatpak_row[6]
+        self.install_type = flatpak_row[7]
+        self.app_ref = flatpak_row[8]
+        self.dependent_runtime = flatpak_row[13]
+        self.is_runtime = len(flatpak_row[13]) == 0
+        self.is_eol = "eol" in flatpak_row[12]
+        self.is_runtime_eol = is_runtime_eol
+        self.masked = is_masked
+        self.has_data = has_data
+
 class AppRow(Adw.ActionRow):
+    """A recycled row of the main list, showing whichever `FlatpakItem` is bound to it."""
 
     def set_selectable(self, is_selectable):
-        self.tickbox.set_active(False)
         self.tickbox.set_visible(is_selectable)
         self.row_menu.set_visible(not is_selectable)
-        self.set_activatable(is_selectable)
-
-    def set_is_visible(self, is_visible):
-        self.set_visible(is_visible)
-        self.set_selectable(False)
 
     def info_button_show_or_hide(self):
         self.info_button.set_visible(False)
@@ -38,49 +55,103 @@ class AppRow(Adw.ActionRow):
         self.mask_label.set_visible(is_masked)
         self.info_button_show_or_hide()
 
-    def __init__(self, parent_window, host_flatpaks, index, **kwargs):
-        super().__init__(**kwargs)
-        self.my_utils = myUtils(parent_window)
+    def itemChangedHandler(self, *_args):
+        self.set_masked(self.item.masked)
 
-        current_flatpak = host_flatpaks[index]
+    def setIcon(self, item, texture):
+        if self.item is not item:
+            return # The row was recycled for another item before the icon loaded
+        if texture == None:
+            self.icon.set_from_icon_name("application-x-executable-symbolic")
+            self.icon.remove_css_class("icon-dropshadow")
+        else:
+            self.icon.set_from_paintable(texture)
+            self.icon.add_css_class("icon-dropshadow")
+
+    def bind(self, item):
+        self.item = item
+        self.set_title(item.app_name)
+        self.set_subtitle(item.app_id)
+
+        self.setIcon(item, None)
+        self.my_utils.findAppIcon(item.app_id, lambda texture: self.setIcon(item, texture))
+
+        # EOL = End Of Life, meaning the app or its runtime will not be updated
+        self.mask_label.set_tooltip_text(_("{} is masked and will not be updated").format(item.app_name))
+        self.eol_app_label.set_tooltip_text(_("{} has reached its End of Life and will not receive any security updates").format(item.app_name))
+        self.eol_app_label.set_visible(item.is_eol)
+        self.eol_runtime_label.set_tooltip_text(_("{}'s runtime has reached its End of Life and will not receive any security updates").format(item.app_name))
+        self.eol_runtime_label.set_visible(item.dependent_runtime in self.parent_window.eol_list)
+
+        self.selected_binding = item.bind_property("selected", self.tickbox, "active", GObject.BindingFlags.BIDIRECTIONAL | GObject.BindingFlags.SYNC_CREATE)
+        self.item_handler = item.connect("notify", self.itemChangedHandler)
+        self.itemChangedHandler()
+        self.set_selectable(self.parent_window.in_batch_mode)
+
+    def unbind(self):
+        self.selected_binding.unbind()
+        self.item.disconnect(self.item_handler)
+        self.item = None
+
+    def add_menu_item(self, menu, label, action, hide_when_disabled=False):
+        menu_item = Gio.MenuItem.new(label, None)
+        menu_item.set_action_and_target_value(f"win.{action}", GLib.Variant.new_string(self.item.key))
+        if hide_when_disabled:
+            menu_item.set_attribute_value("hidden-when", GLib.Variant.new_string("action-disabled"))
+        menu.append_item(menu_item)
+
+    def create_menu(self, menu_button):
+        # Built when opened, so the menu targets the bound item and its state is current
+        self.parent_window.update_item_actions(self.item)
 
-        self.index = index
-        self.app_name = current_flatpak[0]
-        self.app_id = current_flatpak[2]
-        self.origin_remote = current_flatpak[6]
-        self.install_type = current_flatpak[7]
-        self.app_ref = current_flatpak[8]
-        self.dependent_runtime = current_flatpak[13]
+        row_menu_model = Gio.Menu()
+        copy_menu_model = Gio.Menu()
+        data_menu_model = Gio.Menu()
+        advanced_menu_model = Gio.Menu()
 
-        self.set_title(self.app_name)
-        self.set_subtitle(self.app_id)
-        self.add_prefix(self.my_utils.findAppIcon(self.app_id))
+        self.add_menu_item(copy_menu_model, _("Copy Name"), "copy-name")
+        self.add_menu_item(copy_menu_model, _("Copy ID"), "copy-id")
+        self.add_menu_item(copy_menu_model, _("Copy Ref"), "copy-ref")
+        self.add_menu_item(copy_menu_model, _("Copy Launch Command"), "copy-command")
+        row_menu_model.append_submenu(_("Copy"), copy_menu_model)
+
+        self.add_menu_item(row_menu_model, _("Open"), "run", True)
+        self.add_menu_item(row_menu_model, _("Uninstall"), "uninstall")
+
+        self.add_menu_item(data_menu_model, _("Open User Data Folder"), "open-data", True)
+        self.add_menu_item(data_menu_model, _("Trash User Data"), "trash", True)
+        row_menu_model.append_section(None, data_menu_model)
+
+        self.add_menu_item(advanced_menu_model, _("Disable Updates"), "mask", True)
+        self.add_menu_item(advanced_menu_model, _("Enable Updates"), "unmask", True)
+        self.add_menu_item(advanced_menu_model, _("Manage Snapshots"), "snapshot", True)
+        self.add_menu_item(advanced_menu_model, _("Downgrade"), "downgrade")
+        row_menu_model.append_section(None, advanced_menu_model)
 
-        self.is_runtime = False
-        if len(current_flatpak[13]) == 0:
-            self.is_runtime = True
+        menu_button.set_menu_model(row_menu_model)
+
+    def __init__(self, parent_window, **kwargs):
+        super().__init__(**kwargs)
+        self.my_utils = myUtils(parent_window)
+        self.parent_window = parent_window
+        self.item = None
+
+        self.icon = Gtk.Image(icon_size=Gtk.IconSize.LARGE)
+        self.add_prefix(self.icon)
 
         info_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, valign=Gtk.Align.CENTER, halign=Gtk.Align.CENTER, hexpand=True, vexpand=True, spacing=6)
 
         # justify=Gtk.Justification.RIGHT
-        self.mask_label = Gtk.Label(label=_("Updates Disabled"), visible=False, hexpand=True, wrap=True, valign=Gtk.Align.CENTER, tooltip_text=_("{} is masked and will not be updated").format(self.app_name))
+        self.mask_label = Gtk.Label(label=_("Updates Disabled"), visible=False, hexpand=True, wrap=True, valign=Gtk.Align.CENTER)
         self.mask_label.add_css_class("warning")
 
-        self.eol_app_label = Gtk.Label(label=_("App EOL"), visible=False, hexpand=True, wrap=True, valign=Gtk.Align.CENTER, tooltip_text=_("{} has reached its End of Life and will not receive any security updates").format(self.app_name))
+        self.eol_app_label = Gtk.Label(label=_("App EOL"), visible=False, hexpand=True, wrap=True, valign=Gtk.Align.CENTER)
         self.eol_app_label.add_css_class("error")
         info_box.append(self.eol_app_label)
-        if "eol" in parent_window.host_flatpaks[index][12]:
-            # EOL = End Of Life, meaning the app will not be updated
-            # justify=Gtk.Justification.RIGHT
-            self.eol_app_label.set_visible(True)
 
-        self.eol_runtime_label = Gtk.Label(label=_("Runtime EOL"), visible=False, hexpand=True, wrap=True, valign=Gtk.Align.CENTER, tooltip_text=_("{}'s runtime has reached its End of Life and will not receive any security updates").format(self.app_name))
+        self.eol_runtime_label = Gtk.Label(label=_("Runtime EOL"), visible=False, hexpand=True, wrap=True, valign=Gtk.Align.CENTER)
         self.eol_runtime_label.add_css_class("error")
         info_box.append(self.eol_runtime_label)
-        if current_flatpak[13] in parent_window.eol_list:
-            # EOL = End Of Life, meaning the runtime will not be updated
-            # justify=Gtk.Justification.RIGHT
-            self.eol_runtime_label.set_visible(True)
 
         info_pop = Gtk.Popover()
         info_pop.set_child(info_box)
@@ -92,90 +163,14 @@ class AppRow(Adw.ActionRow):
 
         properties_button = Gtk.Button(icon_name="info-symbolic", valign=Gtk.Align.CENTER, tooltip_text=_("View Properties"))
         properties_button.add_css_class("flat")
-        properties_button.connect("clicked", lambda *_: PropertiesWindow(index, host_flatpaks, parent_window))
+        properties_button.connect("clicked", lambda *_: PropertiesWindow(parent_window.host_flatpaks.index(self.item.flatpak_row), parent_window.host_flatpaks, parent_window))
         self.add_suffix(properties_button)
-        
+
         self.tickbox = Gtk.CheckButton(visible=False) # visible=self.in_batch_mode
         self.tickbox.add_css_class("selection-mode")
-        self.tickbox.connect("toggled", parent_window.rowSelectHandler)
         self.add_suffix(self.tickbox)
-        self.set_activatable_widget(self.tickbox)
-        self.set_activatable(False)
 
         self.row_menu = Gtk.MenuButton(icon_name="view-more-symbolic", valign=Gtk.Align.CENTER) # visible=not self.in_batch_mode
         self.row_menu.add_css_class("flat")
-        row_menu_model = Gio.Menu()
-        copy_menu_model = Gio.Menu()
-        advanced_menu_model = Gio.Menu()
+        self.row_menu.set_create_popup_func(self.create_menu)
         self.add_suffix(self.row_menu)
-
-        parent_window.create_action(("copy-name" + str(index)), lambda *_, name=self.app_name, toast=_("Copied name"): parent_window.copyItem(name, toast))
-        copy_menu_model.append_item(Gio.MenuItem.new(_("Copy Name"), f"win.copy-name{index}"))
-
-        parent_window.create_action(("copy-id" + str(index)), lambda *_, id=self.app_id, toast=_("Copied ID"): parent_window.copyItem(id, toast))
-        copy_menu_model.append_item(Gio.MenuItem.new(_("Copy ID"), f"win.copy-id{index}"))
-
-        parent_window.create_action(("copy-ref" + str(index)), lambda *_, ref=self.app_ref, toast=_("Copied ref"): parent_window.copyItem(ref, toast))
-        copy_menu_model.append_item(Gio.MenuItem.new(_("Copy Ref"), f"win.copy-ref{index}"))
-
-        parent_window.create_action(("copy-command" + str(index)), lambda *_, ref=self.app_ref, toast=_("Copied launch command"): parent_window.copyItem(f"flatpak run {ref}", toast))
-        copy_menu_model.append_item(Gio.MenuItem.new(_("Copy Launch Command"), f"win.copy-command{index}"))
-
-        row_menu_model.append_submenu(_("Copy"), copy_menu_model)
-
-        if "runtime" not in parent_window.host_flatpaks[index][12]:
-            parent_window.create_action(("run" + str(index)), lambda *_a, ref=self.app_ref, name=self.app_name: parent_window.runAppThread(ref, _("Opened {}").format(name)))
-            run_item = Gio.MenuItem.new(_("Open"), f"win.run{index}")
-            row_menu_model.append_item(run_item)
-
-        parent_window.create_action(("uninstall" + str(index)), lambda *_: parent_window.uninstallButtonHandler(self, self.app_name, self.app_ref, self.app_id))
-        uninstall_item = Gio.MenuItem.new(_("Uninstall"), f"win.uninstall{index}")
-        row_menu_model.append_item(uninstall_item)
-
-        data_menu_model = Gio.Menu()
-
-        parent_window.create_action(("open-data" + str(index)), lambda *_, path=(parent_window.user_data_path + self.app_id): parent_window.openDataFolder(path))
-        open_data_item = Gio.MenuItem.new(_("Open User Data Folder"), f"win.open-data{index}")
-        open_data_item.set_attribute_value("hidden-when", GLib.Variant.new_string("action-disabled"))
-        data_menu_model.append_item(open_data_item)
-
-        parent_window.create_action(("trash" + str(index)), lambda *_, name=self.app_name, id=self.app_id, index=index: parent_window.trashData(name, id, index))
-        trash_item = Gio.MenuItem.new(_("Trash User Data"), f"win.trash{index}")
-        trash_item.set_attribute_value("hidden-when", GLib.Variant.new_string("action-disabled"))
-        data_menu_model.append_item(trash_item)
-
-        row_menu_model.append_section(None, data_menu_model)
-        
-        if not os.path.exists(parent_window.user_data_path + self.app_id):
-            parent_window.lookup_action(f"open-data{self.index}").set_enabled(False)
-            parent_window.lookup_action(f"trash{self.index}").set_enabled(False)
-
-        parent_window.create_action(("mask" + str(index)), lambda *_, id=self.app_id, type=self.install_type, index=index: parent_window.maskFlatpak(self))
-        mask_item = Gio.MenuItem.new(_("Disable Updates"), f"win.mask{index}")
-        mask_item.set_attribute_value("hidden-when", GLib.Variant.new_string("action-disabled"))
-        advanced_menu_model.append_item(mask_item)
-
-        parent_window.create_action(("unmask" + str(index)), lambda *_, id=self.app_id, type=self.install_type, index=index: parent_window.maskFlatpak(self))
-        unmask_item = Gio.MenuItem.new(_("Enable Updates"), f"win.unmask{index}")
-        unmask_item.set_attribute_value("hidden-when", GLib.Variant.new_string("action-disabled"))
-        advanced_menu_model.append_item(unmask_item)
-
-        if "runtime" not in parent_window.host_flatpaks[index][12]:
-            parent_window.create_action(("snapshot" + str(index)), lambda *_, row=current_flatpak: SnapshotsWindow(parent_window, row).present())
-            snapshot_item = Gio.MenuItem.new(_("Manage Snapshots"), f"win.snapshot{index}")
-            advanced_menu_model.append_item(snapshot_item)
-
-        parent_window.create_action(("downgrade" + str(index)), lambda *_, row=current_flatpak, index=index: DowngradeWindow(parent_window, row, index))
-        downgrade_item = Gio.MenuItem.new(_("Downgrade"), f"win.downgrade{index}")
-        advanced_menu_model.append_item(downgrade_item)
-
-        if self.app_id in parent_window.system_mask_list or self.app_id in parent_window.user_mask_list:
-            self.mask_label.set_visible(True)
-            parent_window.lookup_action(f"mask{index}").set_enabled(False)
-        else:
-            parent_window.lookup_action(f"unmask{index}").set_enabled(False)
-
-        row_menu_model.append_section(None, advanced_menu_model)
-        self.row_menu.set_menu_model(row_menu_model)
-
-        self.info_button_show_or_hide()
@@ -0,0 +1,175 @@
+from gi.repository import GLib
+from xml.etree import ElementTree
+import difflib
+import gzip
+import os
+import pathlib
+
+class AppstreamEntry:
+    def __init__(self, app_id, name, summary, keywords, version, branch, remote):
+        self.app_id = app_id
+        self.name = name
+        self.summary = summary
+        self.keywords = keywords
+        self.version = version
+        self.branch = branch
+        self.remote = remote
+        # Lowercased once here, so queries don't have to
+        self.words = set((name + " " + app_id.replace(".", " ") + " " + keywords).lower().split())
+        self.text = f"{app_id}\t{name}\t{summary}\t{keywords}".lower()
+
+    def row(self):
+        # Same columns as `flatpak search --columns=all`
+        return [self.name, self.summary, self.app_id, self.version, self.branch, self.remote]
+
+class AppstreamIndex:
+    """An offline search index over the appstream data Flatpak keeps for every remote.
+
+    Each remote's `appstream.xml.gz` is parsed as a stream, and the id, name,
+    summary, keywords, version and branch of every component are saved to a
+    small tab separated file in the user cache. That file is named after the
+    appstream commit, so the XML is only parsed again after the remote's
+    appstream data was updated.
+    """
+
+    host_home = str(pathlib.Path.home())
+    installations = [
+        ["system", "/var/lib/flatpak"],
+        ["user", host_home + "/.local/share/flatpak"],
+    ]
+    index_dir = os.path.join(GLib.get_user_cache_dir(), "warehouse", "appstream")
+    fuzzy_cutoff = 0.8
+
+    def __init__(self):
+        self.entries = []
+
+    def is_empty(self):
+        return len(self.entries) == 0
+
+    def load(self):
+        """Reads or builds the index of every remote. This does file IO, so call it from a thread."""
+        entries = []
+        wanted_files = set()
+        for installation, installation_path in self.installations:
+            appstream_path = os.path.join(installation_path, "appstream")
+            try:
+                remotes = os.listdir(appstream_path)
+            except OSError:
+                continue
+            for remote in remotes:
+                try:
+                    arches = os.listdir(os.path.join(appstream_path, remote))
+                except OSError:
+                    continue
+                for arch in arches:
+                    active_path = os.path.join(appstream_path, remote, arch, "active")
+                    try:
+                        commit = os.path.basename(os.readlink(active_path))
+                    except OSError:
+                        continue
+                    index_file = os.path.join(self.index_dir, f"{installation}-{remote}-{arch}-{commit}.tsv")
+                    wanted_files.add(os.path.basename(index_file))
+                    entries += self.loadRemote(os.path.join(active_path, "appstream.xml.gz"), index_file, remote)
+        self.removeOldIndexes(wanted_files)
+        self.entries = entries
+        return self
+
+    def loadRemote(self, xml_path, index_file, remote):
+        if not os.path.exists(index_file):
+            try:
+                self.buildRemote(xml_path, index_file)
+            except (OSError, ElementTree.ParseError, EOFError) as e:
+                print("error in appstream_index.AppstreamIndex.loadRemote: could not index", xml_path, e)
+                return []
+        entries = []
+        with open(index_file, "r") as file:
+            for line in file:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 6:
+                    entries.append(AppstreamEntry(*fields, remote))
+        return entries
+
+    def buildRemote(self, xml_path, index_file):
+        os.makedirs(self.index_dir, exist_ok=True)
+        temp_path = index_file + ".tmp"
+        with gzip.open(xml_path, "rb") as xml_file, open(temp_path, "w") as file:
+            # Components are handled and dropped one at a time, the whole tree is never in memory
+            for event, element in ElementTree.iterparse(xml_file, events=["end"]):
+                if element.tag != "component":
+                    continue
+                fields = self.readComponent(element)
+                element.clear()
+                if fields != None:
+                    file.write("\t".join(field.replace("\t", " ").replace("\n", " ") for field in fields) + "\n")
+        os.replace(temp_path, index_file)
+
+    def readComponent(self, component):
+        app_id = component.findtext("id", "").strip()
+        if app_id == "":
+            return None
+        app_id = app_id.removesuffix(".desktop")
+        # Untranslated elements have no xml:lang attribute
+        name = self.findUntranslated(component, "name") or app_id
+        summary = self.findUntranslated(component, "summary")
+        keywords = " ".join(keyword.text.strip() for keyword in component.iter("keyword") if keyword.text and len(keyword.attrib) == 0)
+        version = ""
+        release = component.find("releases/release")
+        if release != None:
+            version = release.get("version", "")
+        branch = ""
+        bundle = component.findtext("bundle", "").strip()
+        if bundle.count("/") == 3:
+            branch = bundle.split("/")[3]
+        return [app_id, name.strip(), summary.strip(), keywords, version, branch]
+
+    def findUntranslated(self, component, tag):
+        for element in component.findall(tag):
+            if len(element.attrib) == 0 and element.text:
+                return element.text
+        return ""
+
+    def removeOldIndexes(self, wanted_files):
+        try:
+            names = os.listdir(self.index_dir)
+        except OSError:
+            return
+        for name in names:
+            if name not in wanted_files:
+                try:
+                    os.remove(os.path.join(self.index_dir, name))
+                except OSError as e:
+                    print("error in appstream_index.AppstreamIndex.removeOldIndexes:", e)
+
+    def score(self, entry, term):
+        if term == entry.app_id.lower() or term == entry.name.lower():
+            return 100
+        if entry.name.lower().startswith(term):
+            return 80
+        for word in entry.words:
+            if word.startswith(term):
+                return 60
+        if term in entry.text:
+            return 30
+        if len(term) > 3 and len(difflib.get_close_matches(term, entry.words, 1, self.fuzzy_cutoff)) > 0:
+            return 10 # A typo of one of the entry's words
+        return 0
+
+    def search(self, query, remotes=None):
+        """Returns `flatpak search` style rows for every entry that matches all the words of `query`, best first."""
+        terms = query.lower().split()
+        if len(terms) == 0:
+            return []
+        results = []
+        for entry in self.entries:
+            if remotes and entry.remote not in remotes:
+                continue
+            total = 0
+            for term in terms:
+                score = self.score(entry, term)
+                if score == 0:
+                    break
+                total += score
+            else:
+                results.append((total, entry))
+        results.sort(key=lambda result: (-result[0], result[1].name.lower()))
+        return [entry.row() for _score, entry in results]
@@ -0,0 +1,374 @@
+from .snapshot_engine import SnapshotEngine
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import fcntl
+import gzip
+import hashlib
+import json
+import os
+import stat
+import tempfile
+import time
+import zlib
+
+class ChunkStore:
+    """Compressed chunks of snapshot data, stored once by their hash and shared by the snapshots of every app.
+
+    A chunked snapshot is only a manifest in the app's snapshots folder, listing
+    its files and the chunks they are made of. Chunks live in a hidden folder
+    next to the apps' folders, so two snapshots, or two apps, holding the same
+    data store it once. Snapshots being written hold a shared lock on the
+    store and garbage collection an exclusive one, so a chunk a new snapshot
+    reuses can't be removed before its manifest is written.
+    """
+
+    manifest_suffix = ".chunks.json.gz"
+    compression_level = 3
+
+    def __init__(self, snapshots_path):
+        self.snapshots_path = snapshots_path
+        self.path = os.path.join(snapshots_path, ".chunks")
+        self.lock_path = os.path.join(snapshots_path, ".chunks.lock")
+
+    @contextmanager
+    def locked(self, exclusive=False):
+        # flock() locks are per open file, so threads of one Warehouse exclude each other like other processes do
+        os.makedirs(self.snapshots_path, exist_ok=True)
+        with open(self.lock_path, "a") as file:
+            fcntl.flock(file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            try:
+                yield
+            finally:
+                fcntl.flock(file, fcntl.LOCK_UN)
+
+    def chunkPath(self, chunk_id):
+        return os.path.join(self.path, chunk_id[:2], chunk_id[2:])
+
+    def has(self, chunk_id):
+        return os.path.exists(self.chunkPath(chunk_id))
+
+    def write(self, chunk_id, data):
+        """Compresses and stores a chunk, returns the bytes it added on disk. Safe to call from many threads and processes."""
+        path = self.chunkPath(chunk_id)
+        if os.path.exists(path):
+            return 0 # Another snapshot being made at the same time wrote it first
+        # zlib releases the GIL while it works, so chunks compress in parallel
+        compressed = zlib.compress(data, self.compression_level)
+        if len(compressed) < len(data):
+            payload = b"z" + compressed
+        else:
+            payload = b"r" + data # Already compressed data would only grow
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Snapshots only share the lock, so each writer needs its own temp file
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as file:
+                file.write(payload)
+            os.replace(temp_path, path)
+        except OSError:
+            os.remove(temp_path)
+            raise
+        return len(payload)
+
+    def read(self, chunk_id):
+        with open(self.chunkPath(chunk_id), "rb") as file:
+            payload = file.read()
+        if payload[:1] == b"z":
+            return zlib.decompress(payload[1:])
+        return payload[1:]
+
+    def readManifest(self, path):
+        with gzip.open(path, "rt") as file:
+            return json.load(file)
+
+    def writeManifest(self, path, manifest):
+        """Writes a manifest, returns the checksum of the file written."""
+        payload = gzip.compress(json.dumps(manifest, separators=(",", ":")).encode(), compresslevel=6)
+        with open(path + ".tmp", "wb") as file:
+            file.write(payload)
+        os.replace(path + ".tmp", path)
+        return hashlib.blake2b(payload, digest_size=32).hexdigest()
+
+    def manifestPaths(self):
+        paths = []
+        for app_id in os.listdir(self.snapshots_path):
+            app_path = os.path.join(self.snapshots_path, app_id)
+            if app_id.startswith(".") or not os.path.isdir(app_path):
+                continue
+            paths += [os.path.join(app_path, name) for name in os.listdir(app_path) if name.endswith(self.manifest_suffix)]
+        return paths
+
+    def collectGarbage(self):
+        """Removes the chunks no manifest refers to, returns the bytes freed. Does file IO, so call it from a thread."""
+        try:
+            with self.locked(exclusive=True):
+                return self.removeUnreferenced()
+        except OSError as e:
+            print("error in chunk_store.ChunkStore.collectGarbage: could not lock the store:", e)
+            return 0
+
+    def removeUnreferenced(self):
+        started = time.time()
+        referenced = set()
+        try:
+            for path in self.manifestPaths():
+                for entry in self.readManifest(path)["entries"]:
+                    referenced.update(entry.get("chunks", []))
+        except (OSError, ValueError, KeyError) as e:
+            # Without every manifest there's no telling which chunks are still needed
+            print("error in chunk_store.ChunkStore.collectGarbage: not collecting, could not read manifests:", e)
+            return 0
+
+        freed = 0
+        try:
+            prefixes = os.listdir(self.path)
+        except OSError:
+            return 0
+        for prefix in prefixes:
+            prefix_path = os.path.join(self.path, prefix)
+            try:
+                names = os.listdir(prefix_path)
+            except OSError:
+                continue
+            for name in names:
+                if prefix + name in referenced or name.endswith(".tmp"):
+                    continue # Partly written chunks belong to a write still going on
+                try:
+                    info = os.stat(os.path.join(prefix_path, name))
+                    if info.st_mtime >= started:
+                        continue # Written after the manifests were read, by a snapshot this can't see yet
+                    os.remove(os.path.join(prefix_path, name))
+                    freed += info.st_size
+                except OSError as e:
+                    print("error in chunk_store.ChunkStore.collectGarbage:", e)
+            try:
+                os.rmdir(prefix_path)
+            except OSError:
+                pass # Still has chunks
+        return freed
+
+class ChunkSnapshotEngine(SnapshotEngine):
+    """Writes and restores snapshots as manifests of content defined chunks in a `ChunkStore`.
+
+    Each file is cut after a run of bytes that all map to 1 in `anchor_table`,
+    so the cuts move with the content instead of with the file offset: data
+    inserted, removed or changed anywhere only makes new chunks around the
+    change. Looping over every byte would be far too slow in Python, so the
+    buffer is mapped with `bytes.translate()` and the run found with
+    `bytes.find()`, which both run in C. Only chunks the store doesn't have
+    yet are compressed and written, on a thread pool.
+    """
+
+    min_chunk_size = 256 * 1024
+    max_chunk_size = 4 * 1024 * 1024
+    anchor = b"\x01" * 19 # In random data a run of 19 ones comes about every 2^20 bytes, so chunks average about 1.25 MiB with the minimum
+    # Exactly half of the byte values map to 1, picked by hash so they're spread out but the same every run
+    anchor_table = bytes.maketrans(bytes(sorted(range(256), key=lambda i: hashlib.blake2b(bytes([i])).digest())), b"\x01" * 128 + b"\x00" * 128)
+    max_workers = min(8, (os.cpu_count() or 1) + 2)
+
+    def __init__(self, store, progress_callback=None):
+        super().__init__(progress_callback)
+        self.store = store
+        self.stored_size = 0
+
+    def findCut(self, buffer):
+        start = self.min_chunk_size - len(self.anchor)
+        position = buffer.translate(self.anchor_table).find(self.anchor, max(start, 0))
+        if position == -1:
+            return len(buffer)
+        return position + len(self.anchor)
+
+    def splitFile(self, file):
+        buffer = b""
+        while True:
+            buffer += file.read(self.max_chunk_size - len(buffer))
+            if len(buffer) == 0:
+                return
+            cut = self.findCut(buffer)
+            yield buffer[:cut]
+            buffer = buffer[cut:]
+
+    def create(self, source_dir, manifest_path):
+        """Snapshots `source_dir` into the store and writes its manifest, returns True on success. Blocks, so call it from a thread."""
+        try:
+            with self.store.locked():
+                return self.createLocked(source_dir, manifest_path)
+        except OSError as e:
+            print("error in chunk_store.ChunkSnapshotEngine.create: could not lock the store:", e)
+            return False
+
+    def createLocked(self, source_dir, manifest_path):
+        paths = self.scan(source_dir)
+        self.update(force=True)
+        entries = []
+        writing = {} # Chunk id to the future writing it
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                for path in paths:
+                    entry = self.addPath(path, os.path.relpath(path, source_dir), executor, writing)
+                    if entry != None:
+                        entries.append(entry)
+                for future in writing.values():
+                    self.stored_size += future.result()
+            self.checksum = self.store.writeManifest(manifest_path, {
+                "format": 1,
+                "created": int(time.time()),
+                "total_size": self.progress.bytes_done,
+                "stored_size": self.stored_size,
+                "entries": entries,
+            })
+        except OSError as e:
+            print("error in chunk_store.ChunkSnapshotEngine.create: could not write", manifest_path, e)
+            # Chunks written so far are collected with the next garbage collection
+            return False
+        self.update(force=True)
+        return True
+
+    def waitForWrites(self, writing):
+        # Chunks wait in memory until written, so reading may only get a little ahead
+        pending = [future for future in writing.values() if not future.done()]
+        if len(pending) >= self.max_workers * 2:
+            pending[0].result()
+
+    def addPath(self, path, name, executor, writing):
+        try:
+            info = os.lstat(path)
+        except OSError as e:
+            print("error in chunk_store.ChunkSnapshotEngine.addPath: skipping", path, e)
+            return None
+        entry = {"path": name, "mode": stat.S_IMODE(info.st_mode), "mtime_ns": info.st_mtime_ns}
+        if stat.S_ISDIR(info.st_mode):
+            entry["type"] = "dir"
+        elif stat.S_ISLNK(info.st_mode):
+            entry["type"] = "symlink"
+            entry["target"] = os.readlink(path)
+        elif stat.S_ISREG(info.st_mode):
+            entry["type"] = "file"
+            entry["chunks"] = []
+            file_hash = hashlib.blake2b(digest_size=32)
+            size = 0
+            try:
+                with open(path, "rb") as file:
+                    for chunk in self.splitFile(file):
+                        chunk_id = hashlib.blake2b(chunk, digest_size=32).hexdigest()
+                        file_hash.update(chunk)
+                        size += len(chunk)
+                        if chunk_id not in writing and not self.store.has(chunk_id):
+                            self.waitForWrites(writing)
+                            writing[chunk_id] = executor.submit(self.store.write, chunk_id, chunk)
+                        entry["chunks"].append(chunk_id)
+                        self.count(len(chunk), 0)
+            except OSError as e:
+                print("error in chunk_store.ChunkSnapshotEngine.addPath: skipping", path, e)
+                self.count(0, 1)
+                return None
+            entry["size"] = size
+            entry["hash"] = file_hash.hexdigest()
+            self.count(0, 1)
+        else:
+            return None # Sockets, fifos and devices aren't user data
+        return entry
+
+    def listMembers(self, manifest_path):
+        """Returns the entries of a manifest in the form of `SeekableArchive.members`, or None if it can't be read."""
+        try:
+            manifest = self.store.readManifest(manifest_path)
+        except (OSError, ValueError) as e:
+            print("error in chunk_store.ChunkSnapshotEngine.listMembers: could not read", manifest_path, e)
+            return None
+        return [{
+            "path": entry["path"],
+            "type": entry["type"],
+            "size": entry.get("size", 0),
+            "mode": entry["mode"],
+            "mtime": entry["mtime_ns"] / 1e9,
+        } for entry in manifest["entries"]]
+
+    def restore(self, manifest_path, target_dir, replaced_dir=None):
+        """Makes `target_dir` match a manifest, returns True on success. Blocks, so call it from a thread.
+
+        Only files whose size, mtime or hash differ from the manifest are
+        written, see `SnapshotEngine.restore()`.
+        """
+        return self.restoreEntries(manifest_path, target_dir, "", replaced_dir)
+
+    def restorePath(self, manifest_path, target_dir, path, replaced_dir=None):
+        """Restores only the file or folder at `path` in the manifest, returns True on success. Blocks, so call it from a thread."""
+        return self.restoreEntries(manifest_path, target_dir, path, replaced_dir)
+
+    def restoreEntries(self, manifest_path, target_dir, path, replaced_dir):
+        try:
+            manifest = self.store.readManifest(manifest_path)
+        except (OSError, ValueError) as e:
+            print("error in chunk_store.ChunkSnapshotEngine.restoreEntries: could not read", manifest_path, e)
+            return False
+        entries = manifest["entries"]
+        if path != "":
+            entries = [entry for entry in entries if entry["path"] == path or entry["path"].startswith(path + "/")]
+        self.progress.bytes_total = sum(entry.get("size", 0) for entry in entries)
+        self.progress.files_total = len([entry for entry in entries if entry["type"] == "file"])
+        self.update(force=True)
+
+        target_dir = os.path.realpath(target_dir)
+        try:
+            for entry in entries:
+                self.restoreEntry(entry, target_dir, replaced_dir)
+            if path == "" or any(entry["path"] == path and entry["type"] == "dir" for entry in entries):
+                self.removeExtras(target_dir, path, set(os.path.normpath(entry["path"]) for entry in entries), replaced_dir)
+            # Directories get their attributes last, restoring their files changed them
+            for entry in reversed(entries):
+                if entry["type"] == "dir":
+                    entry_path = self.targetPath(entry, target_dir)
+                    os.chmod(entry_path, entry["mode"])
+                    os.utime(entry_path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+        except (OSError, ValueError, zlib.error) as e:
+            print("error in chunk_store.ChunkSnapshotEngine.restoreEntries: could not restore", manifest_path, e)
+            return False
+        self.update(force=True)
+        return True
+
+    def targetPath(self, entry, target_dir):
+        path = os.path.normpath(os.path.join(target_dir, entry["path"]))
+        if os.path.commonpath([path, target_dir]) != target_dir:
+            raise ValueError(f"{entry['path']} is outside of the snapshot")
+        return path
+
+    def hashFile(self, path):
+        file_hash = hashlib.blake2b(digest_size=32)
+        with open(path, "rb") as file:
+            for chunk in self.splitFile(file):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def restoreEntry(self, entry, target_dir, replaced_dir):
+        path = self.targetPath(entry, target_dir)
+        live = self.liveInfo(path)
+        if entry["type"] == "dir":
+            if live != None and stat.S_ISDIR(live.st_mode):
+                return
+        elif entry["type"] == "symlink":
+            if live != None and stat.S_ISLNK(live.st_mode) and os.readlink(path) == entry["target"]:
+                return
+        elif live != None and stat.S_ISREG(live.st_mode) and live.st_size == entry["size"]:
+            if live.st_mtime_ns == entry["mtime_ns"] or self.hashFile(path) == entry["hash"]:
+                # Same content, at most the mtime needs setting back
+                os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+                self.count(entry["size"], 1)
+                return
+
+        if live != None:
+            self.moveAside(path, os.path.relpath(path, target_dir), replaced_dir)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        if entry["type"] == "dir":
+            os.makedirs(path, exist_ok=True)
+        elif entry["type"] == "symlink":
+            os.symlink(entry["target"], path)
+        elif entry["type"] == "file":
+            with open(path, "wb") as file:
+                for chunk_id in entry["chunks"]:
+                    chunk = self.store.read(chunk_id)
+                    file.write(chunk)
+                    self.count(len(chunk), 0)
+            os.chmod(path, entry["mode"])
+            os.utime(path, ns=(entry["mtime_ns"], entry["mtime_ns"]))
+            self.count(0, 1)
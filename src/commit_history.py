@@ -0,0 +1,119 @@
+from gi.repository import GLib
+import json
+import os
+import subprocess
+
+class CommitHistory:
+    """The commit history of a ref on a remote, cached on disk between sessions.
+
+    `flatpak remote-info --log` walks the whole commit chain on the remote, so
+    it is only used when there is no cache. Otherwise only the remote's head
+    commit is fetched, and when it moved, its parents are followed back to the
+    cached head one commit at a time.
+    """
+
+    cache_dir = os.path.join(GLib.get_user_cache_dir(), "warehouse", "commits")
+    # Past this many new commits a single `--log` call is cheaper than walking parents
+    max_new_commits = 20
+
+    def __init__(self, remote, ref, user_or_system, new_env=None):
+        self.remote = remote
+        self.ref = ref
+        self.user_or_system = user_or_system
+        self.new_env = new_env
+        self.commits = [] # [commit, subject, date], newest first
+        name = f"{user_or_system}-{remote}-{ref}".replace("/", "_")
+        self.cache_path = os.path.join(self.cache_dir, name + ".json")
+
+    def load(self):
+        """Reads the cached history, returns True if there was one."""
+        try:
+            with open(self.cache_path, "r") as file:
+                self.commits = json.load(file)
+        except (OSError, ValueError) as e:
+            if os.path.exists(self.cache_path):
+                print("error in commit_history.CommitHistory.load: could not read cache:", e)
+            self.commits = []
+        return len(self.commits) > 0
+
+    def save(self):
+        try:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            temp_path = self.cache_path + ".tmp"
+            with open(temp_path, "w") as file:
+                json.dump(self.commits, file)
+            os.replace(temp_path, self.cache_path)
+        except OSError as e:
+            print("error in commit_history.CommitHistory.save: could not write cache:", e)
+
+    def remoteInfo(self, *args):
+        command = ["flatpak-spawn", "--host", "flatpak", "remote-info", f"--{self.user_or_system}", *args, self.remote, self.ref]
+        return subprocess.run(command, capture_output=True, text=True, env=self.new_env).stdout
+
+    def parse(self, output):
+        """Returns the [commit, subject, date] entries of `remote-info` output, and the first entry's parent."""
+        entries = []
+        parent = None
+        for line in output.split("\n"):
+            line = line.strip()
+            if line.startswith("Commit:"):
+                entries.append([line.removeprefix("Commit:").strip(), "", ""])
+            elif len(entries) == 0:
+                continue
+            elif line.startswith("Subject:"):
+                entries[-1][1] = line.removeprefix("Subject:").strip()
+            elif line.startswith("Date:"):
+                entries[-1][2] = line.removeprefix("Date:").strip()
+            elif line.startswith("Parent:") and len(entries) == 1:
+                parent = line.removeprefix("Parent:").strip()
+        # Every entry needs a date to be shown
+        return [entry for entry in entries if entry[2] != ""], parent
+
+    def refresh(self):
+        """Brings the history up to date with the remote, returns True if it changed. Blocks, so call it from a thread."""
+        if len(self.commits) == 0:
+            return self.fetchAll()
+
+        cached_head = self.commits[0][0]
+        known = [entry[0] for entry in self.commits]
+        new_commits = []
+        meeting_point = None
+        commit_arg = []
+        while meeting_point == None:
+            if len(new_commits) >= self.max_new_commits:
+                return self.fetchAll()
+            entries, parent = self.parse(self.remoteInfo(*commit_arg))
+            if len(entries) == 0:
+                if len(new_commits) > 0:
+                    return self.fetchAll() # The remote no longer has that parent commit
+                return False # Offline or the remote doesn't know the ref, keep what is cached
+            if entries[0][0] in known:
+                meeting_point = known.index(entries[0][0])
+                break
+            new_commits.append(entries[0])
+            if parent == None:
+                break # The history was rewritten, nothing of the cached one is left
+            commit_arg = [f"--commit={parent}"]
+
+        if meeting_point == None:
+            self.commits = new_commits
+        else:
+            self.commits = new_commits + self.commits[meeting_point:]
+        self.save()
+        return self.commits[0][0] != cached_head
+
+    def fetchAll(self):
+        entries, _parent = self.parse(self.remoteInfo("--log"))
+        if len(entries) == 0:
+            return False
+        # The ref's own info comes first, followed by the same head commit again in the history
+        unique = []
+        seen = set()
+        for entry in entries:
+            if entry[0] not in seen:
+                seen.add(entry[0])
+                unique.append(entry)
+        changed = unique != self.commits
+        self.commits = unique
+        self.save()
+        return changed
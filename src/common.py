@@ -1,7 +1,13 @@
-from gi.repository import GLib, Gtk, Adw, Gio #, Gdk
+from gi.repository import GLib, Adw, Gio #, Gtk, Gdk
 import os
 import subprocess
 import pathlib
+import threading
+from .inventory import InventorySnapshot
+from .icon_cache import IconCache
+from .size_scanner import SizeScanner
+from .size_index import SizeIndex
+from .transaction import FlatpakTransaction
 
 class myUtils:
     def __init__(self, window, **kwargs):
@@ -24,8 +30,8 @@ class myUtils:
             print("error in common.trashFolder: CalledProcessError:", e)
             return 2
 
-    def getSizeWithFormat(self, path):
-        return self.getSizeFormat(self.getDirectorySize(path))
+    def getSizeWithFormat(self, path, cancellable=None, progress_callback=None):
+        return self.getSizeFormat(self.getDirectorySize(path, cancellable, progress_callback))
 
     def getSizeFormat(self, b):
         factor = 1000
@@ -36,51 +42,23 @@ class myUtils:
             b /= factor
         return f"{b:.1f}{suffix}"
 
-    def getDirectorySize(self, directory):
-        """Returns the `directory` size in bytes."""
-        total = 0
-        try:
-            # print("[+] Getting the size of", directory)
-            for entry in os.scandir(directory):
-                if entry.is_symlink():
-                    continue  # Skip symlinks
-                if entry.is_file():
-                    # if it's a file, use stat() function
-                    total += entry.stat().st_size
-                elif entry.is_dir():
-                    # if it's a directory, recursively call this function
-                    try:
-                        total += self.getDirectorySize(entry.path)
-                    except FileNotFoundError:
-                        pass
-        except NotADirectoryError:
-            # if `directory` isn't a directory, get the file size then
-            return os.path.getsize(directory)
-        except PermissionError:
-            # if for whatever reason we can't open the folder, return 0
-            return 0
-        if total == 0:
-            return 0
-        # Adding 4000 seems to make it more accurate to whatever data we can't scan from within the sandbox
-        return total + 4000
+    def getDirectorySize(self, directory, cancellable=None, progress_callback=None):
+        """Returns the space `directory` takes up on disk in bytes.
 
-    def findAppIcon(self, app_id):
-        icon_theme = Gtk.IconTheme.new()
-        icon_theme.add_search_path("/var/lib/flatpak/exports/share/icons/")
-        icon_theme.add_search_path(self.host_home + "/.local/share/flatpak/exports/share/icons")
-        
-        try:
-            icon_path = (icon_theme.lookup_icon(app_id, None, 512, 1, self.parent_window.get_direction(), 0).get_file().get_path())
-        except GLib.GError:
-            icon_path = None
-        if icon_path:
-            image = Gtk.Image.new_from_file(icon_path)
-            image.set_icon_size(Gtk.IconSize.LARGE)
-            image.add_css_class("icon-dropshadow")
-        else:
-            image = Gtk.Image.new_from_icon_name("application-x-executable-symbolic")
-            image.set_icon_size(Gtk.IconSize.LARGE)
-        return image
+        See `SizeScanner` for the meaning of `cancellable` and `progress_callback`.
+        """
+        return SizeScanner(cancellable, progress_callback, SizeIndex.getShared()).scan(directory).allocated
+
+    def getCachedSizeWithFormat(self, path):
+        """Returns the size `path` had at its last complete scan, or None. Cheap enough for the main thread."""
+        total = SizeIndex.getShared().getTotal(path)
+        if total == None:
+            return None
+        return self.getSizeFormat(total[1])
+
+    def findAppIcon(self, app_id, callback, pixel_size=32):
+        # `callback` gets a `Gdk.Texture`, or None when the app has no icon, possibly after this returns
+        IconCache.loadIcon(app_id, pixel_size * self.parent_window.get_scale_factor(), callback)
 
     def getHostUpdates(self):
         list = []
@@ -127,32 +105,22 @@ class myUtils:
         return data
 
     def getHostFlatpaks(self):
-        output = subprocess.run(["flatpak-spawn", "--host", "flatpak", "list", "--columns=all"], capture_output=True, text=True, env=self.new_env).stdout
-        lines = output.strip().split("\n")
-        columns = lines[0].split("\t")
-        data = [columns]
-        for line in lines[1:]:
-            row = line.split("\t")
-            data.append(row)
+        # The runtime column is requested alongside the others, so this is a single `flatpak list` call
+        output = subprocess.run(["flatpak-spawn", "--host", "flatpak", "list", f"--columns={InventorySnapshot.list_columns}"], capture_output=True, text=True, env=self.new_env).stdout
+        return InventorySnapshot(self.new_env).parseFlatpaks(output)
 
-        output = subprocess.run(["flatpak-spawn", "--host", "flatpak", "list", "--columns=runtime"], capture_output=True, text=True, env=self.new_env).stdout
-        lines = output.split("\n")
-        for i in range(len(data)):
-            data[i].append(lines[i])
-        sorted_array = sorted(data, key=lambda item: item[0].lower())
-        return sorted_array
+    def getInventory(self, backend="cli"):
+        """Returns a new `InventorySnapshot` of the host, built from one consolidated query.
+
+        `backend` is "cli" to ask the host's `flatpak`, or "disk" to read the installation directories.
+        """
+        return InventorySnapshot(self.new_env, backend).query()
 
     def getDependentRuntimes(self):
-        paks = self.getHostFlatpaks()
-        dependent_runtimes = []
-        for i in range(len(paks)):
-            current = paks[i]
-            try:
-                if current[13] not in dependent_runtimes and current[13] != "":
-                    dependent_runtimes.append(current[13])
-            except:
-                print("Could not get dependent runtime")
-        return(dependent_runtimes)
+        snapshot = InventorySnapshot(self.new_env)
+        snapshot.flatpaks = self.getHostFlatpaks()
+        snapshot.index()
+        return(snapshot.dependent_runtimes)
 
     def getHostMasks(self, user_or_system):
         output = subprocess.run(["flatpak-spawn", "--host", "flatpak", "mask", f"--{user_or_system}"], capture_output=True, text=True, env=self.new_env).stdout
@@ -175,8 +143,10 @@ class myUtils:
             return(1)
         return(0)
 
-    def downgradeFlatpak(self, ref, commit, install_type="system"):
+    def downgradeFlatpak(self, ref, commit, install_type="system", offline=False):
         command = ['flatpak-spawn', '--host', 'pkexec', 'flatpak', 'update', ref, f"--commit={commit}", f"--{install_type}", '-y']
+        if offline:
+            command.append('--no-pull') # The commit is already in the local repo
         try:
             response = subprocess.run(command, capture_output=True, text=True, env=self.new_env).stderr
         except subprocess.CalledProcessError as e:
@@ -186,99 +156,110 @@ class myUtils:
             return(1)
         return(0)
 
+    def planUninstall(self, ref_arr, type_arr):
+        """Groups the refs to remove by installation, returns a dict of "user" or "system" to refs."""
+        groups = {}
+        for ref, user_or_system in zip(ref_arr, type_arr):
+            groups.setdefault(user_or_system, [])
+            if ref not in groups[user_or_system]:
+                groups[user_or_system].append(ref)
+        return groups
+
     def uninstallFlatpak(self, ref_arr, type_arr, should_trash, progress_bar=None):
         self.uninstall_success = True
-        print(ref_arr)
-        to_uninstall = []
-        for i in range(len(ref_arr)):
-            to_uninstall.append([ref_arr[i], type_arr[i]])
-
-        apps = []
-        fails = []
-        for i in range(len(to_uninstall)):
-            ref = to_uninstall[i][0]
-            id = to_uninstall[i][0].split("/")[0]
-            app_type = to_uninstall[i][1]
-            apps.append([ref, id, app_type])
-        # apps array guide: [app_ref, app_id, user_or_system_install]
-
-        for i in range(len(apps)):
-            command = ['flatpak-spawn', '--host', 'flatpak', 'remove', '-y', f"--{apps[i][2]}", apps[i][0]]
-            try:
-                subprocess.run(command, capture_output=False, check=True, env=self.new_env)
-                if progress_bar:
-                    GLib.idle_add(progress_bar.set_visible, True)
-                    GLib.idle_add(progress_bar.set_fraction, (i + 1.0) / len(ref_arr))
-            except subprocess.CalledProcessError:
-                fails.append(apps[i])
-
-        if len(fails) > 0: # Run this only if there is 1 or more non uninstalled apps
-            pk_command = ['flatpak-spawn', '--host', 'pkexec', 'flatpak', 'remove', '-y', '--system']
-            print("second uninstall process")
-            for i in range(len(fails)):
-
-                if fails[i][2] == "user":
-                    self.uninstall_success = False
-                    continue # Skip if app is a user install app
-
-                pk_command.append(fails[i][0])
-            try:
-                print(pk_command)
-                if progress_bar:
-                    GLib.idle_add(progress_bar.set_visible, True)
-                    GLib.idle_add(progress_bar.set_fraction, 0.9)
-                subprocess.run(pk_command, capture_output=False, check=True, env=self.new_env)
-            except subprocess.CalledProcessError:
-                self.uninstall_success = False
+        groups = self.planUninstall(ref_arr, type_arr)
+        fractions = {}
+
+        def progress(user_or_system, fraction):
+            # Both groups run at once, the bar shows their progress weighted by size
+            fractions[user_or_system] = fraction
+            if progress_bar:
+                done = sum(fractions[group] * len(groups[group]) for group in fractions)
+                GLib.idle_add(progress_bar.set_visible, True)
+                GLib.idle_add(progress_bar.set_fraction, done / len(ref_arr))
+
+        results = {}
+        def run(user_or_system):
+            # System refs go straight to the privileged path instead of failing unprivileged first
+            transaction = FlatpakTransaction("remove", user_or_system, groups[user_or_system], privileged=(user_or_system == "system"), new_env=self.new_env,
+                progress_callback=lambda transaction_progress: progress(user_or_system, transaction_progress.fraction))
+            results[user_or_system] = transaction.run()
+            progress(user_or_system, 1.0)
+
+        threads = [threading.Thread(target=run, args=(user_or_system,)) for user_or_system in groups]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if False in results.values():
+            self.uninstall_success = False
 
         if should_trash:
-            host_paks = self.getHostFlatpaks()
-            host_refs = []
-            for i in range(len(host_paks)):
-                host_refs.append(host_paks[i][8])
-
-            for i in range(len(apps)):
-                if apps[i][0] in host_refs:
-                    print(f"{apps[i][1]} is still installed")
+            host_refs = set(row[8] for row in self.getHostFlatpaks() if len(row) > 8) # An empty list is [['', '']]
+            for ref in ref_arr:
+                app_id = ref.split("/")[0]
+                if ref in host_refs:
+                    print(f"{app_id} is still installed")
                 else:
-                    self.trashFolder(f"{self.user_data_path}{apps[i][1]}")
+                    self.trashFolder(f"{self.user_data_path}{app_id}")
 
         if progress_bar:
             GLib.idle_add(progress_bar.set_visible, False)
             GLib.idle_add(progress_bar.set_fraction, 0.0)
 
+    def getInstalledIds(self, user_or_system):
+        output = subprocess.run(["flatpak-spawn", "--host", "flatpak", "list", f"--{user_or_system}", "--columns=application"], capture_output=True, text=True, env=self.new_env).stdout
+        return set(output.split())
+
+    def getRemoteIds(self, remote, user_or_system):
+        """Returns the set of ids `remote` offers, or None if it could not be listed."""
+        try:
+            output = subprocess.run(["flatpak-spawn", "--host", "flatpak", "remote-ls", f"--{user_or_system}", remote, "--columns=application"], capture_output=True, text=True, check=True, env=self.new_env).stdout
+        except subprocess.CalledProcessError as e:
+            print("error in common.getRemoteIds: CalledProcessError:", e)
+            return None
+        return set(output.split())
+
     def installFlatpak(self, app_arr, remote, user_or_system, progress_bar=None):
+        """Installs every id in `app_arr` from `remote` in one transaction.
+
+        `remote` is None when `app_arr` holds a single bundle or ref file.
+        The ids that could not be installed are left in `self.install_fails`.
+        """
         self.install_success = True
-        fails = []
+        self.install_fails = []
+        to_install = list(app_arr)
+
+        def progress(transaction_progress):
+            if progress_bar:
+                GLib.idle_add(progress_bar.set_visible, True)
+                GLib.idle_add(progress_bar.set_fraction, transaction_progress.fraction)
 
-        for i in range(len(app_arr)):
-            command = ['flatpak-spawn', '--host', 'flatpak', 'install']
+        if remote != None:
+            # A ref the remote doesn't have would fail the whole transaction, so those are left out up front
+            available = self.getRemoteIds(remote, user_or_system)
+            if available != None:
+                self.install_fails = [app_id for app_id in to_install if app_id not in available]
+                to_install = [app_id for app_id in to_install if app_id in available]
+
+        transaction = FlatpakTransaction("install", user_or_system, to_install, remote, new_env=self.new_env, progress_callback=progress)
+        succeeded = transaction.run()
+        if not succeeded and user_or_system == "system":
             if remote != None:
-                command.append(remote)
-            command.append(f"--{user_or_system}")
-            command.append('-y')
-            command.append(app_arr[i])
-            try:
-                subprocess.run(command, capture_output=False, check=True, env=self.new_env)
-                if progress_bar:
-                    GLib.idle_add(progress_bar.set_visible, True)
-                    GLib.idle_add(progress_bar.set_fraction, (i + 1.0) / len(app_arr))
-            except subprocess.CalledProcessError:
-                fails.append(app_arr[i])
-        
-        if (len(fails) > 0) and (user_or_system == "system"):
-            pk_command = ['flatpak-spawn', '--host', 'pkexec', 'flatpak', 'install', remote, f"--{user_or_system}", '-y']
-            for i in range(len(fails)):
-                pk_command.append(fails[i])
-            try:
-                if progress_bar:
-                    GLib.idle_add(progress_bar.set_visible, True)
-                    GLib.idle_add(progress_bar.set_fraction, 0.9)
-                subprocess.run(pk_command, capture_output=False, check=True, env=self.new_env)
-            except subprocess.CalledProcessError:
-                self.install_success = False
-
-        if (len(fails) > 0) and (user_or_system == "user"):
+                # Only retry what is still missing
+                installed = self.getInstalledIds(user_or_system)
+                to_install = [app_id for app_id in to_install if app_id not in installed]
+            transaction = FlatpakTransaction("install", user_or_system, to_install, remote, privileged=True, new_env=self.new_env, progress_callback=progress)
+            succeeded = transaction.run()
+
+        if not succeeded:
+            if remote != None:
+                installed = self.getInstalledIds(user_or_system)
+                self.install_fails += [app_id for app_id in to_install if app_id not in installed]
+            else:
+                self.install_fails += to_install
+
+        if len(self.install_fails) > 0:
             self.install_success = False
 
         if progress_bar:
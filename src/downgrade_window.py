@@ -1,6 +1,7 @@
 from gi.repository import Gtk, Adw, GLib, Gdk, Gio
 from .common import myUtils
-import subprocess
+from .commit_history import CommitHistory
+from .installation_reader import InstallationReader
 import os
 import pathlib
 
@@ -18,6 +19,7 @@ class DowngradeWindow(Adw.Window):
     toast_overlay = Gtk.Template.Child()
     mask_row = Gtk.Template.Child()
     main_toolbar_view = Gtk.Template.Child()
+    outerbox = Gtk.Template.Child()
 
     def pulser(self):
         if self.should_pulse:
@@ -32,61 +34,81 @@ class DowngradeWindow(Adw.Window):
         self.apply_button.set_sensitive(True)
         if button.get_active():
             self.commit_to_use = self.versions[index][0]
+            self.use_local_commit = False
 
-    def getCommits(self):
-        output = subprocess.run(["flatpak-spawn", "--host", "flatpak", "remote-info", "--log", self.remote, self.app_ref, f"--{self.install_type}"], capture_output=True, text=True, env=self.new_env).stdout
-        lines = output.strip().split("\n")
-        columns = lines[0].split("\t")
-        data = [columns]
-        for line in lines[1:]:
-            row = line.split("\t")
-            data.append(row[0].strip())
-        
-        commits = []
-        changes = []
-        dates = []
-        for i in range(len(data)):
-            line = data[i]
-
-            if "Commit:" in line:
-                commits.append(line.replace("Commit: ", ""))
-
-            if "Subject:" in line:
-                changes.append(line.replace("Subject: ", ""))
-
-            if "Date:" in line:
-                dates.append(line.replace("Date: ", ""))
+    def localSelectionHandler(self, button, commit):
+        self.apply_button.set_sensitive(True)
+        if button.get_active():
+            self.commit_to_use = commit
+            self.use_local_commit = True
+
+    def createVersionRow(self, version):
+        date_time = version[2].split(' ')
+        date = date_time[0].split('-')
+        offset = date_time[2][:3] + ":" + date_time[2][3:]
+        time = date_time[1].split(':')
+        display_time = GLib.DateTime.new(GLib.TimeZone.new(offset), int(date[0]), int(date[1]), int(date[2]), int(time[0]), int(time[1]), int(time[2]))
+        display_time = display_time.format("%x %X")
+        change = version[1].split('(')
+        row = Adw.ActionRow(title=GLib.markup_escape_text(change[0]), subtitle=str(display_time))
+        row.set_tooltip_text(_("Commit Hash: {}").format(version[0]))
+        select = Gtk.CheckButton()
+        select.set_group(self.group_button)
+        row.set_activatable_widget(select)
+        row.add_prefix(select)
+        return row, select
+
+    def showLocalCommits(self):
+        # Commits still in the local repo can be deployed again without a download, even offline
+        kind = "runtime" if "runtime" in self.flatpak_row[12] else "app"
+        commits = InstallationReader().readLocalCommits(self.install_type, self.remote, f"{kind}/{self.app_ref}")
+        installed_commit = self.flatpak_row[9]
+        commits = [commit for commit in commits if not commit[0].startswith(installed_commit)]
+        if len(commits) == 0:
+            return
+        local_group = Adw.PreferencesGroup(title=_("Available Offline"), description=_("These releases are still on this device and do not need to be downloaded."))
+        for commit in commits:
+            row, select = self.createVersionRow(commit)
+            select.connect("toggled", self.localSelectionHandler, commit[0])
+            local_group.add(row)
+        # Listed above the releases that need a download
+        self.outerbox.remove(self.versions_group)
+        self.outerbox.add(local_group)
+        self.outerbox.add(self.versions_group)
 
-        for i in range(len(commits)):
-            self.versions.append([commits[i], changes[i], dates[i]])
+    def getCommits(self):
+        self.history_changed = self.history.refresh()
 
     def commitsCallback(self):
         self.progress_bar.set_visible(False)
         self.should_pulse = False
-        group_button = Gtk.CheckButton(visible=False)
-        self.versions_group.add(group_button)
+        if self.history_changed or len(self.version_rows) == 0:
+            self.showVersions()
+        self.set_title(self.window_title)
+
+    def showVersions(self):
+        for row in self.version_rows:
+            self.versions_group.remove(row)
+        self.version_rows = []
+        self.versions = [list(entry) for entry in self.history.commits]
+
         for i in range(len(self.versions)):
             version = self.versions[i]
-            date_time = version[2].split(' ')
-            date = date_time[0].split('-')
-            offset = date_time[2][:3] + ":" + date_time[2][3:]
-            time = date_time[1].split(':')
-            display_time = GLib.DateTime.new(GLib.TimeZone.new(offset), int(date[0]), int(date[1]), int(date[2]), int(time[0]), int(time[1]), int(time[2]))
-            display_time = display_time.format("%x %X")
-            change = version[1].split('(')
-            row = Adw.ActionRow(title=GLib.markup_escape_text(change[0]), subtitle=str(display_time))
-            row.set_tooltip_text(_("Commit Hash: {}").format(version[0]))
-            select = Gtk.CheckButton()
+            row, select = self.createVersionRow(version)
             select.connect("toggled", self.selectionHandler, i)
-            select.set_group(group_button)
+            if version[0] == self.commit_to_use and not self.use_local_commit:
+                select.set_active(True) # Keep the choice made from the cached list
 
             version.append(select)
-            row.set_activatable_widget(select)
-            row.add_prefix(select)
             self.versions_group.add(row)
-        self.set_title(self.window_title)
+            self.version_rows.append(row)
 
     def generateList(self):
+        self.showLocalCommits()
+        if self.history.load():
+            # Shown right away, the remote is then only asked for what is new
+            self.showVersions()
+            self.set_title(self.window_title)
         task = Gio.Task.new(None, None, lambda *_: self.commitsCallback())
         task.run_in_thread(lambda *_: self.getCommits())
 
@@ -109,7 +131,7 @@ class DowngradeWindow(Adw.Window):
         self.close()
 
     def downgradeThread(self):
-        self.response = self.my_utils.downgradeFlatpak(self.app_ref, self.commit_to_use, self.install_type)
+        self.response = self.my_utils.downgradeFlatpak(self.app_ref, self.commit_to_use, self.install_type, self.use_local_commit)
 
     def onApply(self):
         self.set_title(_("Downgrading…"))
@@ -133,8 +155,13 @@ class DowngradeWindow(Adw.Window):
         self.install_type = flatpak_row[7]
         self.app_ref = flatpak_row[8]
         self.versions = []
+        self.version_rows = []
+        self.history = CommitHistory(self.remote, self.app_ref, self.install_type, self.new_env)
+        self.history_changed = False
         self.should_pulse = True
         self.commit_to_use = ""
+        self.use_local_commit = False
+        self.group_button = Gtk.CheckButton() # Never shown, it only links the rows' check buttons
         self.parent_window = parent_window
         self.flatpak_row = flatpak_row
         self.response = 0
@@ -88,7 +88,7 @@ class FilterWindow(Adw.Window):
         self.remotes_expander_switch = Gtk.Switch(valign=Gtk.Align.CENTER)
         self.runtimes_expander_switch = Gtk.Switch(valign=Gtk.Align.CENTER)
         
-        dependent_runtimes = self.my_utils.getDependentRuntimes()
+        dependent_runtimes = self.app_window.inventory.dependent_runtimes
 
         if len(self.host_remotes) < 2: # Don't give the ability to filter by remotes if there is only 1
             self.remotes_expander.set_visible(False)
@@ -150,7 +150,7 @@ class FilterWindow(Adw.Window):
 
         # Create Variables
         self.my_utils = myUtils(self)
-        self.host_remotes = self.my_utils.getHostRemotes()
+        self.host_remotes = main_window.inventory.remotes
         self.host_flatpaks = main_window.host_flatpaks
         self.filter_list = [False, False, [], [], []]
         event_controller = Gtk.EventControllerKey()
@@ -0,0 +1,165 @@
+from gi.repository import GLib, Gtk, Gdk, GdkPixbuf, Gio
+from collections import OrderedDict
+import hashlib
+import os
+import pathlib
+
+class IconCache:
+    """Loads app icons from the Flatpak exports, shared by every window.
+
+    There is one icon theme for the whole process, icons are decoded in a
+    thread at the size they are displayed at, and the resulting textures are
+    kept in a bounded LRU cache keyed by app id, size and the icon file's mtime.
+    Decoded icons are also saved as small PNG thumbnails, so later launches
+    don't have to parse the exported SVGs or large PNGs again.
+    """
+
+    host_home = str(pathlib.Path.home())
+    search_paths = [
+        "/var/lib/flatpak/exports/share/icons/",
+        host_home + "/.local/share/flatpak/exports/share/icons",
+    ]
+    max_entries = 512
+    thumbnail_dir = os.path.join(GLib.get_user_cache_dir(), "warehouse", "icons")
+    icon_theme = None
+    textures = OrderedDict()
+    pending = {}
+
+    @classmethod
+    def getIconTheme(cls):
+        # Every new theme rescans the icon directories, so only ever make one
+        if cls.icon_theme == None:
+            cls.icon_theme = Gtk.IconTheme.new()
+            for path in cls.search_paths:
+                cls.icon_theme.add_search_path(path)
+        return cls.icon_theme
+
+    @classmethod
+    def lookupIconPath(cls, app_id, size):
+        try:
+            icon_file = cls.getIconTheme().lookup_icon(app_id, None, size, 1, Gtk.TextDirection.NONE, 0).get_file()
+        except GLib.GError:
+            return None
+        if icon_file == None:
+            return None
+        icon_path = icon_file.get_path()
+        if icon_path == None or not os.path.exists(icon_path):
+            return None # The theme falls back to "image-missing" when nothing matches
+        return icon_path
+
+    @classmethod
+    def cacheKey(cls, app_id, size, icon_path):
+        try:
+            mtime = os.stat(icon_path).st_mtime_ns
+        except OSError:
+            mtime = 0
+        return f"{app_id}:{size}:{mtime}"
+
+    @classmethod
+    def remember(cls, key, texture):
+        cls.textures[key] = texture
+        cls.textures.move_to_end(key)
+        while len(cls.textures) > cls.max_entries:
+            cls.textures.popitem(last=False)
+
+    @classmethod
+    def thumbnailPath(cls, app_id, size, key, icon_path):
+        # The app id leads the name so thumbnails of uninstalled apps can be found, "@" can't be in an app id
+        digest = hashlib.sha1(f"{icon_path}:{key}".encode()).hexdigest()
+        return os.path.join(cls.thumbnail_dir, f"{app_id}@{size}@{digest}.png")
+
+    @classmethod
+    def decodeIcon(cls, icon_path, size, thumbnail_path):
+        if os.path.exists(thumbnail_path):
+            try:
+                return Gdk.Texture.new_from_filename(thumbnail_path)
+            except GLib.GError as e:
+                print("error in icon_cache.IconCache.decodeIcon: could not read thumbnail", thumbnail_path, e)
+
+        # Scaled while decoding, so big PNGs and SVGs are never rendered at full size
+        pixbuf = GdkPixbuf.Pixbuf.new_from_file_at_size(icon_path, size, size)
+        try:
+            os.makedirs(cls.thumbnail_dir, exist_ok=True)
+            temp_path = thumbnail_path + ".tmp"
+            pixbuf.savev(temp_path, "png", [], [])
+            os.replace(temp_path, thumbnail_path)
+        except (OSError, GLib.GError) as e:
+            print("error in icon_cache.IconCache.decodeIcon: could not write thumbnail", thumbnail_path, e)
+        return Gdk.Texture.new_for_pixbuf(pixbuf)
+
+    @classmethod
+    def pruneThumbnails(cls, app_ids):
+        """Deletes the thumbnails of apps not in `app_ids`, and those of icons that changed since."""
+        try:
+            names = os.listdir(cls.thumbnail_dir)
+        except OSError:
+            return
+        newest = {}
+        for name in sorted(names, key=lambda name: cls.thumbnailMtime(name)):
+            parts = name.split("@")
+            path = os.path.join(cls.thumbnail_dir, name)
+            if len(parts) != 3 or parts[0] not in app_ids:
+                cls.removeThumbnail(path)
+                continue
+            # Only the newest thumbnail of an app at a given size matches its current icon
+            previous = newest.get((parts[0], parts[1]))
+            if previous != None:
+                cls.removeThumbnail(previous)
+            newest[(parts[0], parts[1])] = path
+
+    @classmethod
+    def thumbnailMtime(cls, name):
+        try:
+            return os.stat(os.path.join(cls.thumbnail_dir, name)).st_mtime_ns
+        except OSError:
+            return 0
+
+    @classmethod
+    def removeThumbnail(cls, path):
+        try:
+            os.remove(path)
+        except OSError as e:
+            print("error in icon_cache.IconCache.removeThumbnail: could not remove", path, e)
+
+    @classmethod
+    def loadIcon(cls, app_id, size, callback):
+        """Calls `callback` with a `Gdk.Texture` of the app's icon, or None if it has no icon.
+
+        Cached icons are returned right away, others are decoded in a thread and
+        handed over on the main loop. `size` is in device pixels.
+        """
+        icon_path = cls.lookupIconPath(app_id, size)
+        if icon_path == None:
+            callback(None)
+            return
+
+        key = cls.cacheKey(app_id, size, icon_path)
+        thumbnail_path = cls.thumbnailPath(app_id, size, key, icon_path)
+        if key in cls.textures:
+            cls.textures.move_to_end(key)
+            callback(cls.textures[key])
+            return
+
+        if key in cls.pending:
+            # Already being decoded for another row
+            cls.pending[key].append(callback)
+            return
+        cls.pending[key] = [callback]
+
+        def thread(*_args):
+            try:
+                texture = cls.decodeIcon(icon_path, size, thumbnail_path)
+            except GLib.GError as e:
+                print("error in icon_cache.IconCache.loadIcon: could not decode", icon_path, e)
+                texture = None
+            GLib.idle_add(done, texture)
+
+        def done(texture):
+            if texture != None:
+                cls.remember(key, texture)
+            for waiting in cls.pending.pop(key, []):
+                waiting(texture)
+            return False
+
+        task = Gio.Task.new(None, None, None)
+        task.run_in_thread(thread)
@@ -0,0 +1,224 @@
+from gi.repository import GLib
+import os
+import pathlib
+import sys
+
+class InstallationReader:
+    """Reads installed refs, masks, pins and remotes straight from Flatpak installation directories.
+
+    This is an alternative to parsing `flatpak list` output: it walks the
+    `{app,runtime}/<id>/<arch>/<branch>/active` deploys and reads their
+    `deploy` and `metadata` files and the repo config. Rows are produced in
+    the same column order as `InventorySnapshot.list_columns`.
+    """
+
+    host_home = str(pathlib.Path.home())
+    default_installations = [
+        ["system", "/var/lib/flatpak"],
+        ["user", host_home + "/.local/share/flatpak"],
+    ]
+    # The `deploy` file is a serialized GVariant: origin, commit, subpaths, installed size, metadata
+    deploy_type = GLib.VariantType.new("(ssasta{sv})")
+
+    def __init__(self, installations=None):
+        # `installations` is a list of [installation name, path], so fixture trees can be read as well
+        if installations == None:
+            installations = self.default_installations
+        self.installations = installations
+
+    def read(self):
+        flatpaks = []
+        remotes = []
+        masks = {"system": [], "user": []}
+        pins = []
+        for name, path in self.installations:
+            if not os.path.isdir(path):
+                continue
+            for kind in ["app", "runtime"]:
+                flatpaks += self.readDeploys(name, path, kind)
+            config = self.readRepoConfig(path)
+            if config == None:
+                continue
+            remotes += self.readRemotes(name, config)
+            masks.setdefault(name, [])
+            masks[name] += self.readList(config, "core", "xa.masked")
+            pins += self.readList(config, "core", "xa.pinned")
+        return {
+            "flatpaks": flatpaks,
+            "remotes": remotes,
+            "system_masks": masks["system"],
+            "user_masks": masks["user"],
+            "pins": pins,
+        }
+
+    def readDeploys(self, installation, path, kind):
+        rows = []
+        kind_path = os.path.join(path, kind)
+        try:
+            ids = os.listdir(kind_path)
+        except OSError:
+            return rows
+        for app_id in ids:
+            id_path = os.path.join(kind_path, app_id)
+            current = self.readLink(os.path.join(id_path, "current"))
+            try:
+                arches = os.listdir(id_path)
+            except OSError:
+                continue
+            for arch in arches:
+                arch_path = os.path.join(id_path, arch)
+                if arch == "current" or not os.path.isdir(arch_path):
+                    continue
+                for branch in os.listdir(arch_path):
+                    active_path = os.path.join(arch_path, branch, "active")
+                    if not os.path.isdir(active_path):
+                        continue
+                    try:
+                        rows.append(self.readDeploy(installation, path, kind, app_id, arch, branch, active_path, current == f"{arch}/{branch}"))
+                    except (OSError, GLib.GError, TypeError, ValueError) as e:
+                        print(f"error in installation_reader.readDeploys: could not read {active_path}:", e)
+        return rows
+
+    def readDeploy(self, installation, path, kind, app_id, arch, branch, active_path, is_current):
+        with open(os.path.join(active_path, "deploy"), "rb") as file:
+            data = GLib.Bytes.new(file.read())
+        origin, commit, subpaths, installed_size, metadata = GLib.Variant.new_from_bytes(self.deploy_type, data, False).unpack()
+        ref = f"{app_id}/{arch}/{branch}"
+
+        name = metadata.get("appdata-name") or app_id.split(".")[-1]
+        description = metadata.get("appdata-summary", "")
+        version = metadata.get("appdata-version", "")
+        latest = self.readLatestCommit(path, origin, f"{kind}/{ref}")
+
+        options = []
+        if kind == "app":
+            if is_current:
+                options.append("current")
+        else:
+            options.append("runtime")
+        if len(subpaths) > 0:
+            options.append("partial")
+        if "eol" in metadata:
+            options.append("eol=" + metadata["eol"])
+        if "eolr" in metadata:
+            options.append("eol-rebase=" + metadata["eolr"])
+
+        runtime = ""
+        if kind == "app":
+            keyfile = GLib.KeyFile.new()
+            keyfile.load_from_file(os.path.join(active_path, "metadata"), GLib.KeyFileFlags.NONE)
+            try:
+                runtime = keyfile.get_string("Application", "runtime")
+            except GLib.GError:
+                runtime = ""
+
+        return [
+            name, description, app_id, version, branch, arch, origin, installation, ref,
+            commit[:12], latest[:12], GLib.format_size(installed_size), ",".join(options), runtime,
+        ]
+
+    commit_type = GLib.VariantType.new("(a{sv}aya(say)sstayay)")
+    # Walking a long history object by object is slow and only the recent past matters for a rollback
+    max_local_commits = 50
+
+    def readCommit(self, path, commit):
+        """Returns the (subject, unix timestamp, parent or None) of a commit in the installation's repo, or None if it isn't there."""
+        commit_path = os.path.join(path, "repo", "objects", commit[:2], commit[2:] + ".commit")
+        if os.path.exists(os.path.join(path, "repo", "state", commit + ".commitpartial")):
+            return None # Not all of its files were pulled
+        try:
+            with open(commit_path, "rb") as file:
+                data = GLib.Bytes.new(file.read())
+        except OSError:
+            return None
+        _metadata, parent, _related, subject, _body, timestamp, _tree, _dirmeta = GLib.Variant.new_from_bytes(self.commit_type, data, False).unpack()
+        # OSTree stores the timestamp big endian
+        timestamp = int.from_bytes(timestamp.to_bytes(8, sys.byteorder), "big")
+        parent = bytes(parent).hex() if len(parent) > 0 else None
+        return subject, timestamp, parent
+
+    def readLocalCommits(self, installation, origin, full_ref):
+        """Returns [commit, subject, date] for the commits of `full_ref` that are in the installation's repo, newest first.
+
+        These can be deployed again without downloading anything. The walk
+        starts at the ref's last pulled commit and at every deploy still on disk.
+        """
+        path = dict(self.installations).get(installation)
+        if path == None:
+            return []
+        heads = [self.readLatestCommit(path, origin, full_ref)]
+        try:
+            heads += [name for name in os.listdir(os.path.join(path, full_ref)) if len(name) == 64]
+        except OSError:
+            pass
+
+        commits = {}
+        for commit in heads:
+            while commit not in [None, "-"] and commit not in commits and len(commits) < self.max_local_commits:
+                info = self.readCommit(path, commit)
+                if info == None:
+                    break
+                subject, timestamp, parent = info
+                commits[commit] = [commit, subject, GLib.DateTime.new_from_unix_utc(timestamp).format("%Y-%m-%d %H:%M:%S +0000"), timestamp]
+                commit = parent
+        ordered = sorted(commits.values(), key=lambda entry: entry[3], reverse=True)
+        return [entry[:3] for entry in ordered]
+
+    def readLatestCommit(self, path, origin, full_ref):
+        try:
+            with open(os.path.join(path, "repo", "refs", "remotes", origin, full_ref), "r") as file:
+                return file.read().strip()
+        except OSError:
+            return "-"
+
+    def readLink(self, path):
+        try:
+            return os.readlink(path)
+        except OSError:
+            return None
+
+    def readRepoConfig(self, path):
+        keyfile = GLib.KeyFile.new()
+        try:
+            keyfile.load_from_file(os.path.join(path, "repo", "config"), GLib.KeyFileFlags.NONE)
+        except GLib.GError:
+            return None
+        return keyfile
+
+    def readList(self, keyfile, group, key):
+        try:
+            return [item for item in keyfile.get_string_list(group, key) if item != ""]
+        except GLib.GError:
+            return []
+
+    def readRemotes(self, installation, keyfile):
+        # Same columns as `flatpak remotes --columns=all`
+        remotes = []
+        for group in keyfile.get_groups()[0]:
+            if not group.startswith('remote "'):
+                continue
+            name = group[len('remote "'):-1]
+
+            def get(key, default="-"):
+                try:
+                    value = keyfile.get_string(group, key)
+                except GLib.GError:
+                    return default
+                if value == "":
+                    return default
+                return value
+
+            options = [installation]
+            if get("xa.disable", "false") == "true":
+                options.append("disabled")
+            if get("xa.noenumerate", "false") == "true":
+                options.append("no-enumerate")
+            if get("xa.nodeps", "false") == "true":
+                options.append("no-use-for-deps")
+
+            remotes.append([
+                name, get("xa.title"), get("url"), get("collection-id"), get("xa.subset"), get("xa.filter"),
+                get("xa.prio", "1"), ",".join(options), get("xa.comment"), get("xa.description"),
+                get("xa.homepage"), get("xa.icon"),
+            ])
+        return remotes
@@ -0,0 +1,217 @@
+from gi.repository import GLib
+import os
+import subprocess
+import pathlib
+import json
+import tempfile
+from .installation_reader import InstallationReader
+
+class InventorySnapshot:
+    """A point-in-time view of the host's Flatpak installations.
+
+    Apps, runtimes, masks, pins and remotes are all fetched with a single
+    `flatpak-spawn --host` round-trip, and every window reads from the same
+    snapshot instead of spawning its own `flatpak` processes.
+    """
+
+    # Same order as `flatpak list --columns=all`, with the runtime column appended
+    list_columns = "name,description,application,version,branch,arch,origin,installation,ref,active,latest,size,options,runtime"
+    section_marker = "--warehouse-section--"
+    cache_version = 2
+    cache_path = os.path.join(GLib.get_user_cache_dir(), "warehouse", "inventory.json")
+    installation_paths = ["/var/lib/flatpak", str(pathlib.Path.home()) + "/.local/share/flatpak"]
+
+    def __init__(self, new_env=None, backend="cli"):
+        # `backend` is "cli" to parse the host's `flatpak` output, or "disk" to read the installation directories directly
+        self.backend = backend
+        if new_env is None:
+            new_env = dict( os.environ )
+            new_env['LC_ALL'] = 'C'
+        self.new_env = new_env
+        self.flatpaks = [['', '']]
+        self.remotes = [['']]
+        self.system_masks = []
+        self.user_masks = []
+        self.pins = []
+        self.key = []
+        self.is_stale = False
+
+    def query(self):
+        """Runs the consolidated host query and fills the snapshot. Returns `self`."""
+        self.key = self.cacheKey() # Taken before querying, so changes made during the query invalidate the cache
+        if self.backend == "disk":
+            return self.queryInstallations()
+        commands = [
+            f"flatpak list --columns={self.list_columns}",
+            "flatpak remotes --columns=all --show-disabled",
+            "flatpak mask --system",
+            "flatpak mask --user",
+            "flatpak pin",
+        ]
+        script = f"; echo {self.section_marker}; ".join(commands)
+        output = subprocess.run(["flatpak-spawn", "--host", "sh", "-c", script], capture_output=True, text=True, env=self.new_env).stdout
+        sections = output.split(self.section_marker + "\n")
+        sections += [""] * (len(commands) - len(sections))
+
+        self.flatpaks = self.parseFlatpaks(sections[0])
+        self.remotes = self.parseRemotes(sections[1])
+        self.system_masks = self.parsePatterns(sections[2])
+        self.user_masks = self.parsePatterns(sections[3])
+        self.pins = self.parsePatterns(sections[4])
+        self.index()
+        return self
+
+    def queryInstallations(self):
+        data = InstallationReader().read()
+        self.flatpaks = sorted(data["flatpaks"], key=lambda item: item[0].lower())
+        if len(self.flatpaks) == 0:
+            self.flatpaks = [['', '']]
+        self.remotes = self.normalizeRemotes(data["remotes"])
+        if len(self.remotes) == 0:
+            self.remotes = [['']]
+        self.system_masks = data["system_masks"]
+        self.user_masks = data["user_masks"]
+        self.pins = data["pins"]
+        self.index()
+        return self
+
+    @classmethod
+    def cacheKey(cls):
+        """Returns the mtimes of the installations' change markers, deploy dirs and repo configs.
+
+        Flatpak touches `.changed` and the `app/` and `runtime/` dirs on every
+        install, uninstall and update, and rewrites `repo/config` when remotes,
+        masks or pins change, so an unchanged key means an unchanged inventory.
+        """
+        key = []
+        for installation in cls.installation_paths:
+            for marker in [".changed", "app", "runtime", "repo/config"]:
+                try:
+                    key.append(os.stat(os.path.join(installation, marker)).st_mtime_ns)
+                except OSError:
+                    key.append(0)
+        return key
+
+    @classmethod
+    def load(cls, new_env=None):
+        """Returns the snapshot saved by the last `save()`, or None if there is no usable cache.
+
+        `is_stale` is set on the returned snapshot when the installations changed since it was saved.
+        """
+        if not os.path.exists(cls.cache_path):
+            return None
+        try:
+            with open(cls.cache_path, "r") as file:
+                cache = json.load(file)
+            if cache["version"] != cls.cache_version:
+                return None
+            snapshot = cls(new_env)
+            snapshot.flatpaks = cache["flatpaks"]
+            snapshot.remotes = cache["remotes"]
+            snapshot.system_masks = cache["system_masks"]
+            snapshot.user_masks = cache["user_masks"]
+            snapshot.pins = cache["pins"]
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            print("error in inventory.InventorySnapshot.load: could not read cache:", e)
+            return None
+        snapshot.index()
+        key = cls.cacheKey()
+        # All zeros means no installation could be looked at, so nothing says the cache is still right
+        snapshot.is_stale = cache.get("key") != key or not any(key)
+        return snapshot
+
+    def save(self):
+        cache = {
+            "version": self.cache_version,
+            "key": self.key,
+            "flatpaks": self.flatpaks,
+            "remotes": self.remotes,
+            "system_masks": self.system_masks,
+            "user_masks": self.user_masks,
+            "pins": self.pins,
+        }
+        try:
+            os.makedirs(os.path.dirname(self.cache_path), exist_ok=True)
+            # Saved from more than one thread, so each save writes its own temp file
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(self.cache_path), prefix="inventory.", suffix=".tmp")
+            try:
+                with os.fdopen(fd, "w") as file:
+                    json.dump(cache, file)
+                os.replace(temp_path, self.cache_path) # Never leave a half written cache behind
+            except OSError:
+                os.remove(temp_path)
+                raise
+        except OSError as e:
+            print("error in inventory.InventorySnapshot.save: could not write cache:", e)
+
+    @staticmethod
+    def keyFor(row):
+        """Returns the identity of a `flatpak list` row: its installation and ref."""
+        return f"{row[7]}/{row[8]}"
+
+    def index(self):
+        # Derived lookups, so consumers don't walk the whole list for every question
+        self.app_ids = set()
+        self.refs = set()
+        self.eol_list = []
+        self.dependent_runtimes = []
+        if self.is_empty():
+            return
+        for row in self.flatpaks:
+            self.app_ids.add(row[2])
+            self.refs.add(row[8])
+            if "eol" in row[12]:
+                self.eol_list.append(row[8])
+            if row[13] != "" and row[13] not in self.dependent_runtimes:
+                self.dependent_runtimes.append(row[13])
+
+    def is_empty(self):
+        return self.flatpaks == [['', '']]
+
+    def is_masked(self, app_id):
+        return app_id in self.system_masks or app_id in self.user_masks
+
+    def getMasks(self, user_or_system):
+        if user_or_system == "system":
+            return self.system_masks
+        return self.user_masks
+
+    def parseFlatpaks(self, output):
+        output = output.strip()
+        if output == "":
+            # Kept identical to what an empty `flatpak list` used to produce
+            return [['', '']]
+        data = []
+        for line in output.split("\n"):
+            row = line.split("\t")
+            row += [""] * (14 - len(row))
+            data.append(row)
+        return sorted(data, key=lambda item: item[0].lower())
+
+    def parseRemotes(self, output):
+        lines = output.strip().split("\n")
+        return self.normalizeRemotes([line.split("\t") for line in lines])
+
+    @staticmethod
+    def normalizeRemotes(rows):
+        """Returns the enabled remotes among `flatpak remotes --columns=all` rows, their options column reduced to the installation.
+
+        Every backend's rows go through here, as consumers pass `--{row[7]}` straight to `flatpak`.
+        """
+        remotes = []
+        for row in rows:
+            if len(row) < 8:
+                remotes.append(row) # Not a remote, like the single empty row of no output
+                continue
+            options = row[7].split(",")
+            if "disabled" in options:
+                continue
+            # The installation always comes first, "user", "system" or the id of a custom installation
+            remotes.append(row[:7] + [options[0]] + row[8:])
+        return remotes
+
+    def parsePatterns(self, output):
+        lines = output.strip().split("\n")
+        for i in range(len(lines)):
+            lines[i] = lines[i].strip()
+        return lines
@@ -0,0 +1,41 @@
+import os
+
+class LeftoverData:
+    """The folders in the user data directory that no installed ref owns.
+
+    The set is only worked out again when the data directory's mtime or the
+    installed app ids have changed since the last `update()`.
+    """
+
+    def __init__(self, user_data_path):
+        self.user_data_path = user_data_path
+        self.dirs = []
+        self.key = None
+
+    def update(self, inventory):
+        """Recomputes the leftovers from an `InventorySnapshot` if needed. Returns True if they changed."""
+        try:
+            mtime = os.stat(self.user_data_path).st_mtime_ns
+            names = None
+        except OSError:
+            mtime = 0
+            names = []
+        key = (mtime, frozenset(inventory.app_ids))
+        if key == self.key:
+            return False
+        self.key = key
+
+        if names == None:
+            try:
+                names = os.listdir(self.user_data_path)
+            except OSError as e:
+                print("error in leftover_data.LeftoverData.update: could not list", self.user_data_path, e)
+                names = []
+        dirs = sorted([name for name in names if name not in inventory.app_ids], key=str.lower)
+        if dirs == self.dirs:
+            return False
+        self.dirs = dirs
+        return True
+
+    def invalidate(self):
+        self.key = None
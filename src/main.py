@@ -30,6 +30,7 @@ from .window import WarehouseWindow
 from .remotes_window import RemotesWindow
 from .orphans_window import OrphansWindow
 from .search_install_window import SearchInstallWindow
+from .all_snapshots_window import AllSnapshotsWindow
 from .const import Config
 
 class WarehouseApplication(Adw.Application):
@@ -53,6 +54,7 @@ class WarehouseApplication(Adw.Application):
         self.create_action("manage-data-folders", self.manage_data_shortcut, ["<primary>d"])
         self.create_action("refresh-list", self.refresh_list_shortcut, ["<primary>r", "F5"])
         self.create_action("show-remotes-window", self.show_remotes_shortcut, ["<primary>m"])
+        self.create_action("show-snapshots-window", self.show_snapshots_shortcut)
         self.create_action("set-filter", self.filters_shortcut, ["<primary>t"])
         self.create_action("install-from-file", self.install_from_file, ["<primary>o"])
         self.create_action("open-menu", self.main_menu_shortcut, ["F10"])
@@ -81,6 +83,9 @@ class WarehouseApplication(Adw.Application):
     def show_remotes_shortcut(self, widget, _):
         RemotesWindow(self.props.active_window).present()
 
+    def show_snapshots_shortcut(self, widget, _):
+        AllSnapshotsWindow(self.props.active_window).present()
+
     def filters_shortcut(self, widget, _):
         window = self.props.active_window
         window.filterWindowKeyboardHandler(window)
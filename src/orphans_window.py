@@ -1,5 +1,7 @@
 from gi.repository import Gtk, Adw, GLib, Gdk, Gio
 from .common import myUtils
+from .size_queue import SizeQueue
+from .leftover_data import LeftoverData
 import subprocess
 import os
 import pathlib
@@ -24,6 +26,9 @@ class OrphansWindow(Adw.Window):
     oepn_folder_button = Gtk.Template.Child()
     installing = Gtk.Template.Child()
     main_box = Gtk.Template.Child()
+    title_widget = Gtk.Template.Child()
+    sort_button = Gtk.Template.Child()
+    scrolled_window = Gtk.Template.Child()
 
     window_title = _("Manage Leftover Data")
     host_home = str(pathlib.Path.home())
@@ -34,6 +39,15 @@ class OrphansWindow(Adw.Window):
     no_close_id = 0
     is_result = False
 
+    def destroyHandler(self, *_args):
+        # On destroy rather than close-request, which still runs while an install blocks closing
+        self.size_cancellable.cancel()
+        if self.data_monitor != None:
+            self.data_monitor.cancel()
+        if self.data_change_timeout != 0:
+            GLib.source_remove(self.data_change_timeout)
+            self.data_change_timeout = 0
+
     def key_handler(self, _a, event, _c, _d):
         if event == Gdk.KEY_Escape:
             self.close()
@@ -57,22 +71,21 @@ class OrphansWindow(Adw.Window):
             self.trash_button.set_sensitive(True)
 
     def selectAllHandler(self, button):
+        # Only the check buttons change, the list and its size scans are left alone
         self.should_select_all = button.get_active()
-        if not button.get_active():
-            self.install_button.set_sensitive(False)
-            self.trash_button.set_sensitive(False)
-        self.generateList()
+        for select_button in self.dir_selects.values():
+            select_button.set_active(self.should_select_all)
 
     def installCallback(self, *_args):
+        self.app_window.refresh_list_of_flatpaks(self, False) # Refresh the shared inventory first, so the list below sees the new installs
         self.generateList()
         self.progress_bar.set_visible(False)
-        self.app_window.refresh_list_of_flatpaks(self, False)
         self.disconnect(self.no_close_id) # Make window able to close
         self.search_button.set_sensitive(True)
         if self.my_utils.install_success:
             self.toast_overlay.add_toast(Adw.Toast.new(_("Installed successfully")))
         else:
-            self.toast_overlay.add_toast(Adw.Toast.new(_("Could not install some apps")))
+            self.toast_overlay.add_toast(Adw.Toast.new(_("Could not install {}").format(", ".join(self.my_utils.install_fails))))
 
     def installHandler(self):
         self.main_stack.set_visible_child(self.installing)
@@ -167,73 +180,126 @@ class OrphansWindow(Adw.Window):
         except GLib.GError:
             properties_toast_overlay.add_toast(Adw.Toast.new(_("Could not open folder")))
 
-    def sizeCallBack(self, row_index):
-        row = self.list_of_data.get_row_at_index(row_index)
-        row.set_subtitle(f"~{self.data_rows[row_index][1]}")
+    def sizesCallback(self, sizes):
+        # Sizes arrive in batches, so the rows, the sort and the total are updated once per batch
+        for path, size in sizes.items():
+            dir_name = os.path.basename(path)
+            self.dir_sizes[dir_name] = size
+            self.dir_rows[dir_name].set_subtitle(f"~{self.my_utils.getSizeFormat(size)}")
+        if self.sort_button.get_active():
+            self.list_of_data.invalidate_sort()
+        self.updateTotal()
+
+    def updateTotal(self):
+        total = self.my_utils.getSizeFormat(sum(self.dir_sizes.values()))
+        if len(self.dir_sizes) < len(self.dir_rows):
+            self.title_widget.set_subtitle(_("At least {} reclaimable").format(total))
+        else:
+            self.title_widget.set_subtitle(_("{} reclaimable").format(total))
+
+    def prioritizeVisibleRows(self, *_args):
+        # Rows are at least this tall, so this many rows can fit in the view
+        row_height = 50
+        adjustment = self.scrolled_window.get_vadjustment()
+        first_row = self.list_of_data.get_row_at_y(int(adjustment.get_value()))
+        if first_row == None:
+            return
+        first_index = first_row.get_index()
+        visible = []
+        for index in range(first_index, first_index + int(adjustment.get_page_size() / row_height) + 1):
+            row = self.list_of_data.get_row_at_index(index)
+            if row == None:
+                break
+            visible.append(self.user_data_path + row.get_title())
+        self.size_queue.prioritize(visible)
+
+    def sort_func(self, row1, row2):
+        if self.sort_button.get_active():
+            # Biggest first, unmeasured folders last
+            size1 = self.dir_sizes.get(row1.get_title(), -1)
+            size2 = self.dir_sizes.get(row2.get_title(), -1)
+            if size1 != size2:
+                return -1 if size1 > size2 else 1
+        return -1 if row1.get_title().lower() < row2.get_title().lower() else 1
+
+    def dataChangedHandler(self, _monitor, _file, _other_file, event):
+        if event == Gio.FileMonitorEvent.CHANGES_DONE_HINT:
+            return
+        if self.data_change_timeout != 0:
+            GLib.source_remove(self.data_change_timeout)
+        self.data_change_timeout = GLib.timeout_add(500, self.dataChangedTimeout)
 
-    def sizeThread(self, index, path):
-        size = self.my_utils.getSizeWithFormat(path)
-        self.data_rows[index].append(size)
+    def dataChangedTimeout(self):
+        self.data_change_timeout = 0
+        if self.main_stack.get_visible_child() != self.installing:
+            self.generateList()
+        return GLib.SOURCE_REMOVE
 
-    # Create the list of folders in the window
+    # Update the list of folders in the window, if the leftovers changed
     def generateList(self):
-        self.data_rows = []
-        self.host_flatpaks = self.my_utils.getHostFlatpaks()
-
-        if self.host_flatpaks == [['', '']]:
+        if self.app_window.inventory.is_empty():
             self.app_window.toast_overlay.add_toast(Adw.Toast.new(_("Could not manage data")))
             self.this_just_crashes_the_window_so_it_doesnt_open()
             return
 
-        self.list_of_data.remove_all()
-        self.selected_dirs = []
-        self.set_title(self.window_title)
-        dir_list = os.listdir(self.user_data_path)
+        if self.leftovers.update(self.app_window.inventory):
+            self.createRows()
 
-        # This is a list that only holds IDs of install flatpaks
-        id_list = []
-        for i in range(len(self.host_flatpaks)):
-            try:
-                id_list.append(self.host_flatpaks[i][2])
-            except:
-                print("Could not get data")
+        if self.list_of_data.get_row_at_index(0) == None:
+            self.main_stack.set_visible_child(self.no_data)
+            self.action_bar.set_visible(False)
+        else:
+            self.main_stack.set_visible_child(self.main_box)
+            self.action_bar.set_visible(True)
 
-        for i in range(len(dir_list)):
-            dir_name = dir_list[i]
+    def createRows(self):
+        # Sizes still being counted belong to the rows that are about to be replaced
+        self.size_cancellable.cancel()
+        self.size_cancellable = Gio.Cancellable()
+        self.size_queue = SizeQueue(self.my_utils, self.sizesCallback, self.size_cancellable)
+        self.dir_rows = {}
+        self.dir_selects = {}
+        self.dir_sizes = {}
+        self.host_flatpaks = self.app_window.inventory.flatpaks
 
-            # Skip item if it has a matching flatpak
-            if dir_name in id_list:
-                continue
+        self.list_of_data.remove_all()
+        self.selected_dirs = []
+        self.set_title(self.window_title)
+        self.install_button.set_sensitive(False)
+        self.trash_button.set_sensitive(False)
 
+        for dir_name in self.leftovers.dirs:
             # Create row element
             dir_row = Adw.ActionRow(title=dir_name)
-            self.data_rows.append([dir_row])
+            self.dir_rows[dir_name] = dir_row
             path = self.user_data_path + dir_name
-            index = len(self.data_rows) - 1
-            task = Gio.Task.new(None, None, lambda *_, index=index: self.sizeCallBack(index))
-            task.run_in_thread(lambda _task, _obj, _data, _cancellable, *_, index=index: self.sizeThread(index, path))
+            cached_size = self.my_utils.getCachedSizeWithFormat(path)
+            if cached_size != None:
+                dir_row.set_subtitle(f"~{cached_size}") # Refined once the scan is done
 
             open_row_button = Gtk.Button(icon_name="document-open-symbolic", valign=Gtk.Align.CENTER, tooltip_text=_("Open User Data Folder"))
             open_row_button.add_css_class("flat")
-            open_row_button.connect("clicked", self.open_button_handler, (self.user_data_path + dir_name))
+            open_row_button.connect("clicked", self.open_button_handler, path)
             dir_row.add_suffix(open_row_button)
 
             select_button = Gtk.CheckButton()
             select_button.add_css_class("selection-mode")
             select_button.connect("toggled", self.selectionHandler, dir_name)
             select_button.set_active(self.should_select_all)
+            self.dir_selects[dir_name] = select_button
             dir_row.add_suffix(select_button)
             dir_row.set_activatable_widget(select_button)
 
             # Add row to list
             self.list_of_data.append(dir_row)
 
-        if self.list_of_data.get_row_at_index(0) == None:
-            self.main_stack.set_visible_child(self.no_data)
-            self.action_bar.set_visible(False)
-        else:
-            self.main_stack.set_visible_child(self.main_box)
-            self.action_bar.set_visible(True)
+        # Queued in the order they are shown, then the rows in view are moved to the front
+        row = self.list_of_data.get_row_at_index(0)
+        while row != None:
+            self.size_queue.add(self.user_data_path + row.get_title())
+            row = self.list_of_data.get_row_at_index(row.get_index() + 1)
+        self.prioritizeVisibleRows()
+        self.updateTotal()
 
     def filter_func(self, row):
         if (self.search_entry.get_text().lower() in row.get_title().lower()):
@@ -266,12 +332,23 @@ class OrphansWindow(Adw.Window):
     def __init__(self, main_window, **kwargs):
         super().__init__(**kwargs)
         self.my_utils = myUtils(self) # Access common utils and set the window to this window
-        self.host_remotes = self.my_utils.getHostRemotes()
-        self.host_flatpaks = self.my_utils.getHostFlatpaks()
+        self.app_window = main_window
+        self.host_remotes = main_window.inventory.remotes
+        self.host_flatpaks = main_window.inventory.flatpaks
 
         self.progress_bar = Gtk.ProgressBar(visible=False)
         self.progress_bar.add_css_class("osd")
-        self.app_window = main_window
+        self.size_cancellable = Gio.Cancellable()
+        self.leftovers = LeftoverData(self.user_data_path)
+        self.dir_selects = {}
+        self.data_change_timeout = 0
+        self.data_monitor = None
+        try:
+            self.data_monitor = Gio.File.new_for_path(self.user_data_path).monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+            self.data_monitor.connect("changed", self.dataChangedHandler)
+        except GLib.GError as e:
+            print("error in orphans_window: could not watch the data folder:", e)
+        self.connect("destroy", self.destroyHandler)
 
         self.set_modal(True)
         self.set_transient_for(main_window)
@@ -290,6 +367,9 @@ class OrphansWindow(Adw.Window):
         self.main_overlay.add_overlay(self.progress_bar)
 
         self.list_of_data.set_filter_func(self.filter_func)
+        self.list_of_data.set_sort_func(self.sort_func)
+        self.sort_button.connect("toggled", lambda *_: self.list_of_data.invalidate_sort())
+        self.scrolled_window.get_vadjustment().connect("value-changed", self.prioritizeVisibleRows)
         self.search_entry.connect("search-changed", self.on_invalidate)
         self.search_bar.connect("notify", self.on_change)
         self.search_bar.connect_entry(self.search_entry)
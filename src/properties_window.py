@@ -55,18 +55,26 @@ class PropertiesWindow(Adw.Window):
         self.data_row.set_subtitle(f"~{self.size}")
         self.spinner.set_visible(False)
 
+    def getSizeProgress(self, size):
+        # Called from the scanning thread
+        GLib.idle_add(lambda *_: self.data_row.set_subtitle(f"~{self.my_utils.getSizeFormat(size.allocated)}") if self.spinner.get_visible() else None)
+
     def getSizeThread(self, *args):
-        self.size = self.my_utils.getSizeWithFormat(self.user_data_path)
+        self.size = self.my_utils.getSizeWithFormat(self.user_data_path, self.size_cancellable, self.getSizeProgress)
+
+    def setIcon(self, texture):
+        if texture != None:
+            self.app_icon.set_from_paintable(texture)
 
     def generateUpper(self):
-        image = self.my_utils.findAppIcon(self.app_id)
+        self.app_icon.set_from_icon_name("application-x-executable-symbolic")
+        self.my_utils.findAppIcon(self.app_id, self.setIcon, self.app_icon.get_pixel_size())
         self.runtime.set_subtitle(self.current_flatpak[13])
-        if image.get_paintable() == None:
-            self.app_icon.set_from_icon_name(image.get_icon_name())
-        else:
-            self.app_icon.set_from_paintable(image.get_paintable())
 
         if os.path.exists(self.user_data_path):
+            cached_size = self.my_utils.getCachedSizeWithFormat(self.user_data_path)
+            if cached_size != None:
+                self.data_row.set_subtitle(f"~{cached_size}") # Refined once the scan is done
             task = Gio.Task.new(None, None, self.getSizeCallback)
             task.run_in_thread(self.getSizeThread)
         else:
@@ -145,6 +153,8 @@ class PropertiesWindow(Adw.Window):
         self.install_type = self.current_flatpak[7]
         self.app_ref = self.current_flatpak[8]
         self.user_data_path += self.app_id
+        self.size_cancellable = Gio.Cancellable()
+        self.connect("close-request", lambda *_: self.size_cancellable.cancel())
 
         self.details.connect("activated", self.show_details)
         self.runtime_copy.connect("clicked", lambda *_: self.copyItem(self.runtime.get_subtitle(), self.runtime.get_title()))
@@ -161,7 +171,7 @@ class PropertiesWindow(Adw.Window):
             self.eol_runtime_banner.set_revealed(True)
             self.eol_runtime_banner.set_title(_("{}'s runtime has reached its End of Life and will not receive any security updates").format(self.app_name))
 
-        if self.app_id in self.my_utils.getHostMasks("system") or self.app_id in self.my_utils.getHostMasks("user"):
+        if parent_window.inventory.is_masked(self.app_id):
             self.mask_banner.set_revealed(True)
             self.mask_banner.set_title(_("{} is masked and will not be updated").format(self.app_name))
 
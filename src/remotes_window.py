@@ -33,16 +33,6 @@ class RemotesWindow(Adw.Window):
     def make_toast(self, text):
         self.toast_overlay.add_toast(Adw.Toast.new(text))
 
-    def get_host_flatpaks(self):
-        output = subprocess.run(["flatpak-spawn", "--host", "flatpak", "list", "--columns=all"], capture_output=True, text=True, env=self.new_env).stdout
-        lines = output.strip().split("\n")
-        columns = lines[0].split("\t")
-        data = [columns]
-        for line in lines[1:]:
-            row = line.split("\t")
-            data.append(row)
-        return data
-
     def remove_on_response(self, _dialog, response_id, _function, index):
         if response_id == "cancel":
             return
@@ -85,7 +75,8 @@ class RemotesWindow(Adw.Window):
             self.show_disabled_button_button_content.set_icon_name("eye-not-looking-symbolic")
 
         self.host_remotes = self.my_utils.getHostRemotes()
-        self.host_flatpaks = self.get_host_flatpaks()
+        self.host_flatpaks = self.app_window.host_flatpaks
+        self.app_window.inventory.remotes = self.host_remotes # Keep the shared inventory in step with remote changes made here
         for i in range(len(self.rows_in_list)):
             self.remotes_list.remove(self.rows_in_list[i])
 
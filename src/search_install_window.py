@@ -1,18 +1,57 @@
-from gi.repository import Gtk, Adw, GLib, Gdk, Gio
+from gi.repository import Gtk, Adw, GLib, Gdk, Gio, GObject
 from .common import myUtils
 import subprocess
+from collections import OrderedDict
+from .appstream_index import AppstreamIndex
 import os
 import pathlib
 
+class SearchResultItem(GObject.Object):
+    """One `flatpak search` style result in the search list's model."""
+    __gtype_name__ = "SearchResultItem"
+
+    selected = GObject.Property(type=bool, default=False)
+
+    def __init__(self, result, **kwargs):
+        super().__init__(**kwargs)
+        self.result = result
+        self.name = result[0]
+        self.app_id = result[2]
+        self.version = result[3]
+        self.remote = result[5] if len(result) > 5 else ""
+        self.key = f"{self.remote}/{self.app_id}"
+
+class SearchResultRow(Adw.ActionRow):
+    """A recycled row of the search list, showing whichever `SearchResultItem` is bound to it."""
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.version_label = Gtk.Label(justify=Gtk.Justification.RIGHT, wrap=True, hexpand=True)
+        self.add_suffix(self.version_label)
+        self.check = Gtk.CheckButton()
+        self.check.add_css_class("selection-mode")
+        self.add_suffix(self.check)
+        self.binding = None
+
+    def bind(self, item):
+        self.set_title(GLib.markup_escape_text(item.name))
+        self.set_subtitle(item.app_id)
+        self.version_label.set_label(item.version)
+        self.binding = item.bind_property("selected", self.check, "active", GObject.BindingFlags.BIDIRECTIONAL | GObject.BindingFlags.SYNC_CREATE)
+
+    def unbind(self):
+        self.binding.unbind()
+        self.binding = None
+
 @Gtk.Template(resource_path="/io/github/flattool/Warehouse/../data/ui/search_install.ui")
-class SearchInstallWindow (Adw.Window): # TODO: stop execution of thread when search is changed
+class SearchInstallWindow (Adw.Window):
     __gtype_name__ = "SearchInstallWindow"
 
-    results_list_box = Gtk.Template.Child()
+    results_list_view = Gtk.Template.Child()
+    results_scroll = Gtk.Template.Child()
     main_stack = Gtk.Template.Child()
     main_overlay = Gtk.Template.Child()
     no_results = Gtk.Template.Child()
-    too_many = Gtk.Template.Child()
     cancel_button = Gtk.Template.Child()
     blank_page = Gtk.Template.Child()
     loading_page = Gtk.Template.Child()
@@ -21,42 +60,87 @@ class SearchInstallWindow (Adw.Window): # TODO: stop execution of thread when se
     remotes_dropdown = Gtk.Template.Child()
 
     is_debug = GLib.environ_getenv(GLib.get_environ(), "G_MESSAGES_DEBUG") == "all"
+    search_delay = 300 # ms of no typing before searching
+    search_cache_size = 32
+    page_size = 100
+    appstream_index = AppstreamIndex() # Empty until the first window loads it, then kept for the next ones
 
-    def searchResponse(self, a, b):
-        self.results_list_box.remove_all()
-        print(self.search_results)
-        if (self.is_debug and len(self.search_results) == 5) or (len(self.search_results) == 1 and len(self.search_results[0]) == 1): #This is unreliable with G_DEBUG
+    def searchResponse(self, generation):
+        data = self.pending_results.pop(generation, None)
+        key = self.pending_keys.pop(generation)
+        if generation != self.search_generation or data == None:
+            return # A newer search was started, this result is stale
+        self.search_results = data
+        self.search_cache[key] = data
+        self.search_cache.move_to_end(key)
+        while len(self.search_cache) > self.search_cache_size:
+            self.search_cache.popitem(last=False)
+        self.showResults()
+
+    def showResults(self):
+        self.results_store.remove_all()
+        self.shown_results = 0
+        if len(self.search_results) == 0 or (self.is_debug and len(self.search_results) == 5) or (len(self.search_results) == 1 and len(self.search_results[0]) == 1): #This is unreliable with G_DEBUG
             self.main_stack.set_visible_child(self.no_results)
             return
-        if len(self.search_results) > 50:
-            self.main_stack.set_visible_child(self.too_many)
-            return
         self.main_stack.set_visible_child(self.main_overlay)
-        for i in range(len(self.search_results)):
-            try:
-                print("creating row {}".format(str(i)))
-                row = Adw.ActionRow(title=GLib.markup_escape_text(self.search_results[i][0]), subtitle=self.search_results[i][2])
-                print("row {} is {}".format(str(i), self.search_results[i][0]))
-                check = Gtk.CheckButton()
-                check.add_css_class("selection-mode")
-                check.connect("toggled", self.on_check)
-                label = Gtk.Label(label=self.search_results[i][3], justify=Gtk.Justification.RIGHT, wrap=True, hexpand=True)
-                row.add_suffix(label)
-                row.add_suffix(check)
-                row.set_activatable_widget(check)
-                self.results_list_box.append(row)
-            except:
-                print("Could not create row")
-
-    def on_check(self, button):
-        print(button.get_active())
-
-    def searchThread(self):
-        command = ["flatpak-spawn", "--host", "flatpak", "search", "--columns=all", self.to_search]
-        if self.remote_to_search:
-            command += self.remote_to_search
-
-        output = subprocess.run(command, capture_output=True, text=True, env=self.new_env).stdout
+        self.results_scroll.get_vadjustment().set_value(0)
+        self.loadNextPage()
+
+    def loadNextPage(self):
+        # Results are added a page at a time as the list is scrolled, and only the rows on screen are built
+        page = self.search_results[self.shown_results : self.shown_results + self.page_size]
+        if len(page) == 0:
+            return
+        items = []
+        for result in page:
+            if len(result) < 4:
+                continue # Not a result, like an error line from `flatpak search`
+            item = SearchResultItem(result)
+            item.selected = item.key in self.selected_keys
+            item.connect("notify::selected", self.on_check)
+            items.append(item)
+        self.results_store.splice(self.results_store.get_n_items(), 0, items)
+        self.shown_results += len(page)
+
+    def scrollEdgeHandler(self, _scrolled_window, position):
+        if position == Gtk.PositionType.BOTTOM:
+            self.loadNextPage()
+
+    def on_check(self, item, _pspec):
+        # Kept by key, so a selection survives loading more pages and new searches
+        if item.selected:
+            self.selected_keys.add(item.key)
+        else:
+            self.selected_keys.discard(item.key)
+
+    def rowSetupHandler(self, _factory, list_item):
+        list_item.set_child(SearchResultRow())
+
+    def rowBindHandler(self, _factory, list_item):
+        list_item.get_child().bind(list_item.get_item())
+
+    def rowUnbindHandler(self, _factory, list_item):
+        list_item.get_child().unbind()
+
+    def rowActivateHandler(self, _list_view, position):
+        item = self.results_store.get_item(position)
+        item.selected = not item.selected
+
+    def searchThread(self, to_search, remote_to_search, generation, cancellable):
+        command = ["flatpak-spawn", "--host", "flatpak", "search", "--columns=all", to_search]
+        if remote_to_search:
+            command += remote_to_search
+
+        process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=self.new_env)
+        # Stops the search as soon as a newer one replaces it
+        handler_id = cancellable.connect("cancelled", lambda *_: process.terminate())
+        if cancellable.is_cancelled():
+            process.terminate()
+        output = process.communicate()[0]
+        cancellable.disconnect(handler_id)
+        if cancellable.is_cancelled():
+            return
         lines = output.strip().split("\n")
         columns = lines[0].split("\t")
         data = [columns]
@@ -64,17 +148,61 @@ class SearchInstallWindow (Adw.Window): # TODO: stop execution of thread when se
             row = line.split("\t")
             data.append(row)
         data = sorted(data, key=lambda item: item[0].lower())
-        self.search_results = data
+        self.pending_results[generation] = data
+
+    def indexSearchThread(self, index, to_search, remote_to_search, generation, cancellable):
+        data = index.search(to_search, remote_to_search)
+        if not cancellable.is_cancelled():
+            self.pending_results[generation] = data
+
+    def appstreamIndexThread(self, *_args):
+        self.loaded_appstream_index = AppstreamIndex().load()
+
+    def appstreamIndexCallback(self, *_args):
+        SearchInstallWindow.appstream_index = self.loaded_appstream_index
+
+    def searchChangedHandler(self, *_args):
+        if self.search_timeout != 0:
+            GLib.source_remove(self.search_timeout)
+        self.search_timeout = GLib.timeout_add(self.search_delay, self.searchTimeout)
+
+    def searchTimeout(self):
+        self.search_timeout = 0
+        self.onSearch(None)
+        return GLib.SOURCE_REMOVE
 
     def onSearch(self, widget):
+        if self.search_timeout != 0:
+            GLib.source_remove(self.search_timeout)
+            self.search_timeout = 0
+        self.search_cancellable.cancel()
+        self.search_generation += 1
+
         self.main_stack.set_visible_child(self.loading_page)
         self.to_search = self.search_entry.get_text()
-        if len(self.to_search) < 1 or " " in self.to_search:
-            self.results_list_box.remove_all()
+        if len(self.to_search.strip()) < 1 or (" " in self.to_search and self.appstream_index.is_empty()):
+            self.results_store.remove_all()
             self.main_stack.set_visible_child(self.blank_page)
             return
-        task = Gio.Task.new(None, None, self.searchResponse)
-        task.run_in_thread(lambda *_: self.searchThread())
+
+        index = self.appstream_index
+        key = (not index.is_empty(), tuple(self.remote_to_search), self.to_search)
+        if key in self.search_cache:
+            self.search_cache.move_to_end(key)
+            self.search_results = self.search_cache[key]
+            self.showResults()
+            return
+
+        generation = self.search_generation
+        cancellable = Gio.Cancellable()
+        self.search_cancellable = cancellable
+        self.pending_keys[generation] = key
+        task = Gio.Task.new(None, None, lambda *_: self.searchResponse(generation))
+        if not index.is_empty():
+            # Answered from the local appstream data, no need to ask the host
+            task.run_in_thread(lambda *_, to_search=self.to_search, remote_to_search=list(self.remote_to_search): self.indexSearchThread(index, to_search, remote_to_search, generation, cancellable))
+            return
+        task.run_in_thread(lambda *_, to_search=self.to_search, remote_to_search=list(self.remote_to_search): self.searchThread(to_search, remote_to_search, generation, cancellable))
 
     def set_choice(self, index):
         print(index)
@@ -107,6 +235,23 @@ class SearchInstallWindow (Adw.Window): # TODO: stop execution of thread when se
         self.my_utils = myUtils(self)
         self.search_results = []
         self.to_search = ""
+        self.search_timeout = 0
+        self.search_generation = 0
+        self.search_cancellable = Gio.Cancellable()
+        self.search_cache = OrderedDict() # (remotes, query) to results, most recently used last
+        self.pending_results = {}
+        self.pending_keys = {}
+        self.shown_results = 0
+        self.selected_keys = set()
+        self.results_store = Gio.ListStore(item_type=SearchResultItem)
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self.rowSetupHandler)
+        factory.connect("bind", self.rowBindHandler)
+        factory.connect("unbind", self.rowUnbindHandler)
+        self.results_list_view.set_factory(factory)
+        self.results_list_view.set_model(Gtk.NoSelection(model=self.results_store))
+        self.results_list_view.connect("activate", self.rowActivateHandler)
+        self.results_scroll.connect("edge-reached", self.scrollEdgeHandler)
         self.new_env = dict( os.environ )
         self.new_env['LC_ALL'] = 'C'
         event_controller = Gtk.EventControllerKey()
@@ -121,15 +266,20 @@ class SearchInstallWindow (Adw.Window): # TODO: stop execution of thread when se
         self.search_entry.connect("activate", self.onSearch)
         self.search_button.connect("clicked", self.onSearch)
         self.search_entry.connect("changed", lambda *_: self.search_entry.grab_focus())
-        # self.search_entry.set_key_capture_widget(self.results_list_box)
+        self.search_entry.connect("changed", self.searchChangedHandler)
+        self.connect("close-request", lambda *_: self.search_cancellable.cancel())
         self.search_entry.grab_focus()
 
-        self.host_remotes = self.my_utils.getHostRemotes()
+        self.host_remotes = parent_window.inventory.remotes
         if len(self.host_remotes) > 1:
             self.remotesChooserCreator()
 
         self.remote_to_search = []
         self.main_stack.set_visible_child(self.blank_page)
 
+        # Also reloaded when already loaded, to pick up remotes whose appstream data was updated
+        task = Gio.Task.new(None, None, self.appstreamIndexCallback)
+        task.run_in_thread(self.appstreamIndexThread)
+
         
         
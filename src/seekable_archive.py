@@ -0,0 +1,198 @@
+from collections import deque
+import hashlib
+import json
+import os
+import struct
+import subprocess
+import zlib
+
+class FrameWriter:
+    """A file object that compresses what is written to it as independent zstd frames, on a thread pool.
+
+    Every `frame_size` bytes of input become a frame of their own, so any
+    part of the output can later be decompressed without the frames before
+    it. `finish()` appends the member index and a seek table in zstd's
+    seekable format. Both are skippable frames, which `zstd -d` and
+    `tar --zstd` step over, so the result is still a plain `.tar.zst`.
+    Everything written to `file` is hashed on the way, `hash.hexdigest()`
+    is the checksum of the whole archive once `finish()` returns.
+    """
+
+    def __init__(self, file, level, frame_size, executor, max_pending):
+        self.file = file
+        self.level = level
+        self.frame_size = frame_size
+        self.executor = executor
+        self.max_pending = max_pending
+        self.buffer = bytearray()
+        self.pending = deque() # (decompressed size, future of the compressed frame), in file order
+        self.frames = [] # (compressed size, decompressed size) of every frame written
+        self.hash = hashlib.blake2b(digest_size=32)
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.frame_size:
+            self.submit(bytes(self.buffer[:self.frame_size]))
+            del self.buffer[:self.frame_size]
+        return len(data)
+
+    def writeFile(self, data):
+        self.hash.update(data)
+        self.file.write(data)
+
+    def compress(self, data):
+        command = ["zstd", "-q", f"-{self.level}", "-c"]
+        return subprocess.run(command, input=data, stdout=subprocess.PIPE, check=True).stdout
+
+    def submit(self, data):
+        # Frames wait in memory until written, so only a few may be ahead of the file
+        if len(self.pending) >= self.max_pending:
+            self.writeFrame()
+        self.pending.append((len(data), self.executor.submit(self.compress, data)))
+
+    def writeFrame(self):
+        size, future = self.pending.popleft()
+        compressed = future.result()
+        self.writeFile(compressed)
+        self.frames.append((len(compressed), size))
+
+    def finish(self, members):
+        if len(self.buffer) > 0:
+            self.submit(bytes(self.buffer))
+            self.buffer = bytearray()
+        while len(self.pending) > 0:
+            self.writeFrame()
+
+        index = zlib.compress(json.dumps(members, separators=(",", ":")).encode())
+        self.writeFile(struct.pack("<II", SeekableArchive.index_magic, len(index)) + index)
+
+        table = b"".join(struct.pack("<II", compressed, decompressed) for compressed, decompressed in self.frames)
+        table += struct.pack("<IBI", len(self.frames), 0, SeekableArchive.seekable_magic)
+        self.writeFile(struct.pack("<II", SeekableArchive.seek_table_magic, len(table)) + table)
+
+class FrameReader:
+    """A file object reading the decompressed bytes `start` to `end` of a `SeekableArchive`.
+
+    Only the frames holding that range are read. The next few are decompressed
+    on the thread pool while the current one is consumed. `counter` is called
+    with the compressed size of every frame used.
+    """
+
+    def __init__(self, archive, start, end, executor, max_pending, counter=None):
+        self.archive = archive
+        self.executor = executor
+        self.max_pending = max_pending
+        self.counter = counter
+        self.frames = deque(frame for frame in archive.frames if frame[2] + frame[3] > start and frame[2] < end)
+        self.skip = start - self.frames[0][2] if len(self.frames) > 0 else 0
+        self.remaining = end - start
+        self.pending = deque()
+        self.buffer = b""
+        self.position = 0
+
+    def fill(self):
+        while len(self.pending) < self.max_pending and len(self.frames) > 0:
+            frame = self.frames.popleft()
+            self.pending.append((frame[1], self.executor.submit(self.archive.decompressFrame, frame)))
+
+    def read(self, size=-1):
+        chunks = []
+        wanted = self.remaining if size < 0 else min(size, self.remaining)
+        while wanted > 0:
+            if self.position == len(self.buffer):
+                self.fill()
+                if len(self.pending) == 0:
+                    break
+                compressed_size, future = self.pending.popleft()
+                self.buffer = future.result()
+                self.position = min(self.skip, len(self.buffer))
+                self.skip -= self.position
+                if self.counter != None:
+                    self.counter(compressed_size)
+                continue
+            data = self.buffer[self.position:self.position + wanted]
+            self.position += len(data)
+            wanted -= len(data)
+            self.remaining -= len(data)
+            chunks.append(data)
+        return b"".join(chunks)
+
+class SeekableArchive:
+    """A `.tar.zst` written by `FrameWriter`: its seek table and the index of its members.
+
+    Each member of the index is a dict with the member's "path", "type",
+    "size", "mode" and "mtime", and the "start" and "end" of its tar headers
+    and data in the decompressed stream. Hard links also have the "link" they
+    point to, except in archives of older versions.
+    """
+
+    seek_table_magic = 0x184D2A5E
+    seekable_magic = 0x8F92EAB1
+    index_magic = 0x184D2A51 # Any of the 16 skippable frame magics works, the seek table uses the last one
+    footer_size = 9
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = [] # (compressed offset, compressed size, decompressed offset, decompressed size)
+        self.members = []
+
+    @classmethod
+    def open(cls, path):
+        """Returns the archive at `path` if it has a seek table and member index, else None."""
+        archive = cls(path)
+        try:
+            with open(path, "rb") as file:
+                if archive.readIndex(file):
+                    return archive
+        except (OSError, ValueError, struct.error, zlib.error) as e:
+            print("error in seekable_archive.SeekableArchive.open: could not read index of", path, e)
+        return None
+
+    def readIndex(self, file):
+        file.seek(0, os.SEEK_END)
+        if file.tell() < self.footer_size + 8:
+            return False
+        file.seek(-self.footer_size, os.SEEK_END)
+        frame_count, descriptor, magic = struct.unpack("<IBI", file.read(self.footer_size))
+        if magic != self.seekable_magic:
+            return False # Written as a single frame by an older Warehouse or by tar
+        entry_size = 12 if descriptor & 0x80 else 8
+        file.seek(-(self.footer_size + frame_count * entry_size), os.SEEK_END)
+        table = file.read(frame_count * entry_size)
+
+        compressed_offset = 0
+        decompressed_offset = 0
+        for i in range(frame_count):
+            compressed, decompressed = struct.unpack_from("<II", table, i * entry_size)
+            self.frames.append((compressed_offset, compressed, decompressed_offset, decompressed))
+            compressed_offset += compressed
+            decompressed_offset += decompressed
+
+        # The member index directly follows the last frame
+        file.seek(compressed_offset)
+        magic, size = struct.unpack("<II", file.read(8))
+        if magic != self.index_magic:
+            return False
+        self.members = json.loads(zlib.decompress(file.read(size)))
+        return True
+
+    def compressedSize(self):
+        return sum(frame[1] for frame in self.frames)
+
+    def decompressFrame(self, frame):
+        # `os.pread` doesn't move a shared offset, so frames can be read from many threads
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            data = os.pread(fd, frame[1], frame[0])
+        finally:
+            os.close(fd)
+        return subprocess.run(["zstd", "-d", "-q", "-c"], input=data, stdout=subprocess.PIPE, check=True).stdout
+
+    def reader(self, executor, max_pending, start=0, end=None, counter=None):
+        if end == None:
+            end = self.frames[-1][2] + self.frames[-1][3] if len(self.frames) > 0 else 0
+        return FrameReader(self, start, end, executor, max_pending, counter)
+
+    def membersUnder(self, path):
+        """Returns the members at `path` and, if it is a folder, below it."""
+        return [member for member in self.members if member["path"] == path or member["path"].startswith(path + "/")]
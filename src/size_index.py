@@ -0,0 +1,105 @@
+from gi.repository import GLib
+import json
+import os
+import sqlite3
+import threading
+
+class IndexedDirectory:
+    """What a directory held the last time it was listed: the size of its own files and its subdirectories."""
+
+    def __init__(self, inode, mtime, apparent, allocated, subdirs):
+        self.inode = inode
+        self.mtime = mtime
+        self.apparent = apparent
+        self.allocated = allocated
+        self.subdirs = subdirs
+
+class SizeIndex:
+    """Remembers directory sizes across sessions, so unchanged directories are not listed again.
+
+    Each directory is stored with its inode and mtime. A directory's mtime
+    changes whenever an entry is added, removed or renamed in it, so while
+    both match, the stored size of its own files and its list of
+    subdirectories still hold. A file that grows in place does not touch its
+    directory's mtime, which is the price of not stat-ing every file again.
+    Totals of the last full scan of a folder are kept as well, to be shown
+    while it is being scanned again.
+    """
+
+    index_path = os.path.join(GLib.get_user_cache_dir(), "warehouse", "sizes.sqlite")
+    shared = None
+    shared_lock = threading.Lock()
+
+    @classmethod
+    def getShared(cls):
+        with cls.shared_lock:
+            if cls.shared == None:
+                cls.shared = cls(cls.index_path)
+            return cls.shared
+
+    def __init__(self, index_path):
+        self.lock = threading.Lock()
+        self.connection = None
+        try:
+            os.makedirs(os.path.dirname(index_path), exist_ok=True)
+            # Scans run in several threads, every use of the connection goes through `self.lock`
+            self.connection = sqlite3.connect(index_path, check_same_thread=False)
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS directories (path TEXT PRIMARY KEY, inode INTEGER, mtime INTEGER, apparent INTEGER, allocated INTEGER, subdirs TEXT);
+                CREATE TABLE IF NOT EXISTS totals (path TEXT PRIMARY KEY, apparent INTEGER, allocated INTEGER);
+            """)
+        except (OSError, sqlite3.Error) as e:
+            print("error in size_index.SizeIndex: could not open index, sizes will not be remembered:", e)
+            self.connection = None
+
+    def lookup(self, path, info):
+        """Returns the `IndexedDirectory` for `path` if it is still valid for the `os.stat_result` `info`, else None."""
+        if self.connection == None:
+            return None
+        try:
+            with self.lock:
+                row = self.connection.execute("SELECT inode, mtime, apparent, allocated, subdirs FROM directories WHERE path = ?", (path,)).fetchone()
+        except sqlite3.Error as e:
+            print("error in size_index.SizeIndex.lookup:", e)
+            return None
+        if row == None or row[0] != info.st_ino or row[1] != info.st_mtime_ns:
+            return None
+        return IndexedDirectory(row[0], row[1], row[2], row[3], json.loads(row[4]))
+
+    def store(self, directories):
+        """Saves a dict of path to `IndexedDirectory`, and forgets the subdirectories that are gone."""
+        if self.connection == None or len(directories) == 0:
+            return
+        try:
+            with self.lock, self.connection:
+                for path, directory in directories.items():
+                    previous = self.connection.execute("SELECT subdirs FROM directories WHERE path = ?", (path,)).fetchone()
+                    if previous != None:
+                        for subdir in set(json.loads(previous[0])) - set(directory.subdirs):
+                            self.connection.execute("DELETE FROM directories WHERE path = ? OR path LIKE ? ESCAPE '\\'", (subdir, subdir.replace("%", "\\%").replace("_", "\\_") + "/%"))
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO directories VALUES (?, ?, ?, ?, ?, ?)",
+                        (path, directory.inode, directory.mtime, directory.apparent, directory.allocated, json.dumps(directory.subdirs)),
+                    )
+        except sqlite3.Error as e:
+            print("error in size_index.SizeIndex.store:", e)
+
+    def getTotal(self, path):
+        """Returns the (apparent, allocated) size of the last complete scan of `path`, or None."""
+        if self.connection == None:
+            return None
+        try:
+            with self.lock:
+                return self.connection.execute("SELECT apparent, allocated FROM totals WHERE path = ?", (path,)).fetchone()
+        except sqlite3.Error as e:
+            print("error in size_index.SizeIndex.getTotal:", e)
+            return None
+
+    def setTotal(self, path, apparent, allocated):
+        if self.connection == None:
+            return
+        try:
+            with self.lock, self.connection:
+                self.connection.execute("INSERT OR REPLACE INTO totals VALUES (?, ?, ?)", (path, apparent, allocated))
+        except sqlite3.Error as e:
+            print("error in size_index.SizeIndex.setTotal:", e)
@@ -0,0 +1,68 @@
+from gi.repository import GLib, Gio
+
+class SizeQueue:
+    """Measures many folders a few at a time, front of the queue first.
+
+    Only `max_running` scans run at once, since each already spreads over the
+    scanner's thread pool. `prioritize()` moves paths to the front, e.g. the
+    rows that were scrolled into view. Finished sizes are handed to
+    `results_callback` as a dict of path to allocated bytes, in batches of
+    whatever finished during the last `batch_interval` ms.
+    """
+
+    max_running = 2
+    batch_interval = 250
+
+    def __init__(self, my_utils, results_callback, cancellable):
+        self.my_utils = my_utils
+        self.results_callback = results_callback
+        self.cancellable = cancellable
+        self.waiting = []
+        self.running = 0
+        self.scanned = {} # Written by the scan threads, one key each
+        self.finished = {}
+        self.flush_timeout = 0
+
+    def add(self, path):
+        self.waiting.append(path)
+        self.startNext()
+
+    def prioritize(self, paths):
+        front = [path for path in paths if path in self.waiting]
+        if len(front) == 0:
+            return
+        self.waiting = front + [path for path in self.waiting if path not in front]
+
+    def startNext(self):
+        while self.running < self.max_running and len(self.waiting) > 0 and not self.cancellable.is_cancelled():
+            path = self.waiting.pop(0)
+            self.running += 1
+            task = Gio.Task.new(None, self.cancellable, lambda *_, path=path: self.scanCallback(path))
+            task.run_in_thread(lambda *_, path=path: self.scanThread(path))
+
+    def scanThread(self, path):
+        self.scanned[path] = self.my_utils.getDirectorySize(path, self.cancellable)
+
+    def scanCallback(self, path):
+        self.running -= 1
+        size = self.scanned.pop(path, None)
+        if self.cancellable.is_cancelled():
+            return
+        if size != None:
+            self.finished[path] = size
+        if self.flush_timeout == 0:
+            self.flush_timeout = GLib.timeout_add(self.batch_interval, self.flush)
+        self.startNext()
+
+    def flush(self):
+        self.flush_timeout = 0
+        if self.cancellable.is_cancelled():
+            return False
+        batch = self.finished
+        self.finished = {}
+        if len(batch) > 0:
+            self.results_callback(batch)
+        return False
+
+    def is_done(self):
+        return self.running == 0 and len(self.waiting) == 0 and self.flush_timeout == 0
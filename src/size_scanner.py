@@ -0,0 +1,154 @@
+from concurrent.futures import ThreadPoolExecutor
+import os
+import stat
+import threading
+from .size_index import IndexedDirectory
+
+class DirectorySize:
+    """The result of a scan. `allocated` is what the files take up on disk, like `du` reports."""
+
+    def __init__(self, apparent=0, allocated=0):
+        self.apparent = apparent
+        self.allocated = allocated
+
+    def add(self, other):
+        self.apparent += other.apparent
+        self.allocated += other.allocated
+
+class SizeScanner:
+    """Measures directory trees, splitting the top level subtrees across a shared thread pool.
+
+    Hardlinked files are counted once, the scan does not cross into other
+    filesystems, and it stops early when its `Gio.Cancellable` is cancelled.
+    `progress_callback`, if given, is called with the running `DirectorySize`
+    from the scanning thread every time a subtree is done.
+    """
+
+    max_workers = min(8, (os.cpu_count() or 1) + 2)
+    pool = None
+    pool_lock = threading.Lock()
+
+    @classmethod
+    def getPool(cls):
+        with cls.pool_lock:
+            if cls.pool == None:
+                cls.pool = ThreadPoolExecutor(max_workers=cls.max_workers, thread_name_prefix="size-scanner")
+            return cls.pool
+
+    def __init__(self, cancellable=None, progress_callback=None, index=None):
+        # `index` is a `SizeIndex`, directories it still knows are not listed again
+        self.cancellable = cancellable
+        self.progress_callback = progress_callback
+        self.index = index
+        self.seen_inodes = set()
+        self.lock = threading.Lock()
+        self.total = DirectorySize()
+        self.listed = {}
+
+    def is_cancelled(self):
+        return self.cancellable != None and self.cancellable.is_cancelled()
+
+    def scan(self, path):
+        """Returns the `DirectorySize` of `path`, which may also be a single file.
+
+        A cancelled scan returns what was counted so far. This blocks, so it
+        should be called from a thread, never from the pool itself.
+        """
+        self.total = DirectorySize()
+        self.listed = {}
+        try:
+            root = os.lstat(path)
+        except OSError:
+            return self.total
+        if not stat.S_ISDIR(root.st_mode):
+            self.addFile(root)
+            return self.total
+
+        directory = self.scanDirectory(path, root, root.st_dev)
+        if directory == None:
+            return self.total
+        self.merge(DirectorySize(directory.apparent, directory.allocated))
+
+        pool = self.getPool()
+        futures = [pool.submit(self.scanSubtree, subdir, root.st_dev) for subdir in directory.subdirs]
+        for future in futures:
+            if self.is_cancelled():
+                future.cancel()
+                continue
+            self.merge(future.result())
+
+        if self.index != None:
+            # Every listed directory is complete on its own, so they are kept even when cancelled
+            self.index.store(self.listed)
+            if not self.is_cancelled():
+                self.index.setTotal(path, self.total.apparent, self.total.allocated)
+        return self.total
+
+    def scanSubtree(self, path, device):
+        # Walked iteratively, so a pool thread never waits on another pool task
+        size = DirectorySize()
+        directories = [path]
+        while len(directories) > 0:
+            if self.is_cancelled():
+                break
+            path = directories.pop()
+            try:
+                info = os.lstat(path)
+            except OSError:
+                continue # Removed while scanning
+            directory = self.scanDirectory(path, info, device)
+            if directory == None:
+                continue
+            size.apparent += directory.apparent
+            size.allocated += directory.allocated
+            directories += directory.subdirs
+        return size
+
+    def scanDirectory(self, path, info, device):
+        """Returns an `IndexedDirectory` with the size of the directory and its own files, and its subdirectories on `device`."""
+        if self.index != None:
+            directory = self.index.lookup(path, info)
+            if directory != None:
+                return directory
+
+        directory = IndexedDirectory(info.st_ino, info.st_mtime_ns, info.st_size, info.st_blocks * 512, [])
+        try:
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    try:
+                        entry_info = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    if stat.S_ISDIR(entry_info.st_mode):
+                        if entry_info.st_dev == device:
+                            directory.subdirs.append(entry.path)
+                    elif self.is_first_link(entry_info):
+                        directory.apparent += entry_info.st_size
+                        directory.allocated += entry_info.st_blocks * 512
+        except OSError as e:
+            print("error in size_scanner.SizeScanner.scanDirectory: could not list", path, e)
+            return None
+        with self.lock:
+            self.listed[path] = directory
+        return directory
+
+    def is_first_link(self, info):
+        if info.st_nlink < 2:
+            return True
+        with self.lock:
+            inode = (info.st_dev, info.st_ino)
+            if inode in self.seen_inodes:
+                return False
+            self.seen_inodes.add(inode)
+            return True
+
+    def addFile(self, info):
+        if self.is_first_link(info):
+            self.merge(DirectorySize(info.st_size, info.st_blocks * 512))
+
+    def merge(self, size):
+        with self.lock:
+            self.total.add(size)
+            partial = DirectorySize(self.total.apparent, self.total.allocated)
+        if self.progress_callback != None:
+            self.progress_callback(partial)
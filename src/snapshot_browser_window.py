@@ -0,0 +1,148 @@
+from gi.repository import Gtk, Adw, GLib, Gdk, Gio
+from .common import myUtils
+import os
+
+@Gtk.Template(resource_path="/io/github/flattool/Warehouse/../data/ui/snapshot_browser.ui")
+class SnapshotBrowserWindow(Adw.Window):
+    __gtype_name__ = "SnapshotBrowserWindow"
+
+    title_widget = Gtk.Template.Child()
+    back_button = Gtk.Template.Child()
+    toast_overlay = Gtk.Template.Child()
+    main_stack = Gtk.Template.Child()
+    loading = Gtk.Template.Child()
+    loading_label = Gtk.Template.Child()
+    progress_bar = Gtk.Template.Child()
+    outerbox = Gtk.Template.Child()
+    entries_list = Gtk.Template.Child()
+    no_index = Gtk.Template.Child()
+    empty_folder = Gtk.Template.Child()
+
+    def key_handler(self, _a, event, _c, _d):
+        if event == Gdk.KEY_Escape:
+            self.close()
+
+    def loadThread(self):
+        self.members = self.parent_window.makeEngine(self.file).listMembers(self.snapshot_path)
+
+    def loadCallback(self):
+        if self.members == None:
+            self.main_stack.set_visible_child(self.no_index)
+            return
+        # Folder path to the members directly inside of it, "" being the snapshot's top
+        self.children = {"": []}
+        for member in self.members:
+            path = os.path.normpath(member["path"])
+            if path == ".":
+                continue
+            self.children.setdefault(os.path.dirname(path), []).append(member)
+            if member["type"] == "dir":
+                self.children.setdefault(path, [])
+        self.showFolder("")
+
+    def showFolder(self, folder):
+        self.current_folder = folder
+        self.back_button.set_sensitive(folder != "")
+        self.title_widget.set_subtitle(folder)
+
+        while self.entries_list.get_row_at_index(0) != None:
+            self.entries_list.remove(self.entries_list.get_row_at_index(0))
+        members = sorted(self.children.get(folder, []), key=lambda member: (member["type"] != "dir", os.path.basename(member["path"]).lower()))
+        if len(members) == 0:
+            self.main_stack.set_visible_child(self.empty_folder)
+            return
+        for member in members:
+            self.create_row(member)
+        self.main_stack.set_visible_child(self.outerbox)
+
+    def create_row(self, member):
+        path = os.path.normpath(member["path"])
+        row = Adw.ActionRow(title=GLib.markup_escape_text(os.path.basename(path)))
+        if member["type"] == "dir":
+            row.set_activatable(True)
+            row.connect("activated", lambda *_: self.showFolder(path))
+            row.add_suffix(Gtk.Image(icon_name="go-next-symbolic"))
+        elif member["type"] == "symlink":
+            row.set_subtitle(_("Link"))
+        else:
+            row.set_subtitle(GLib.format_size(member["size"]))
+
+        restore = Gtk.Button(icon_name="check-plain-symbolic", valign=Gtk.Align.CENTER, tooltip_text=_("Restore"))
+        restore.connect("clicked", lambda *_: self.restorePath(path))
+        restore.add_css_class("flat")
+        row.add_prefix(restore)
+        self.entries_list.append(row)
+
+    def progressCallback(self, progress):
+        fraction = progress.fraction
+        GLib.idle_add(lambda *_: self.progress_bar.set_fraction(fraction))
+
+    def restorePath(self, path):
+        self.restored = False
+        replaced_dir = self.parent_window.makeReplacedDir()
+
+        def thread():
+            engine = self.parent_window.makeEngine(self.file, self.progressCallback)
+            self.restored = engine.restorePath(self.snapshot_path, self.parent_window.app_user_data, path, replaced_dir)
+            self.parent_window.trashReplaced(replaced_dir)
+
+        def callback():
+            try:
+                self.disconnect(self.no_close_id) # Make window able to close
+            except:
+                pass
+            if self.restored:
+                self.toast_overlay.add_toast(Adw.Toast.new(_("Restored {}").format(os.path.basename(path))))
+            else:
+                self.toast_overlay.add_toast(Adw.Toast.new(_("Could not restore {}").format(os.path.basename(path))))
+            self.showFolder(self.current_folder)
+
+        def on_response(dialog, response, func):
+            if response == "cancel":
+                return
+            self.no_close_id = self.connect("close-request", lambda event: True)  # Make window unable to close
+            self.loading_label.set_label(_("Restoring…"))
+            self.progress_bar.set_fraction(0)
+            self.progress_bar.set_visible(True)
+            self.main_stack.set_visible_child(self.loading)
+            task = Gio.Task.new(None, None, lambda *_: callback())
+            task.run_in_thread(lambda *_: thread())
+
+        if replaced_dir != None:
+            body = _("{} will be restored from this snapshot, and what it replaces will be sent to the trash.").format(path)
+        else:
+            body = _("{} will be restored from this snapshot, and what it replaces will be deleted.").format(path)
+        dialog = Adw.MessageDialog.new(self, _("Restore From Snapshot?"), body)
+        dialog.add_response("cancel", _("Cancel"))
+        dialog.set_close_response("cancel")
+        dialog.add_response("continue", _("Restore"))
+        dialog.set_response_appearance("continue", Adw.ResponseAppearance.DESTRUCTIVE)
+        dialog.connect("response", on_response, dialog.choose_finish)
+        dialog.present()
+
+    def __init__(self, parent_window, file, snapshot_title, **kwargs):
+        super().__init__(**kwargs)
+
+        # Variables
+        self.my_utils = myUtils(self)
+        self.parent_window = parent_window
+        self.file = file
+        self.snapshot_path = parent_window.snapshots_of_app_path + file
+        self.members = None
+        self.children = {}
+        self.current_folder = ""
+        self.progress_bar.set_visible(False)
+
+        # Calls
+        self.back_button.connect("clicked", lambda *_: self.showFolder(os.path.dirname(self.current_folder)))
+        event_controller = Gtk.EventControllerKey()
+        event_controller.connect("key-pressed", self.key_handler)
+        self.add_controller(event_controller)
+
+        # Window stuffs
+        self.set_title(snapshot_title)
+        self.set_transient_for(parent_window)
+        self.set_size_request(260, 230)
+
+        task = Gio.Task.new(None, None, lambda *_: self.loadCallback())
+        task.run_in_thread(lambda *_: self.loadThread())
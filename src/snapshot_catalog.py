@@ -0,0 +1,182 @@
+from .chunk_store import ChunkStore
+import json
+import os
+import threading
+
+class SnapshotCatalog:
+    """What is known about every snapshot of every app, written when a snapshot is made.
+
+    Each snapshot's app, version, creation time, compressed and uncompressed
+    size, file count and checksum are kept in `catalog.json` at the top of the
+    snapshots folder, so snapshot lists are drawn without reading the
+    snapshots themselves. The mtime of each app's snapshots folder is kept
+    too: when it no longer matches, files were added or removed behind
+    Warehouse's back and only that folder is listed again, keeping the
+    records of files whose size didn't change. Snapshots found that way have
+    no uncompressed size, file count or checksum.
+    """
+
+    archive_suffix = ".tar.zst"
+    shared = None
+    shared_lock = threading.Lock()
+
+    @classmethod
+    def getShared(cls, snapshots_path):
+        with cls.shared_lock:
+            if cls.shared == None:
+                cls.shared = cls(snapshots_path)
+            return cls.shared
+
+    def __init__(self, snapshots_path):
+        self.snapshots_path = snapshots_path
+        self.catalog_path = os.path.join(snapshots_path, "catalog.json")
+        self.lock = threading.Lock()
+        self.snapshots = {} # "<app id>/<file name>" to the snapshot's record
+        self.folders = {} # App id to the mtime of its folder when the catalog last matched it
+        self.load()
+
+    def load(self):
+        try:
+            with open(self.catalog_path, "r") as file:
+                catalog = json.load(file)
+            self.snapshots = catalog["snapshots"]
+            self.folders = catalog["folders"]
+        except (OSError, ValueError, KeyError) as e:
+            if os.path.exists(self.catalog_path):
+                print("error in snapshot_catalog.SnapshotCatalog.load: could not read catalog, listing snapshots again:", e)
+            self.snapshots = {}
+            self.folders = {}
+
+    def save(self):
+        try:
+            temp_path = self.catalog_path + ".tmp"
+            with open(temp_path, "w") as file:
+                json.dump({"snapshots": self.snapshots, "folders": self.folders}, file)
+            os.replace(temp_path, self.catalog_path)
+        except OSError as e:
+            print("error in snapshot_catalog.SnapshotCatalog.save: could not write catalog:", e)
+
+    def folderMtime(self, app_id):
+        try:
+            return os.stat(os.path.join(self.snapshots_path, app_id)).st_mtime_ns
+        except OSError:
+            return 0
+
+    def is_snapshot(self, file_name):
+        return file_name.endswith(self.archive_suffix) or file_name.endswith(ChunkStore.manifest_suffix)
+
+    def makeRecord(self, app_id, app_name, file_name, uncompressed_size=None, file_count=None, compressed_size=None, checksum=None):
+        """Returns the record of a snapshot file, reading what wasn't given from the file itself."""
+        name = file_name.removesuffix(self.archive_suffix).removesuffix(ChunkStore.manifest_suffix).split("_", 1)
+        path = os.path.join(self.snapshots_path, app_id, file_name)
+        is_chunked = file_name.endswith(ChunkStore.manifest_suffix)
+        if is_chunked and (compressed_size == None or uncompressed_size == None):
+            manifest = ChunkStore(self.snapshots_path).readManifest(path)
+            compressed_size = manifest["stored_size"]
+            uncompressed_size = manifest["total_size"]
+            file_count = len([entry for entry in manifest["entries"] if entry["type"] == "file"])
+        file_size = os.stat(path).st_size
+        if not is_chunked and compressed_size == None:
+            compressed_size = file_size
+        return {
+            "app_id": app_id,
+            "app_name": app_name,
+            "file": file_name,
+            "version": name[1] if len(name) > 1 else "",
+            "created": int(name[0]),
+            "format": "chunks" if is_chunked else "archive",
+            "compressed_size": compressed_size,
+            "file_size": file_size,
+            "uncompressed_size": uncompressed_size,
+            "file_count": file_count,
+            "checksum": checksum,
+        }
+
+    def add(self, record):
+        with self.lock:
+            self.snapshots[f"{record['app_id']}/{record['file']}"] = record
+            self.folders[record["app_id"]] = self.folderMtime(record["app_id"])
+            self.save()
+
+    def remove(self, app_id, file_name):
+        with self.lock:
+            self.snapshots.pop(f"{app_id}/{file_name}", None)
+            self.folders[app_id] = self.folderMtime(app_id)
+            self.save()
+
+    def refreshApp(self, app_id, app_name=None):
+        """Lists an app's snapshots folder again if it changed since the catalog last matched it."""
+        mtime = self.folderMtime(app_id)
+        with self.lock:
+            seen = self.folders.get(app_id)
+            if seen == mtime:
+                return
+            known = {record["file"]: record for record in self.snapshots.values() if record["app_id"] == app_id}
+
+        # Unknown snapshots are read without the lock, so windows drawing their lists don't wait on the disk
+        app_path = os.path.join(self.snapshots_path, app_id)
+        try:
+            files = [name for name in os.listdir(app_path) if self.is_snapshot(name)]
+        except OSError:
+            files = []
+        records = {}
+        for file_name in files:
+            record = known.get(file_name)
+            if record != None and not self.sizeMatches(app_id, record):
+                record = None # Replaced by another file of the same name
+            if record == None:
+                try:
+                    record = self.makeRecord(app_id, app_name or app_id, file_name)
+                except (OSError, ValueError, KeyError) as e:
+                    print("error in snapshot_catalog.SnapshotCatalog.refreshApp: skipping", file_name, e)
+                    continue
+            records[f"{app_id}/{file_name}"] = record
+
+        with self.lock:
+            if self.folders.get(app_id) != seen:
+                return # A snapshot was added or removed meanwhile, which is newer than this listing
+            for key, record in list(self.snapshots.items()):
+                if record["app_id"] == app_id:
+                    del self.snapshots[key]
+            self.snapshots.update(records)
+            if len(files) == 0:
+                self.folders.pop(app_id, None)
+            else:
+                self.folders[app_id] = mtime
+            self.save()
+
+    def sizeMatches(self, app_id, record):
+        # Records from before "file_size" was kept only have it for archives, where it's the compressed size
+        expected = record.get("file_size", record["compressed_size"] if record["format"] == "archive" else None)
+        try:
+            return os.stat(os.path.join(self.snapshots_path, app_id, record["file"])).st_size == expected
+        except OSError:
+            return False
+
+    def refreshAll(self):
+        """Lists the folders of apps that gained, lost or changed snapshots since the catalog last matched them."""
+        try:
+            app_ids = [name for name in os.listdir(self.snapshots_path) if not name.startswith(".") and os.path.isdir(os.path.join(self.snapshots_path, name))]
+        except OSError:
+            app_ids = []
+        for app_id in set(app_ids) | set(self.folders):
+            self.refreshApp(app_id)
+
+    def forApp(self, app_id):
+        """Returns the records of an app's snapshots, oldest first."""
+        with self.lock:
+            records = [record for record in self.snapshots.values() if record["app_id"] == app_id]
+        return sorted(records, key=lambda record: record["created"])
+
+    def apps(self):
+        """Returns a dict of app id to the records of its snapshots, oldest first."""
+        apps = {}
+        with self.lock:
+            for record in self.snapshots.values():
+                apps.setdefault(record["app_id"], []).append(record)
+        for records in apps.values():
+            records.sort(key=lambda record: record["created"])
+        return apps
+
+    def totalSize(self, records):
+        return sum(record["compressed_size"] or 0 for record in records)
@@ -0,0 +1,427 @@
+from .seekable_archive import FrameWriter, SeekableArchive
+from concurrent.futures import ThreadPoolExecutor
+import os
+import shutil
+import stat
+import subprocess
+import tarfile
+import threading
+import time
+
+class SnapshotProgress:
+    """Where a `SnapshotEngine` is at. `files_total` is 0 when it isn't known, as when restoring an archive."""
+
+    def __init__(self):
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.files_done = 0
+        self.files_total = 0
+        self.fraction = 0.0
+
+class PaddedReader:
+    """Reads exactly `size` bytes of a file that may change while it is archived.
+
+    A file that shrank is padded with zeros and one that grew is cut off, as
+    GNU tar does, so the archive stays readable either way.
+    """
+
+    def __init__(self, file, size, counter):
+        self.file = file
+        self.remaining = size
+        self.counter = counter
+        self.changed = False
+
+    def read(self, size=-1):
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        if len(data) < size:
+            self.changed = True
+            data += bytes(size - len(data))
+        self.remaining -= len(data)
+        self.counter(len(data))
+        return data
+
+class RestoredMembers:
+    """What a restore has gone through so far: the paths the snapshot has and its folders, whose attributes are set last."""
+
+    def __init__(self, target_dir, replaced_dir):
+        self.target_dir = os.path.realpath(target_dir)
+        self.replaced_dir = replaced_dir
+        self.wanted = set()
+        self.dirs = []
+
+    def setDirAttributes(self):
+        # Restoring a folder's files changed its mtime
+        for path, member in reversed(self.dirs):
+            os.chmod(path, member.mode)
+            os.utime(path, (member.mtime, member.mtime))
+
+class SnapshotEngine:
+    """Writes and restores the `.tar.zst` snapshots of an app's user data.
+
+    The data folder is scanned once for the number of files and bytes it holds,
+    then streamed as a tar through a `FrameWriter`, which compresses it as
+    independent zstd frames at the given level on all cores and indexes its
+    members. Restoring decompresses those frames on all cores too, and single
+    files or folders can be restored from only the frames that hold them.
+    Archives of older Warehouse versions have a single frame, they are fed to
+    `zstd` from a second thread while the tar stream is unpacked.
+    `progress_callback` is called with a `SnapshotProgress`, at most
+    `max_updates_per_second` times.
+    """
+
+    copy_buffer_size = 1024 * 1024
+    max_updates_per_second = 30
+    default_level = 3
+    frame_size = 4 * 1024 * 1024
+    max_workers = os.cpu_count() or 1
+
+    def __init__(self, progress_callback=None, level=default_level):
+        self.progress_callback = progress_callback
+        self.level = min(max(level, 1), 19) # Higher levels need `--ultra` and lots of memory
+        self.progress = SnapshotProgress()
+        self.last_update = 0
+        self.lock = threading.Lock()
+        self.checksum = None # Of the file written by `create()`
+
+    def scan(self, source_dir):
+        """Returns the paths under `source_dir`, parents first, and counts their files and bytes."""
+        paths = []
+        linked = set() # Hard links are archived once, the other names only point to them
+        to_scan = [source_dir]
+        while len(to_scan) > 0:
+            directory = to_scan.pop()
+            try:
+                entries = sorted(os.scandir(directory), key=lambda entry: entry.name)
+            except OSError as e:
+                print("error in snapshot_engine.SnapshotEngine.scan: could not list", directory, e)
+                continue
+            subdirs = []
+            for entry in entries:
+                paths.append(entry.path)
+                try:
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirs.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        info = entry.stat(follow_symlinks=False)
+                        self.progress.files_total += 1
+                        if info.st_nlink > 1:
+                            if (info.st_dev, info.st_ino) in linked:
+                                continue
+                            linked.add((info.st_dev, info.st_ino))
+                        self.progress.bytes_total += info.st_size
+                except OSError:
+                    pass
+            to_scan += reversed(subdirs)
+        return paths
+
+    def create(self, source_dir, archive_path):
+        """Archives `source_dir` into `archive_path`, returns True on success. Blocks, so call it from a thread."""
+        paths = self.scan(source_dir)
+        self.update(force=True)
+        temp_path = archive_path + ".part"
+        members = []
+        try:
+            with open(temp_path, "wb") as file, ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                writer = FrameWriter(file, self.level, self.frame_size, executor, self.max_workers * 2)
+                with tarfile.open(fileobj=writer, mode="w|", format=tarfile.PAX_FORMAT, copybufsize=self.copy_buffer_size) as archive:
+                    for path in paths:
+                        member = self.addPath(archive, path, os.path.relpath(path, source_dir))
+                        if member != None:
+                            members.append(member)
+                writer.finish(members)
+                self.checksum = writer.hash.hexdigest()
+        except (OSError, tarfile.TarError, subprocess.CalledProcessError) as e:
+            print("error in snapshot_engine.SnapshotEngine.create: could not write", archive_path, e)
+            self.removePartial(temp_path)
+            return False
+        os.replace(temp_path, archive_path)
+        self.update(force=True)
+        return True
+
+    def addPath(self, archive, path, name):
+        """Adds a file to the archive, returns its entry for the member index or None if it was skipped."""
+        try:
+            info = archive.gettarinfo(path, name)
+        except OSError as e:
+            print("error in snapshot_engine.SnapshotEngine.addPath: skipping", path, e)
+            return None
+        if info == None:
+            return None # Sockets can't be archived
+        member = {"path": name, "type": self.memberType(info), "size": info.size, "mode": info.mode, "mtime": info.mtime, "start": archive.offset}
+        if not info.isreg():
+            archive.addfile(info)
+            if info.islnk():
+                member["link"] = info.linkname
+                self.count(0, 1)
+            member["end"] = archive.offset
+            return member
+        try:
+            file = open(path, "rb")
+        except OSError as e:
+            print("error in snapshot_engine.SnapshotEngine.addPath: skipping", path, e)
+            self.count(info.size, 1)
+            return None
+        with file:
+            reader = PaddedReader(file, info.size, lambda size: self.count(size, 0))
+            archive.addfile(info, reader)
+        if reader.changed:
+            print("error in snapshot_engine.SnapshotEngine.addPath: file changed as it was read", path)
+        self.count(0, 1)
+        member["end"] = archive.offset
+        return member
+
+    def memberType(self, info):
+        if info.isdir():
+            return "dir"
+        if info.issym():
+            return "symlink"
+        if info.islnk():
+            return "link"
+        return "file"
+
+    def listMembers(self, archive_path):
+        """Returns the member index of an archive, or None if it has none. Does file IO, so call it from a thread."""
+        archive = SeekableArchive.open(archive_path)
+        if archive == None:
+            return None
+        return archive.members
+
+    def restore(self, archive_path, target_dir, replaced_dir=None):
+        """Makes `target_dir` match `archive_path`, returns True on success. Blocks, so call it from a thread.
+
+        Files that already match the archive's size and mtime are left alone,
+        the others are written again and files the archive doesn't have are
+        removed. Anything replaced or removed is moved into `replaced_dir`
+        when one is given, and deleted otherwise.
+        """
+        try:
+            self.progress.bytes_total = os.stat(archive_path).st_size
+        except OSError as e:
+            print("error in snapshot_engine.SnapshotEngine.restore:", e)
+            return False
+        seekable = SeekableArchive.open(archive_path)
+        if seekable == None:
+            return self.restoreSingleFrame(archive_path, target_dir, replaced_dir)
+
+        self.progress.files_total = len([member for member in seekable.members if member["type"] in ["file", "link"]])
+        self.update(force=True)
+        restored = RestoredMembers(target_dir, replaced_dir)
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                reader = seekable.reader(executor, self.max_workers * 2, counter=lambda size: self.count(size, 0))
+                self.restoreStream(reader, restored)
+            self.removeExtras(target_dir, "", restored.wanted, replaced_dir)
+            restored.setDirAttributes()
+            succeeded = True
+        except (OSError, tarfile.TarError, subprocess.CalledProcessError) as e:
+            print("error in snapshot_engine.SnapshotEngine.restore: could not restore", archive_path, e)
+            succeeded = False
+        self.update(force=True)
+        return succeeded
+
+    def restorePath(self, archive_path, target_dir, path, replaced_dir=None):
+        """Restores only the file or folder at `path` in the archive, returns True on success. Blocks, so call it from a thread."""
+        seekable = SeekableArchive.open(archive_path)
+        if seekable == None:
+            return False
+        restored = RestoredMembers(target_dir, replaced_dir)
+        try:
+            self.memberPath(restored.target_dir, path) # Folders outside of the target are never looked at
+            with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                members = self.withLinkTargets(seekable, seekable.membersUnder(path), executor)
+                self.progress.bytes_total = sum(member["size"] for member in members)
+                self.progress.files_total = len([member for member in members if member["type"] in ["file", "link"]])
+                self.update(force=True)
+
+                # A folder's subfolders follow its files in the tar, so its members can be in several runs
+                runs = []
+                for member in members:
+                    if len(runs) > 0 and runs[-1][1] == member["start"]:
+                        runs[-1][1] = member["end"]
+                    else:
+                        runs.append([member["start"], member["end"]])
+                for start, end in runs:
+                    self.restoreStream(seekable.reader(executor, self.max_workers * 2, start, end), restored, count_bytes=True)
+            if any(member["path"] == path and member["type"] == "dir" for member in members):
+                self.removeExtras(restored.target_dir, path, restored.wanted, replaced_dir)
+            restored.setDirAttributes()
+            succeeded = True
+        except (OSError, KeyError, tarfile.TarError, subprocess.CalledProcessError) as e: # KeyError is a hard link whose target is missing
+            print("error in snapshot_engine.SnapshotEngine.restorePath: could not restore", path, "from", archive_path, e)
+            succeeded = False
+        self.update(force=True)
+        return succeeded
+
+    def withLinkTargets(self, seekable, members, executor):
+        """Returns `members` and the files their hard links point to, in archive order.
+
+        A hard link is made from the file it points to, which has to be
+        restored first even when it is outside of the chosen folder.
+        """
+        names = set(member["path"] for member in members)
+        by_path = {member["path"]: member for member in seekable.members}
+        targets = {}
+        for member in members:
+            if member["type"] != "link":
+                continue
+            link = member.get("link")
+            if link == None:
+                link = self.readLinkName(seekable, member, executor)
+            link = os.path.normpath(link)
+            if link not in names and link in by_path:
+                targets[link] = by_path[link]
+        return sorted(members + list(targets.values()), key=lambda member: member["start"])
+
+    def readLinkName(self, seekable, member, executor):
+        # Indexes written by older versions don't have the target, but the member's tar header does
+        reader = seekable.reader(executor, 1, member["start"], member["end"])
+        with tarfile.open(fileobj=reader, mode="r|") as archive:
+            return archive.next().linkname
+
+    def restoreSingleFrame(self, archive_path, target_dir, replaced_dir):
+        try:
+            process = subprocess.Popen(["zstd", "-d", "-q", "-c", "-T0"], stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+        except OSError as e:
+            print("error in snapshot_engine.SnapshotEngine.restoreSingleFrame:", e)
+            return False
+        self.update(force=True)
+
+        # Bytes fed to zstd are the compressed bytes read, which gives the progress
+        feeder = threading.Thread(target=self.feed, args=(archive_path, process.stdin), daemon=True)
+        feeder.start()
+        restored = RestoredMembers(target_dir, replaced_dir)
+        try:
+            self.restoreStream(process.stdout, restored)
+            self.removeExtras(target_dir, "", restored.wanted, replaced_dir)
+            restored.setDirAttributes()
+            succeeded = True
+        except (OSError, tarfile.TarError) as e:
+            print("error in snapshot_engine.SnapshotEngine.restoreSingleFrame: could not restore", archive_path, e)
+            process.kill()
+            succeeded = False
+        feeder.join()
+        process.stdout.close()
+        if process.wait() != 0:
+            succeeded = False
+        self.update(force=True)
+        return succeeded
+
+    def restoreStream(self, fileobj, restored, count_bytes=False):
+        """Restores the members of a tar stream that differ from what is in the target. `count_bytes` counts their sizes as progress."""
+        # The "tar" filter keeps permissions and links but refuses paths outside of the target
+        extract_args = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+        target_dir = restored.target_dir
+        with tarfile.open(fileobj=fileobj, mode="r|", copybufsize=self.copy_buffer_size) as archive:
+            for member in archive:
+                name = os.path.normpath(member.name)
+                if name == ".":
+                    continue
+                # Checked before anything is moved aside, the "tar" filter only looks once extracting
+                path = self.memberPath(target_dir, name)
+                restored.wanted.add(name)
+                live = self.liveInfo(path)
+                is_file = member.isreg() or member.islnk()
+                if member.isdir():
+                    restored.dirs.append((path, member))
+                    if live != None and stat.S_ISDIR(live.st_mode):
+                        continue
+                elif self.is_unchanged(member, path, live):
+                    if is_file:
+                        self.count(member.size if count_bytes else 0, 1)
+                    continue
+                if live != None:
+                    self.moveAside(path, name, restored.replaced_dir)
+                archive.extract(member, target_dir, set_attrs=not member.isdir(), **extract_args)
+                if is_file:
+                    self.count(member.size if count_bytes else 0, 1)
+
+    def memberPath(self, target_dir, name):
+        """Returns where the member `name` goes in `target_dir`, raises `tarfile.ExtractError` if that is outside of it."""
+        path = os.path.normpath(os.path.join(target_dir, name))
+        # The parent is resolved as well, a symlinked folder could lead anywhere
+        if os.path.commonpath([os.path.realpath(os.path.dirname(path)), target_dir]) != target_dir:
+            raise tarfile.ExtractError(f"{name} is outside of the snapshot")
+        return path
+
+    def is_unchanged(self, member, path, live):
+        if live == None:
+            return False
+        if member.issym():
+            return stat.S_ISLNK(live.st_mode) and os.readlink(path) == member.linkname
+        if member.isreg():
+            # Archives written by GNU tar only have whole seconds
+            return stat.S_ISREG(live.st_mode) and live.st_size == member.size and int(live.st_mtime) == int(member.mtime)
+        return False # Hard links are cheap to make again
+
+    def liveInfo(self, path):
+        try:
+            return os.lstat(path)
+        except OSError:
+            return None
+
+    def moveAside(self, path, name, replaced_dir):
+        """Moves `path` into `replaced_dir` under its snapshot relative `name`, or deletes it."""
+        if replaced_dir == None:
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.remove(path)
+            return
+        destination = os.path.join(replaced_dir, name)
+        os.makedirs(os.path.dirname(destination), exist_ok=True)
+        os.replace(path, destination)
+
+    def removeExtras(self, target_dir, name, wanted, replaced_dir):
+        """Moves aside everything below `name` that the snapshot doesn't have."""
+        for entry in os.scandir(os.path.join(target_dir, name)):
+            entry_name = os.path.join(name, entry.name)
+            if entry_name not in wanted:
+                self.moveAside(entry.path, entry_name, replaced_dir)
+            elif entry.is_dir(follow_symlinks=False):
+                self.removeExtras(target_dir, entry_name, wanted, replaced_dir)
+
+    def feed(self, archive_path, pipe):
+        try:
+            with open(archive_path, "rb") as file:
+                while True:
+                    data = file.read(self.copy_buffer_size)
+                    if len(data) == 0:
+                        break
+                    pipe.write(data)
+                    self.count(len(data), 0)
+        except OSError as e:
+            print("error in snapshot_engine.SnapshotEngine.feed:", e)
+        finally:
+            try:
+                pipe.close()
+            except OSError:
+                pass
+
+    def removePartial(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def count(self, size, files):
+        with self.lock:
+            self.progress.bytes_done += size
+            self.progress.files_done += files
+        self.update()
+
+    def update(self, force=False):
+        progress = self.progress
+        if progress.bytes_total > 0:
+            progress.fraction = min(progress.bytes_done / progress.bytes_total, 1.0)
+        elif progress.files_total > 0:
+            progress.fraction = progress.files_done / progress.files_total
+
+        if self.progress_callback == None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_update < 1 / self.max_updates_per_second:
+            return
+        self.last_update = now
+        self.progress_callback(progress)
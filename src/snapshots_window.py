@@ -1,5 +1,9 @@
 from gi.repository import Gtk, Adw, GLib, Gdk, Gio
 from .common import myUtils
+from .snapshot_engine import SnapshotEngine
+from .chunk_store import ChunkStore, ChunkSnapshotEngine
+from .snapshot_catalog import SnapshotCatalog
+from .snapshot_browser_window import SnapshotBrowserWindow
 import subprocess
 import os
 import pathlib
@@ -14,6 +18,9 @@ class SnapshotsWindow(Adw.Window):
     host_home = str(pathlib.Path.home())
     user_data_path = host_home + "/.var/app/"
     snapshots_path = host_home + "/.var/app/io.github.flattool.Warehouse/data/Snapshots/"
+    # Files a restore replaces are gathered here, so they go to the trash as one folder
+    replaced_path = host_home + "/.var/app/io.github.flattool.Warehouse/data/Replaced/"
+    archive_suffix = ".tar.zst"
 
     snapshots_group = Gtk.Template.Child()
     main_stack = Gtk.Template.Child()
@@ -25,6 +32,9 @@ class SnapshotsWindow(Adw.Window):
     loading = Gtk.Template.Child()
     loading_label = Gtk.Template.Child()
     action_bar = Gtk.Template.Child()
+    progress_bar = Gtk.Template.Child()
+    progress_label = Gtk.Template.Child()
+    title_widget = Gtk.Template.Child()
 
     def showListOrEmpty(self):
         try:
@@ -33,58 +43,58 @@ class SnapshotsWindow(Adw.Window):
             pass
 
         self.action_bar.set_revealed(True)
-        if os.path.exists(self.snapshots_of_app_path):
-            if len(os.listdir(self.snapshots_of_app_path)) > 0:
-                self.main_stack.set_visible_child(self.outerbox)
-                return "list"
+        self.updateTotal()
+        if len(self.catalog.forApp(self.app_id)) > 0:
+            self.main_stack.set_visible_child(self.outerbox)
+            return "list"
         self.open_folder_button.set_sensitive(False)
         self.main_stack.set_visible_child(self.no_snapshots)
         return "empty"
 
+    def updateTotal(self):
+        records = self.catalog.forApp(self.app_id)
+        if len(records) == 0:
+            self.title_widget.set_subtitle("")
+        else:
+            self.title_widget.set_subtitle(_("{} of snapshots").format(self.my_utils.getSizeFormat(self.catalog.totalSize(records))))
+
     def generateList(self):
-        if not os.path.exists(self.app_user_data):
-            self.new_snapshot.set_sensitive(False)
+        has_user_data = os.path.exists(self.app_user_data)
+        if not has_user_data:
             self.new_snapshot.set_tooltip_text(_("There is no User Data to Snapshot"))
+        self.new_snapshot.set_sensitive(False) # Until the list is drawn, so a new snapshot's row isn't added twice
 
-        if self.showListOrEmpty() == "empty":
-            return
-
-        snapshot_files = os.listdir(self.snapshots_of_app_path)
-        to_trash = []
-        
-        for i in range(len(snapshot_files)):
-            if not snapshot_files[i].endswith(".tar.zst"):
-                # Find all files that aren't snapshots
-                to_trash.append(snapshot_files[i])
-
-        for i in range(len(to_trash)):
-            # Trash all files that aren't snapshots
-            a = self.my_utils.trashFolder(f"{self.snapshots_of_app_path}{to_trash[i]}")
-            if a == 0:
-                snapshot_files.remove(to_trash[i])
-
-        if len(snapshot_files) == 0:
-            self.main_stack.set_visible_child(self.no_snapshots)
-            return
+        def callback():
+            self.new_snapshot.set_sensitive(has_user_data)
+            if self.showListOrEmpty() == "empty":
+                return
+            for record in self.catalog.forApp(self.app_id):
+                self.create_row(record)
 
-        for i in range(len(snapshot_files)):
-            self.create_row(snapshot_files[i])
+        # Only lists the snapshots folder when something changed it outside of Warehouse
+        task = Gio.Task.new(None, None, lambda *_: callback())
+        task.run_in_thread(lambda *_: self.catalog.refreshApp(self.app_id, self.app_name))
 
-    def create_row(self, file):
-        def sizeThread(*args):
-            size = self.my_utils.getSizeWithFormat(self.snapshots_of_app_path + file)
-            GLib.idle_add(lambda *_a: row.set_subtitle(f"~{size}"))
+    def is_chunked(self, file):
+        return file.endswith(ChunkStore.manifest_suffix)
 
-        split_file = file.removesuffix(".tar.zst").split("_")
-        time = GLib.DateTime.new_from_unix_local(int(split_file[0])).format("%x %X")
+    def create_row(self, record):
+        file = record["file"]
+        time = GLib.DateTime.new_from_unix_local(record["created"]).format("%x %X")
         row = Adw.ActionRow(title=time)
+        subtitle = f"~{self.my_utils.getSizeFormat(record['compressed_size'])}"
+        if record["file_count"] != None:
+            subtitle = _("{}, {} files").format(subtitle, record["file_count"])
+        row.set_subtitle(subtitle)
 
-        task = Gio.Task()
-        task.run_in_thread(sizeThread)
-        
-        label = Gtk.Label(label=_("Version {}").format(split_file[1]), hexpand=True, wrap=True, justify=Gtk.Justification.RIGHT)
+        label = Gtk.Label(label=_("Version {}").format(record["version"]), hexpand=True, wrap=True, justify=Gtk.Justification.RIGHT)
         row.add_suffix(label)
 
+        browse = Gtk.Button(icon_name="folder-visiting-symbolic", valign=Gtk.Align.CENTER, tooltip_text=_("Browse Snapshot"))
+        browse.connect("clicked", self.browse_snapshot, file, row)
+        browse.add_css_class("flat")
+        row.add_suffix(browse)
+
         apply = Gtk.Button(icon_name="check-plain-symbolic", valign=Gtk.Align.CENTER)
         apply.connect("clicked", self.apply_snapshot, file, row)
         apply.add_css_class("flat")
@@ -102,67 +112,139 @@ class SnapshotsWindow(Adw.Window):
         def on_response(dialog, response, func):
             if response == "cancel":
                 return
-            a = self.my_utils.trashFolder(self.snapshots_of_app_path + file)
+            if self.is_chunked(file):
+                # Its chunks are collected below, so a manifest restored from the trash would point at nothing
+                try:
+                    os.remove(self.snapshots_of_app_path + file)
+                    a = 0
+                except OSError as e:
+                    print("error in snapshots_window.trash_snapshot: could not delete snapshot:", e)
+                    a = 1
+            else:
+                a = self.my_utils.trashFolder(self.snapshots_of_app_path + file)
             if a == 0:
                 self.snapshots_group.remove(row)
                 if not self.snapshots_group.get_row_at_index(0):
                     self.my_utils.trashFolder(self.snapshots_of_app_path)
-                    self.showListOrEmpty()
+                self.catalog.remove(self.app_id, file)
+                self.showListOrEmpty()
+                if self.is_chunked(file):
+                    # Drop the chunks only the deleted snapshot used
+                    task = Gio.Task()
+                    task.run_in_thread(lambda *_: self.chunk_store.collectGarbage())
             else:
-                self.toast_overlay.add_toast(Adw.Toast.new(_("Could not trash snapshot")))
-
-        dialog = Adw.MessageDialog.new(self, _("Trash Snapshot?"), _("This snapshot and its contents will be sent to the trash."))
+                self.toast_overlay.add_toast(Adw.Toast.new(_("Could not delete snapshot") if self.is_chunked(file) else _("Could not trash snapshot")))
+
+        if self.is_chunked(file):
+            dialog = Adw.MessageDialog.new(self, _("Delete Snapshot?"), _("This snapshot and the data only it uses will be permanently deleted."))
+            continue_label = _("Delete Snapshot")
+        else:
+            dialog = Adw.MessageDialog.new(self, _("Trash Snapshot?"), _("This snapshot and its contents will be sent to the trash."))
+            continue_label = _("Trash Snapshot")
         dialog.add_response("cancel", _("Cancel"))
         dialog.set_close_response("cancel")
-        dialog.add_response("continue", _("Trash Snapshot"))
+        dialog.add_response("continue", continue_label)
         dialog.set_response_appearance("continue", Adw.ResponseAppearance.DESTRUCTIVE)
         dialog.connect("response", on_response, dialog.choose_finish)
         dialog.present()
 
+    def progressCallback(self, progress):
+        # Called from the engine's thread, so copy the numbers before they change
+        values = (progress.fraction, progress.bytes_done, progress.bytes_total, progress.files_done, progress.files_total)
+        GLib.idle_add(lambda *_: self.showProgress(*values))
+
+    def showProgress(self, fraction, bytes_done, bytes_total, files_done, files_total):
+        self.progress_bar.set_fraction(fraction)
+        if files_total > 0:
+            self.progress_label.set_label(_("{} of {}, {} of {} files").format(GLib.format_size(bytes_done), GLib.format_size(bytes_total), files_done, files_total))
+        else:
+            self.progress_label.set_label(_("{} files").format(files_done))
+
+    def showLoading(self, label):
+        self.no_close_id = self.connect("close-request", lambda event: True)  # Make window unable to close
+        self.loading_label.set_label(label)
+        self.progress_bar.set_fraction(0)
+        self.progress_label.set_label("")
+        self.action_bar.set_revealed(False)
+        self.main_stack.set_visible_child(self.loading)
+
     def createSnapshot(self):
         epoch = int(time.time())
+        level = self.settings.get_int("snapshot-compression-level")
+        if self.settings.get_string("snapshot-format") == "chunks":
+            file_name = f"{epoch}_{self.app_version}{ChunkStore.manifest_suffix}"
+        else:
+            file_name = f"{epoch}_{self.app_version}{self.archive_suffix}"
 
         def thread():
-            try:
-                subprocess.run(
-                    ['tar', 'cafv', f"{self.snapshots_of_app_path}{epoch}_{self.app_version}.tar.zst", "-C", f"{self.app_user_data}", "."],
-                    check=True, env=self.new_env
-                )
-            except subprocess.CalledProcessError as e:
-                print("Error in snapshots_windopw.py: createSnapshot():", e)
+            if self.is_chunked(file_name):
+                engine = ChunkSnapshotEngine(self.chunk_store, self.progressCallback)
+            else:
+                engine = SnapshotEngine(self.progressCallback, level)
+            path = self.snapshots_of_app_path + file_name
+            if not engine.create(self.app_user_data, path):
+                print("error in snapshots_window.createSnapshot.thread: could not create snapshot")
                 GLib.idle_add(lambda *_a: self.toast_overlay.add_toast(Adw.Toast.new(_("Could not create snapshot"))))
+            else:
+                try:
+                    if self.is_chunked(file_name):
+                        compressed_size = engine.stored_size
+                    else:
+                        compressed_size = os.stat(path).st_size
+                    record = self.catalog.makeRecord(self.app_id, self.app_name, file_name, engine.progress.bytes_done,
+                        engine.progress.files_done, compressed_size, engine.checksum)
+                    self.catalog.add(record)
+                except (OSError, ValueError) as e:
+                    print("error in snapshots_window.createSnapshot.thread: could not add snapshot to the catalog:", e)
             if(int(time.time()) == epoch): # Wait 1s if the snapshot is made too quickly, to prevent overriding a snapshot file
                 subprocess.run(['sleep', '1s'])
 
-        # `tar -tf filepath` to see the contents of a tar file
-
         def callback():
             if self.showListOrEmpty() == "list":
-                self.create_row(f"{epoch}_{self.app_version}.tar.zst")
+                for record in self.catalog.forApp(self.app_id):
+                    if record["file"] == file_name:
+                        self.create_row(record)
 
         if not os.path.exists(self.snapshots_of_app_path):
             file = Gio.File.new_for_path(self.snapshots_of_app_path)
             file.make_directory()
 
-        self.no_close_id = self.connect("close-request", lambda event: True)  # Make window unable to close
-        self.loading_label.set_label(_("Creating Snapshot…"))
-        self.action_bar.set_revealed(False)
-        self.main_stack.set_visible_child(self.loading)
+        self.showLoading(_("Creating Snapshot…"))
 
         task = Gio.Task.new(None, None, lambda *_: callback())
         task.run_in_thread(lambda *_: thread())
 
+    def makeEngine(self, file, progress_callback=None):
+        if self.is_chunked(file):
+            return ChunkSnapshotEngine(self.chunk_store, progress_callback)
+        return SnapshotEngine(progress_callback)
+
+    def makeReplacedDir(self):
+        # None when replaced files should be deleted rather than trashed
+        if not self.settings.get_boolean("snapshot-trash-replaced"):
+            return None
+        return f"{self.replaced_path}{self.app_id}-{int(time.time())}"
+
+    def trashReplaced(self, replaced_dir):
+        if replaced_dir == None or not os.path.exists(replaced_dir):
+            return
+        self.my_utils.trashFolder(replaced_dir)
+        try:
+            os.rmdir(self.replaced_path)
+        except OSError:
+            pass
+
+    def browse_snapshot(self, button, file, row):
+        SnapshotBrowserWindow(self, file, row.get_title()).present()
+
     def apply_snapshot(self, button, file, row):
         self.applied = False
+        replaced_dir = self.makeReplacedDir()
+
         def thread():
-            try:
-                subprocess.run(
-                    ['tar', '--zstd', '-xvf', f"{self.snapshots_of_app_path}{file}", "-C", f"{self.app_user_data}"],
-                    check=True, env=self.new_env
-                )
-                self.applied = True
-            except subprocess.CalledProcessError as e:
-                print("error in snapshots_window.apply_snapshot.thread: CalledProcessError:", e)
+            engine = self.makeEngine(file, self.progressCallback)
+            self.applied = engine.restore(f"{self.snapshots_of_app_path}{file}", self.app_user_data, replaced_dir)
+            self.trashReplaced(replaced_dir)
 
         def callback():
             if not self.applied:
@@ -170,34 +252,30 @@ class SnapshotsWindow(Adw.Window):
             else:
                 self.toast_overlay.add_toast(Adw.Toast.new(_("Snapshot applied")))
 
+            self.new_snapshot.set_sensitive(True)
             self.new_snapshot.set_tooltip_text("")
             self.showListOrEmpty()
 
         def on_response(dialog, response, func):
             if response == "cancel":
                 return
-            to_apply = self.snapshots_of_app_path + file
-            to_trash = self.app_user_data
-            if os.path.exists(to_trash):
-                a = self.my_utils.trashFolder(to_trash)
-                if a != 0:
-                    self.toast_overlay.add_toast(Adw.Toast.new(_("Could not apply snapshot")))
-                    return
-            data = Gio.File.new_for_path(self.app_user_data)
-            data.make_directory()
-            if not os.path.exists(data.get_path()):
+            try:
+                os.makedirs(self.app_user_data, exist_ok=True)
+            except OSError as e:
+                print("error in snapshots_window.apply_snapshot.on_response: could not create user data folder:", e)
                 self.toast_overlay.add_toast(Adw.Toast.new(_("Could not apply snapshot")))
                 return
 
-            self.no_close_id = self.connect("close-request", lambda event: True)  # Make window unable to close
-            self.loading_label.set_label(_("Applying Snapshot…"))
-            self.action_bar.set_revealed(False)
-            self.main_stack.set_visible_child(self.loading)
+            self.showLoading(_("Applying Snapshot…"))
 
             task = Gio.Task.new(None, None, lambda *_: callback())
             task.run_in_thread(lambda *_: thread())
-        
-        dialog = Adw.MessageDialog.new(self, _("Apply Snapshot?"), _("Applying this snapshot will trash any current user data for {}.").format(self.app_name))
+
+        if replaced_dir != None:
+            body = _("Files of {} that differ from this snapshot will be replaced, and files it doesn't have will be removed. Replaced and removed files are sent to the trash.").format(self.app_name)
+        else:
+            body = _("Files of {} that differ from this snapshot will be replaced, and files it doesn't have will be deleted.").format(self.app_name)
+        dialog = Adw.MessageDialog.new(self, _("Apply Snapshot?"), body)
         dialog.add_response("cancel", _("Cancel"))
         dialog.set_close_response("cancel")
         dialog.add_response("continue", _("Apply Snapshot"))
@@ -220,6 +298,9 @@ class SnapshotsWindow(Adw.Window):
 
         # Variables
         self.my_utils = myUtils(self)
+        self.settings = Gio.Settings.new("io.github.flattool.Warehouse")
+        self.chunk_store = ChunkStore(self.snapshots_path)
+        self.catalog = SnapshotCatalog.getShared(self.snapshots_path)
         self.app_name = flatpak_row[0]
         self.app_id = flatpak_row[2]
         self.app_version = flatpak_row[3]
@@ -0,0 +1,123 @@
+import re
+import subprocess
+import time
+
+class TransactionProgress:
+    """Where a `FlatpakTransaction` is at. `eta` is in seconds, None until it can be estimated."""
+
+    def __init__(self):
+        self.bytes_done = 0
+        self.bytes_total = 0
+        self.current_ref = ""
+        self.eta = None
+        self.fraction = 0.0
+
+class FlatpakTransaction:
+    """A single `flatpak install` or `flatpak remove` run on the host for many refs at once.
+
+    Flatpak resolves dependencies and reads the remote's summary once for the
+    whole transaction instead of once per ref. Its output is streamed while it
+    runs: the download sizes come from the table it prints first, and each
+    operation's percentage from its progress line. `progress_callback` is
+    called with a `TransactionProgress`, at most `max_updates_per_second` times.
+    """
+
+    # The rows of the table of operations, like " 1. [ ] org.gnome.Platform  45  i  flathub  < 320.3 MB (partial)"
+    table_row_pattern = re.compile(r"^\s*(\d+)\.\s+(?:\[.\]\s+)?(\S+)\s.*?<\s*([\d.,]+)\s*([kKMGT]?i?B)")
+    # Lines like "Installing 2/5… ████▌   45%  3.2 MB/s", as printed for each operation of the transaction
+    operation_pattern = re.compile(r"(Installing|Updating|Uninstalling)\s+(\d+)/(\d+)")
+    percent_pattern = re.compile(r"(\d+)%")
+    units = {"B": 1, "kB": 1000, "KB": 1000, "MB": 1000**2, "GB": 1000**3, "TB": 1000**4, "KiB": 1024, "MiB": 1024**2, "GiB": 1024**3, "TiB": 1024**4}
+    max_updates_per_second = 30
+
+    def __init__(self, verb, installation, refs, remote=None, privileged=False, new_env=None, progress_callback=None):
+        # `verb` is "install" or "remove", `installation` is "user" or "system"
+        self.verb = verb
+        self.installation = installation
+        self.refs = refs
+        self.remote = remote
+        self.privileged = privileged
+        self.new_env = new_env
+        self.progress_callback = progress_callback
+        self.progress = TransactionProgress()
+        self.operation_sizes = {} # Operation number to download size in bytes
+        self.operation_ids = {}
+        self.operation = 0
+        self.operation_count = 0
+        self.operation_percent = 0
+        self.started = None
+        self.last_update = 0
+        self.output = []
+
+    def command(self):
+        command = ["flatpak-spawn", "--host"]
+        if self.privileged:
+            command.append("pkexec")
+        command += ["flatpak", self.verb, f"--{self.installation}", "-y"]
+        if self.remote != None:
+            command.append(self.remote)
+        return command + self.refs
+
+    def run(self):
+        """Runs the transaction, returns True if flatpak reported success."""
+        if len(self.refs) == 0:
+            return True
+        try:
+            process = subprocess.Popen(self.command(), stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, env=self.new_env)
+        except OSError as e:
+            print("error in transaction.FlatpakTransaction.run:", e)
+            return False
+        # Text mode also splits on the carriage returns flatpak uses to redraw its progress line
+        for line in process.stdout:
+            self.output.append(line)
+            self.parseLine(line)
+        return process.wait() == 0
+
+    def parseLine(self, line):
+        row = self.table_row_pattern.search(line)
+        if row != None:
+            size = float(row.group(3).replace(",", "")) * self.units.get(row.group(4), 1)
+            self.operation_sizes[int(row.group(1))] = int(size)
+            self.operation_ids[int(row.group(1))] = row.group(2)
+            return
+
+        operation = self.operation_pattern.search(line)
+        if operation == None:
+            return
+        is_new_operation = int(operation.group(2)) != self.operation
+        self.operation = int(operation.group(2))
+        self.operation_count = int(operation.group(3))
+        percent = self.percent_pattern.search(line, operation.end())
+        self.operation_percent = int(percent.group(1)) if percent != None else 0
+        self.update(force=is_new_operation)
+
+    def update(self, force=False):
+        now = time.monotonic()
+        if self.started == None:
+            self.started = now
+        progress = self.progress
+
+        current_id = self.operation_ids.get(self.operation, "")
+        progress.current_ref = current_id
+        for ref in self.refs:
+            if current_id != "" and current_id in ref:
+                progress.current_ref = ref
+
+        progress.bytes_total = sum(self.operation_sizes.values())
+        progress.bytes_done = sum(size for number, size in self.operation_sizes.items() if number < self.operation)
+        progress.bytes_done += self.operation_sizes.get(self.operation, 0) * self.operation_percent // 100
+        if progress.bytes_total > 0:
+            progress.fraction = progress.bytes_done / progress.bytes_total
+        elif self.operation_count > 0:
+            # Nothing to download, as when removing, so every operation counts the same
+            progress.fraction = (self.operation - 1 + self.operation_percent / 100) / self.operation_count
+        elapsed = now - self.started
+        if progress.fraction > 0 and elapsed > 1:
+            progress.eta = elapsed / progress.fraction - elapsed
+
+        if self.progress_callback == None:
+            return
+        if not force and now - self.last_update < 1 / self.max_updates_per_second:
+            return
+        self.last_update = now
+        self.progress_callback(progress)
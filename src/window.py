@@ -25,18 +25,20 @@ from gi.repository import Adw, Gdk, Gio, GLib, Gtk
 from .properties_window import PropertiesWindow
 from .filter_window import FilterWindow
 from .common import myUtils
+from .inventory import InventorySnapshot
+from .icon_cache import IconCache
 from .remotes_window import RemotesWindow
 from .downgrade_window import DowngradeWindow
 from .snapshots_window import SnapshotsWindow
 from .const import Config
 
-from .app_row_widget import AppRow
+from .app_row_widget import AppRow, FlatpakItem
 
 @Gtk.Template(resource_path="/io/github/flattool/Warehouse/../data/ui/window.ui")
 class WarehouseWindow(Adw.ApplicationWindow):
     __gtype_name__ = "WarehouseWindow"
     main_window_title = "Warehouse"
-    flatpaks_list_box = Gtk.Template.Child()
+    flatpaks_list_view = Gtk.Template.Child()
     search_entry = Gtk.Template.Child()
     search_button = Gtk.Template.Child()
     search_bar = Gtk.Template.Child()
@@ -70,22 +72,70 @@ class WarehouseWindow(Adw.ApplicationWindow):
     in_batch_mode = False
     should_select_all = False
     host_flatpaks = None
+    inventory = None
     install_success = True
     no_close = None
     re_get_flatpaks = False
     currently_uninstalling = False
-    is_result = False
     is_empty = False
     selected_rows = []
     flatpak_rows = []
     # ^ {Row visibility, Row selected, the row itself, properties, row menu, select, the flatpak row from `flatpak list`, mask label}
     default_filter = [True, False, ["all"], ["all"], ["all"]]
     total_selected = 0
+    is_revalidating = False
+    should_revalidate_again = False
+    installation_change_timeout = 0
 
-    def filter_func(self, row):
-        if (self.search_entry.get_text().lower() in row.get_title().lower()) or (self.search_entry.get_text().lower() in row.get_subtitle().lower()):
-            self.is_result = True
-            return True
+    def filter_func(self, item):
+        search = self.search_entry.get_text().lower()
+        if (search not in item.app_name.lower()) and (search not in item.app_id.lower()):
+            return False
+
+        filter = self.filter_list
+        show_apps = filter[0]
+        show_runtimes = filter[1]
+        filter_install_type = filter[2]
+        filter_remotes_list = filter[3]
+        filter_runtimes_list = filter[4]
+
+        if show_apps == False and item.is_runtime == False:
+            return False
+
+        if show_runtimes == False and item.is_runtime == True:
+            return False
+
+        if (not 'all' in filter_install_type):
+            if not item.install_type in filter_install_type:
+                return False
+
+        if (not 'all' in filter_remotes_list):
+            if not item.origin_remote in filter_remotes_list:
+                return False
+
+        if (not 'all' in filter_runtimes_list):
+            if not item.dependent_runtime in filter_runtimes_list:
+                return False
+
+        return True
+
+    def sort_func(self, item1, item2, _data):
+        name1 = item1.app_name.lower()
+        name2 = item2.app_name.lower()
+        if name1 == name2:
+            return Gtk.Ordering.EQUAL
+        if name1 < name2:
+            return Gtk.Ordering.SMALLER
+        return Gtk.Ordering.LARGER
+
+    def items(self):
+        return [self.flatpaks_store.get_item(i) for i in range(self.flatpaks_store.get_n_items())]
+
+    def visible_items(self):
+        return [self.filter_model.get_item(i) for i in range(self.filter_model.get_n_items())]
+
+    def selected_items(self):
+        return [item for item in self.items() if item.selected]
 
     def removeRow(self, row):
         row[5].set_active(False)
@@ -121,14 +171,10 @@ class WarehouseWindow(Adw.ApplicationWindow):
         id_arr = []
         type_arr = []
         self.currently_uninstalling = True
-        i = 0
-        while(self.flatpaks_list_box.get_row_at_index(i) != None):
-            current = self.flatpaks_list_box.get_row_at_index(i)
-            if current.tickbox.get_active() == True:
-                ref_arr.append(current.app_ref)
-                id_arr.append(current.app_id)
-                type_arr.append(current.install_type)
-            i += 1
+        for current in self.selected_items():
+            ref_arr.append(current.app_ref)
+            id_arr.append(current.app_id)
+            type_arr.append(current.install_type)
         self.set_title(self.main_window_title)
         task = Gio.Task.new(None, None, self.uninstallFlatpakCallback)
         task.run_in_thread(lambda _task, _obj, _data, _cancellable, ref_arr=ref_arr, id_arr=id_arr, type_arr=type_arr, should_trash=should_trash: self.uninstallFlatpakThread(ref_arr, id_arr, type_arr, should_trash))
@@ -156,13 +202,8 @@ class WarehouseWindow(Adw.ApplicationWindow):
         dialog = Adw.MessageDialog.new(self, _("Uninstall Selected Apps?"), _("It will not be possible to use these apps after removal."))
 
         # Check to see if at least one app in the list has user data
-        i = 0
-        while(True):
-            current = self.flatpaks_list_box.get_row_at_index(i)
-            i += 1
-            if(current == None):
-                break
-            if current.tickbox.get_active() and os.path.exists(f"{self.user_data_path}{current.app_id}"):
+        for current in self.selected_items():
+            if os.path.exists(f"{self.user_data_path}{current.app_id}"):
                 has_user_data = True
                 break
 
@@ -204,7 +245,10 @@ class WarehouseWindow(Adw.ApplicationWindow):
         dialog.set_response_appearance("continue", Adw.ResponseAppearance.DESTRUCTIVE)
         Gtk.Window.present(dialog)
 
-    def uninstallButtonHandler(self, row, name, ref, id):
+    def uninstallButtonHandler(self, item):
+        name = item.app_name
+        id = item.app_id
+
         if self.currently_uninstalling:
             self.toast_overlay.add_toast(Adw.Toast.new(_("Cannot uninstall while already uninstalling")))
             return
@@ -228,7 +272,8 @@ class WarehouseWindow(Adw.ApplicationWindow):
             self.search_button.set_sensitive(False)
             self.uninstallFlatpak(should_trash)
 
-        row.tickbox.set_active(True)
+        if not item.selected:
+            item.selected = True
 
         # Create Widgets
         dialog = Adw.MessageDialog.new(self, _("Uninstall {}?").format(name), _("It will not be possible to use {} after removal.").format(name))
@@ -277,40 +322,156 @@ class WarehouseWindow(Adw.ApplicationWindow):
             self.main_stack.set_visible_child(self.main_box)
             self.search_button.set_sensitive(True)
 
-    def create_row(self, index):
-        row = AppRow(self, self.host_flatpaks, index)
-        self.flatpaks_list_box.insert(row, index)
-    
-    def generate_list_of_flatpaks(self):
-        self.host_flatpaks = self.my_utils.getHostFlatpaks()
-        self.dependent_runtimes = self.my_utils.getDependentRuntimes()
+    def create_item(self, index):
+        flatpak_row = self.host_flatpaks[index]
+        is_masked = flatpak_row[2] in self.system_mask_list or flatpak_row[2] in self.user_mask_list
+        has_data = os.path.exists(self.user_data_path + flatpak_row[2])
+        item = FlatpakItem(flatpak_row, self.inventory.keyFor(flatpak_row), self.rowSignature(flatpak_row), is_masked, flatpak_row[13] in self.eol_list, has_data)
+        item.connect("notify::selected", self.rowSelectHandler)
+        self.items_by_key[item.key] = item
+        return item
+
+    def remove_item(self, position):
+        item = self.flatpaks_store.get_item(position)
+        if item.selected:
+            item.selected = False # Keep the selection count right
+        self.items_by_key.pop(item.key, None)
+        self.flatpaks_store.remove(position)
+
+    def rowSignature(self, flatpak_row):
+        # Everything a row displays, so an item only needs replacing when this changes
+        is_masked = flatpak_row[2] in self.system_mask_list or flatpak_row[2] in self.user_mask_list
+        return tuple(flatpak_row) + (is_masked, flatpak_row[13] in self.eol_list)
+
+    def set_inventory(self, snapshot):
+        self.inventory = snapshot
+        self.host_flatpaks = snapshot.flatpaks
+        self.dependent_runtimes = snapshot.dependent_runtimes
+        self.eol_list = snapshot.eol_list
+        self.system_mask_list = snapshot.system_masks
+        self.user_mask_list = snapshot.user_masks
+
+    def generate_list_of_flatpaks(self, snapshot=None):
+        if snapshot == None:
+            snapshot = self.my_utils.getInventory(self.settings.get_string("inventory-backend"))
+            snapshot.save()
+        self.set_inventory(snapshot)
         self.set_title(self.main_window_title)
-        self.eol_list = []
-        self.system_mask_list = self.my_utils.getHostMasks("system")
-        self.user_mask_list = self.my_utils.getHostMasks("user")
 
-        for index in range(len(self.host_flatpaks)):
-            try:
-                if "eol" in self.host_flatpaks[index][12]:
-                    self.eol_list.append(self.host_flatpaks[index][8])
-            except:
-                print("Could not find EOL")
+        if self.inventory.is_empty():
+            self.windowSetEmpty(True)
+            return
+        self.windowSetEmpty(False)
 
-        for index in range(len(self.host_flatpaks)):
-            self.create_row(index)
+        self.items_by_key = {}
+        new_items = [self.create_item(index) for index in range(len(self.host_flatpaks))]
+        self.flatpaks_store.splice(0, self.flatpaks_store.get_n_items(), new_items)
 
         self.applyFilter()
 
-        # self.windowSetEmpty(not self.flatpaks_list_box.get_row_at_index(0))
         self.batchActionsEnable(False)
 
+    def apply_inventory(self, snapshot):
+        """Updates the list to match `snapshot`, only touching items whose refs changed."""
+        self.set_inventory(snapshot)
+        if snapshot.is_empty():
+            for current in self.selected_items():
+                current.selected = False
+            self.flatpaks_store.remove_all()
+            self.items_by_key = {}
+            self.windowSetEmpty(True)
+            return
+        if self.is_empty:
+            self.windowSetEmpty(False)
+
+        new_signatures = {}
+        for flatpak_row in self.host_flatpaks:
+            new_signatures[snapshot.keyFor(flatpak_row)] = self.rowSignature(flatpak_row)
+
+        position = 0
+        while position < self.flatpaks_store.get_n_items():
+            current = self.flatpaks_store.get_item(position)
+            if new_signatures.get(current.key) != current.signature:
+                self.remove_item(position)
+            else:
+                position += 1
+
+        # Both lists are sorted the same way, so kept items are already in order and only gaps need filling
+        for index in range(len(self.host_flatpaks)):
+            current = self.flatpaks_store.get_item(index)
+            if current == None or current.key != snapshot.keyFor(self.host_flatpaks[index]):
+                self.flatpaks_store.insert(index, self.create_item(index))
+
+        self.batchActionsEnable(self.total_selected > 0)
+
+    def revalidateCallback(self, _a, _b):
+        snapshot = self.revalidated_inventory
+        self.is_revalidating = False
+        if self.should_revalidate_again:
+            # Changes were seen during this query, so ask again whatever happens to its result
+            self.should_revalidate_again = False
+            self.revalidate_inventory()
+        if self.currently_uninstalling:
+            return # The uninstall callback refreshes the list when it is done
+        if self.inventory == None:
+            self.generate_list_of_flatpaks(snapshot)
+        else:
+            self.apply_inventory(snapshot)
+
+    def revalidateThread(self, *_args):
+        snapshot = self.my_utils.getInventory(self.settings.get_string("inventory-backend"))
+        snapshot.save()
+        if not snapshot.is_empty():
+            IconCache.pruneThumbnails(snapshot.app_ids)
+        self.revalidated_inventory = snapshot
+
+    def revalidate_inventory(self):
+        if self.is_revalidating:
+            # Changes seen mid-query may not be in its result, so run once more afterwards
+            self.should_revalidate_again = True
+            return
+        self.is_revalidating = True
+        task = Gio.Task.new(None, None, self.revalidateCallback)
+        task.run_in_thread(self.revalidateThread)
+
+    def installationChangedHandler(self, _monitor, _file, _other_file, event):
+        if event in [Gio.FileMonitorEvent.CHANGES_DONE_HINT, Gio.FileMonitorEvent.PRE_UNMOUNT, Gio.FileMonitorEvent.UNMOUNTED]:
+            return
+        # A single transaction touches many files, so wait for things to settle before looking
+        if self.installation_change_timeout != 0:
+            GLib.source_remove(self.installation_change_timeout)
+        self.installation_change_timeout = GLib.timeout_add(750, self.installationChangedTimeout)
+
+    def installationChangedTimeout(self):
+        self.installation_change_timeout = 0
+        if not self.currently_uninstalling:
+            self.revalidate_inventory()
+        return GLib.SOURCE_REMOVE
+
+    def watch_installations(self):
+        self.installation_monitors = []
+        for installation in InventorySnapshot.installation_paths:
+            for path, is_directory in [[".changed", False], ["app", True], ["runtime", True], ["repo/config", False]]:
+                file = Gio.File.new_for_path(os.path.join(installation, path))
+                try:
+                    if is_directory:
+                        monitor = file.monitor_directory(Gio.FileMonitorFlags.WATCH_MOVES, None)
+                    else:
+                        monitor = file.monitor_file(Gio.FileMonitorFlags.NONE, None)
+                except GLib.GError as e:
+                    print(f"error in window.watch_installations: could not watch {file.get_path()}:", e)
+                    continue
+                monitor.connect("changed", self.installationChangedHandler)
+                self.installation_monitors.append(monitor)
+
     def refresh_list_of_flatpaks(self, widget, should_toast):
         if self.currently_uninstalling:
             return
         if should_toast:
             self.toast_overlay.add_toast(Adw.Toast.new(_("List refreshed")))
-        self.flatpaks_list_box.remove_all()
-        self.generate_list_of_flatpaks()
+        snapshot = self.my_utils.getInventory(self.settings.get_string("inventory-backend"))
+        snapshot.save()
+        self.apply_inventory(snapshot)
         self.batch_mode_button.set_active(False)
 
     def openDataFolder(self, path):
@@ -319,7 +480,10 @@ class WarehouseWindow(Adw.ApplicationWindow):
         except GLib.GError:
             self.toast_overlay.add_toast(Adw.Toast.new(_("Could not open folder")))
 
-    def trashData(self, name, id, index):
+    def trashData(self, item):
+        name = item.app_name
+        id = item.app_id
+
         def onContinue(dialog, response):
             if response == "cancel":
                 return
@@ -327,8 +491,7 @@ class WarehouseWindow(Adw.ApplicationWindow):
             if result != 0:
                 self.toast_overlay.add_toast(Adw.Toast.new(_("Could not trash user data")))
                 return
-            self.lookup_action(f"open-data{index}").set_enabled(False)
-            self.lookup_action(f"trash{index}").set_enabled(False)
+            item.has_data = False
             self.toast_overlay.add_toast(Adw.Toast.new(_("Trashed user data")))
 
         dialog = Adw.MessageDialog.new(self,_("Send {}'s User Data to the Trash?").format(name))
@@ -341,16 +504,20 @@ class WarehouseWindow(Adw.ApplicationWindow):
         dialog.present()
 
     def maskFlatpak(self, row):
-        is_masked = row.mask_label.get_visible() # Check the visibility of the mask label to see if the flatpak is masked
+        is_masked = row.masked
         result = []
 
         def callback():
             if result[0] == 1:
                 self.toast_overlay.add_toast(Adw.Toast.new(_("Could not disable updates for {}").format(row.app_name)))
                 return
-            row.set_masked(not is_masked)
-            self.lookup_action(f"mask{row.index}").set_enabled(is_masked)
-            self.lookup_action(f"unmask{row.index}").set_enabled(not is_masked)
+            row.masked = not is_masked
+            masks = self.inventory.getMasks(row.install_type)
+            if is_masked and row.app_id in masks:
+                masks.remove(row.app_id)
+            elif not is_masked:
+                masks.append(row.app_id)
+            row.signature = self.rowSignature(row.flatpak_row)
 
         def onContinue(dialog, response):
             if response == "cancel":
@@ -398,12 +565,12 @@ class WarehouseWindow(Adw.ApplicationWindow):
 
     def batch_mode_handler(self, widget):
         batch_mode = widget.get_active()
-        i = 0
-        while(self.flatpaks_list_box.get_row_at_index(i) != None):
-            current = self.flatpaks_list_box.get_row_at_index(i)
-            current.set_selectable(batch_mode)
-            i += 1
         self.in_batch_mode = batch_mode
+        for row in self.app_rows:
+            row.set_selectable(batch_mode)
+        if not batch_mode:
+            for current in self.selected_items():
+                current.selected = False
         self.batch_mode_bar.set_revealed(batch_mode)
 
         if not widget.get_active():
@@ -420,15 +587,9 @@ class WarehouseWindow(Adw.ApplicationWindow):
             self.batch_uninstall_button.set_sensitive(should_enable)
 
     def onBatchCleanResponse(self, dialog, response, _a):
-        i = 0
-        trashReturnCodes = 0
-        while(True):
-            current = self.flatpaks_list_box.get_row_at_index(i)
-            i += 1
-            if current == None:
-                break
-            if current.tickbox.get_active() == False:
-                continue
+        if response == "cancel":
+            return
+        for current in self.selected_items():
             trash = self.my_utils.trashFolder(f"{self.user_data_path}{current.app_id}")
             if trash == 1:
                 self.toast_overlay.add_toast(Adw.Toast.new(_("{} has no data to trash").format(current.app_name)))
@@ -436,8 +597,7 @@ class WarehouseWindow(Adw.ApplicationWindow):
             if trash == 2:
                 self.toast_overlay.add_toast(Adw.Toast.new(_("Could not trash {}'s data").format(current.app_name)))
                 continue
-            self.lookup_action(f"open-data{current.index}").set_enabled(False) # Disable the Open User Data dropdown option when the data was deleted
-            self.lookup_action(f"trash{current.index}").set_enabled(False) # Disable the Trash User Data dropdown option when the data was deleted
+            current.has_data = False # Disable the Open and Trash User Data dropdown options when the data was deleted
 
     def batchCleanHandler(self, widget):
         dialog = Adw.MessageDialog.new(self, _("Trash Selected Apps' User Data?"), _("Your files and data for these apps will be sent to the trash."))
@@ -452,15 +612,17 @@ class WarehouseWindow(Adw.ApplicationWindow):
         self.set_select_all(widget.get_active())
                 
     def set_select_all(self, should_select_all):
-        i = 0
-        while(self.flatpaks_list_box.get_row_at_index(i) != None):
-            current = self.flatpaks_list_box.get_row_at_index(i)
-            if current.get_visible() == True:
-                current.tickbox.set_active(should_select_all)
-            i += 1
-
-    def rowSelectHandler(self, tickbox):
-        if tickbox.get_active() == True:
+        if should_select_all:
+            to_change = self.visible_items()
+        else:
+            to_change = self.selected_items()
+        for current in to_change:
+            # Every set notifies, so only change items that differ to keep the count right
+            if current.selected != should_select_all:
+                current.selected = should_select_all
+
+    def rowSelectHandler(self, item, _pspec):
+        if item.selected == True:
             self.total_selected += 1
         else:
             self.total_selected -= 1
@@ -473,6 +635,37 @@ class WarehouseWindow(Adw.ApplicationWindow):
             self.set_title(f"{self.total_selected} Selected")
             self.batchActionsEnable(True)
 
+    def create_item_action(self, name, callback):
+        """Add a window action that acts on a single ref of the list.
+
+        The action's target is the item's key, so one action serves every row.
+
+        Args:
+            name: the name of the action
+            callback: the function to be called with the `FlatpakItem`
+              when the action is activated
+        """
+        def activate(_action, key):
+            item = self.items_by_key.get(key.get_string())
+            if item == None:
+                return # The ref went away while its menu was open
+            callback(item)
+
+        action = Gio.SimpleAction.new(name, GLib.VariantType.new("s"))
+        action.connect("activate", activate)
+        self.add_action(action)
+
+    def update_item_actions(self, item):
+        # Called as a row's menu opens, the enabled state then applies to that row only
+        is_app = "runtime" not in item.flatpak_row[12]
+        item.has_data = os.path.exists(self.user_data_path + item.app_id)
+        self.lookup_action("run").set_enabled(is_app)
+        self.lookup_action("snapshot").set_enabled(is_app)
+        self.lookup_action("open-data").set_enabled(item.has_data)
+        self.lookup_action("trash").set_enabled(item.has_data)
+        self.lookup_action("mask").set_enabled(not item.masked)
+        self.lookup_action("unmask").set_enabled(item.masked)
+
     def create_action(self, name, callback, shortcuts=None):
         """Add a window action.
 
@@ -490,40 +683,22 @@ class WarehouseWindow(Adw.ApplicationWindow):
 
     def copyNames(self, widget, _a):
         to_copy = ""
-        i = 0
-        while(True):
-            current = self.flatpaks_list_box.get_row_at_index(i)
-            i += 1
-            if(current == None):
-                break
-            if current.tickbox.get_active():
-                to_copy += f"{current.app_name}\n"
+        for current in self.selected_items():
+            to_copy += f"{current.app_name}\n"
         self.clipboard.set(to_copy)
         self.toast_overlay.add_toast(Adw.Toast.new(_("Copied selected app names")))
 
     def copyIDs(self, widget, _a):
         to_copy = ""
-        i = 0
-        while(True):
-            current = self.flatpaks_list_box.get_row_at_index(i)
-            i += 1
-            if(current == None):
-                break
-            if current.tickbox.get_active():
-                to_copy += f"{current.app_id}\n"
+        for current in self.selected_items():
+            to_copy += f"{current.app_id}\n"
         self.clipboard.set(to_copy)
         self.toast_overlay.add_toast(Adw.Toast.new(_("Copied selected app IDs")))
 
     def copyRefs(self, widget, _a):
         to_copy = ""
-        i = 0
-        while(True):
-            current = self.flatpaks_list_box.get_row_at_index(i)
-            i += 1
-            if(current == None):
-                break
-            if current.tickbox.get_active():
-                to_copy += f"{current.app_ref}\n"
+        for current in self.selected_items():
+            to_copy += f"{current.app_ref}\n"
         self.clipboard.set(to_copy)
         self.toast_overlay.add_toast(Adw.Toast.new(_("Copied selected app refs")))
 
@@ -539,50 +714,30 @@ class WarehouseWindow(Adw.ApplicationWindow):
 
     def applyFilter(self, filter=default_filter):
         self.filter_list = filter
-        show_apps = filter[0]
-        show_runtimes = filter[1]
-        filter_install_type = filter[2]
-        filter_remotes_list = filter[3]
-        filter_runtimes_list = filter[4]
-        total_visible = 0
         self.batch_select_all_button.set_active(False)
         self.set_select_all(False)
+        self.filterRows()
 
-        index = 0
-        while(self.flatpaks_list_box.get_row_at_index(index) != None):
-            current = self.flatpaks_list_box.get_row_at_index(index)
-            visible = True
-
-            if show_apps == False and current.is_runtime == False:
-                visible = False
-            
-            if show_runtimes == False and current.is_runtime == True:
-                visible = False
-
-            if (not 'all' in filter_install_type):
-                if not current.install_type in filter_install_type:
-                    visible = False
-
-            if (not 'all' in filter_remotes_list):
-                if not current.origin_remote in filter_remotes_list:
-                    visible = False
-
-            if (not 'all' in filter_runtimes_list):
-                if not current.dependent_runtime in filter_runtimes_list:
-                    visible = False
-            
-            if visible == True:
-                total_visible += 1
-            
-            current.set_visible(visible)
-            index += 1
-        
-        if total_visible == 0:
-            self.main_stack.set_visible_child(self.no_matches)
-            self.search_button.set_sensitive(False)
-        else:
+    def filterRows(self):
+        self.list_filter.changed(Gtk.FilterChange.DIFFERENT)
+
+    def listChangedHandler(self, *_args):
+        if self.inventory == None or self.is_empty:
+            return
+        if self.filter_model.get_pending() > 0:
+            return # Wait until the incremental filter has seen every item
+        if self.main_stack.get_visible_child() in [self.installing, self.uninstalling]:
+            return
+
+        if self.filter_model.get_n_items() > 0:
             self.main_stack.set_visible_child(self.main_box)
             self.search_button.set_sensitive(True)
+        elif self.search_entry.get_text() != "":
+            self.main_stack.set_visible_child(self.no_results)
+            self.search_button.set_sensitive(False)
+        else:
+            self.main_stack.set_visible_child(self.no_matches)
+            self.search_button.set_sensitive(False)
 
     def installCallback(self, _a, _b):
         self.main_stack.set_visible_child(self.main_box)
@@ -660,15 +815,9 @@ class WarehouseWindow(Adw.ApplicationWindow):
             self.batch_mode_button.set_active(False)
             self.main_stack.set_visible_child(self.no_flatpaks)
             self.search_button.set_sensitive(False)
-        else:
-            self.main_stack.set_visible_child(self.main_box)
-            self.search_button.set_sensitive(True)
+            return
 
-        self.is_result = False
-        self.flatpaks_list_box.invalidate_filter()
-        if self.is_result == False:
-            self.main_stack.set_visible_child(self.no_results)
-            self.search_button.set_sensitive(False)
+        self.filterRows()
 
     def on_change(self, prop, prop2):
         if self.search_bar.get_search_mode() == False:
@@ -677,8 +826,27 @@ class WarehouseWindow(Adw.ApplicationWindow):
                 self.main_stack.set_visible_child(self.no_flatpaks)
                 self.search_button.set_sensitive(False)
             else:
-                self.main_stack.set_visible_child(self.main_box)
-                self.search_button.set_sensitive(True)
+                self.listChangedHandler()
+
+    def rowSetupHandler(self, _factory, list_item):
+        row = AppRow(self)
+        self.app_rows.append(row)
+        list_item.set_child(row)
+
+    def rowBindHandler(self, _factory, list_item):
+        list_item.get_child().bind(list_item.get_item())
+
+    def rowUnbindHandler(self, _factory, list_item):
+        list_item.get_child().unbind()
+
+    def rowTeardownHandler(self, _factory, list_item):
+        self.app_rows.remove(list_item.get_child())
+
+    def rowActivateHandler(self, _list_view, position):
+        if not self.in_batch_mode:
+            return
+        item = self.filter_model.get_item(position)
+        item.selected = not item.selected
 
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
@@ -694,15 +862,34 @@ class WarehouseWindow(Adw.ApplicationWindow):
         self.new_env = dict( os.environ )
         self.new_env['LC_ALL'] = 'C'
 
-        if self.host_flatpaks == [['', '']]:
-            self.windowSetEmpty(True)
-            return
+        # Only the rows on screen exist as widgets; they are recycled as the list scrolls
+        self.app_rows = []
+        self.items_by_key = {}
+        self.flatpaks_store = Gio.ListStore.new(FlatpakItem)
+        self.list_sorter = Gtk.CustomSorter.new(self.sort_func, None)
+        self.sort_model = Gtk.SortListModel(model=self.flatpaks_store, sorter=self.list_sorter, incremental=True)
+        self.list_filter = Gtk.CustomFilter.new(self.filter_func)
+        self.filter_model = Gtk.FilterListModel(model=self.sort_model, filter=self.list_filter, incremental=True)
+        self.filter_model.connect("items-changed", self.listChangedHandler)
+        self.filter_model.connect("notify::pending", self.listChangedHandler)
+
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self.rowSetupHandler)
+        factory.connect("bind", self.rowBindHandler)
+        factory.connect("unbind", self.rowUnbindHandler)
+        factory.connect("teardown", self.rowTeardownHandler)
+        self.flatpaks_list_view.set_factory(factory)
+        self.flatpaks_list_view.set_model(Gtk.NoSelection(model=self.filter_model))
+        self.flatpaks_list_view.connect("activate", self.rowActivateHandler)
+
+        # Paint the last known list straight away, and only ask the host again if the installations changed since
+        cached = InventorySnapshot.load(self.new_env)
+        if cached:
+            self.generate_list_of_flatpaks(cached)
+        if cached == None or cached.is_stale:
+            self.revalidate_inventory()
+        self.watch_installations()
 
-        self.flatpaks_list_box.set_filter_func(self.filter_func)
-        
-        task = Gio.Task()
-        task.run_in_thread(lambda *_: GLib.idle_add(lambda *_: self.generate_list_of_flatpaks()))
-        
         self.search_entry.connect("search-changed", self.on_invalidate)
         self.search_bar.connect_entry(self.search_entry)
         self.search_bar.connect("notify", self.on_change)
@@ -722,6 +909,19 @@ class WarehouseWindow(Adw.ApplicationWindow):
         self.create_action("copy-ids", self.copyIDs)
         self.create_action("copy-refs", self.copyRefs)
 
+        self.create_item_action("copy-name", lambda item: self.copyItem(item.app_name, _("Copied name")))
+        self.create_item_action("copy-id", lambda item: self.copyItem(item.app_id, _("Copied ID")))
+        self.create_item_action("copy-ref", lambda item: self.copyItem(item.app_ref, _("Copied ref")))
+        self.create_item_action("copy-command", lambda item: self.copyItem(f"flatpak run {item.app_ref}", _("Copied launch command")))
+        self.create_item_action("run", lambda item: self.runAppThread(item.app_ref, _("Opened {}").format(item.app_name)))
+        self.create_item_action("uninstall", self.uninstallButtonHandler)
+        self.create_item_action("open-data", lambda item: self.openDataFolder(self.user_data_path + item.app_id))
+        self.create_item_action("trash", self.trashData)
+        self.create_item_action("mask", self.maskFlatpak)
+        self.create_item_action("unmask", self.maskFlatpak)
+        self.create_item_action("snapshot", lambda item: SnapshotsWindow(self, item.flatpak_row).present())
+        self.create_item_action("downgrade", lambda item: DowngradeWindow(self, item.flatpak_row, self.host_flatpaks.index(item.flatpak_row)))
+
         self.filter_button.connect("toggled", self.filterWindowHandler)
 
         file_drop = Gtk.DropTarget.new(Gio.File, Gdk.DragAction.COPY)